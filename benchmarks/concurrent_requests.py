@@ -0,0 +1,142 @@
+"""
+Concurrent request throughput benchmark.
+
+Fires ``--requests`` authenticated ``GET /api/users/me/`` calls, ``--concurrency`` at a time, at the app
+in-process and reports throughput and latency percentiles. Every call runs the users-table lookup in
+``Auth.get_current_user``, so the numbers show how many DB round trips a single worker can overlap.
+
+Postgres is reached through a small TCP proxy that delays every packet by ``--latency-ms`` to emulate the
+network hop between the app and the database:
+
+    python benchmarks/concurrent_requests.py --upstream localhost:5432 --dsn-user postgres --dsn-db postgres
+    python benchmarks/concurrent_requests.py --upstream /tmp/pgdata/.s.PGSQL.5432 --latency-ms 2
+
+Run it from the repository root. ``--driver`` selects the SQLAlchemy driver the app is configured with.
+"""
+import argparse
+import asyncio
+import multiprocessing
+import os
+import socket
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+async def _pipe(reader, writer, delay):
+    try:
+        while data := await reader.read(65536):
+            await asyncio.sleep(delay)
+            writer.write(data)
+            await writer.drain()
+    finally:
+        writer.close()
+
+
+async def _serve_proxy(port, upstream, delay):
+    async def handle(client_reader, client_writer):
+        if ':' in upstream:
+            host, upstream_port = upstream.rsplit(':', 1)
+            server_reader, server_writer = await asyncio.open_connection(host, int(upstream_port))
+        else:
+            server_reader, server_writer = await asyncio.open_unix_connection(upstream)
+        await asyncio.gather(_pipe(client_reader, server_writer, delay), _pipe(server_reader, client_writer, delay),
+                             return_exceptions=True)
+
+    server = await asyncio.start_server(handle, '127.0.0.1', port)
+    async with server:
+        await server.serve_forever()
+
+
+def run_proxy(port, upstream, delay):
+    asyncio.run(_serve_proxy(port, upstream, delay))
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def percentile(values, q):
+    return statistics.quantiles(values, n=100)[q - 1] * 1000
+
+
+async def bench(app, token, requests, concurrency):
+    import httpx
+
+    latencies = []
+    semaphore = asyncio.Semaphore(concurrency)
+    headers = {"Authorization": f"Bearer {token}"}
+
+    async with httpx.AsyncClient(app=app, base_url="http://bench") as client:
+        async def one():
+            async with semaphore:
+                started = time.perf_counter()
+                response = await client.get("/api/users/me/", headers=headers)
+                latencies.append(time.perf_counter() - started)
+                assert response.status_code == 200, response.text
+
+        await one()
+        latencies.clear()
+        started = time.perf_counter()
+        await asyncio.gather(*(one() for _ in range(requests)))
+        elapsed = time.perf_counter() - started
+
+    print(f"requests={requests} concurrency={concurrency} elapsed={elapsed:.2f}s rps={requests / elapsed:.1f} "
+          f"p50={percentile(latencies, 50):.1f}ms p95={percentile(latencies, 95):.1f}ms "
+          f"p99={percentile(latencies, 99):.1f}ms")
+
+
+async def seed(url):
+    from sqlalchemy import delete
+    from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
+
+    from src.database.models import Base, User
+
+    engine = create_async_engine(url)
+    async with engine.begin() as connection:
+        await connection.run_sync(Base.metadata.create_all)
+    async with AsyncSession(engine) as session:
+        await session.execute(delete(User).where(User.email == 'bench@example.com'))
+        session.add(User(username='bench', email='bench@example.com', password='x', avatar='', confirmed=True))
+        await session.commit()
+    await engine.dispose()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--upstream', required=True, help='Postgres host:port or unix socket path')
+    parser.add_argument('--dsn-user', default='postgres')
+    parser.add_argument('--dsn-password', default='')
+    parser.add_argument('--dsn-db', default='postgres')
+    parser.add_argument('--driver', default='asyncpg')
+    parser.add_argument('--latency-ms', type=float, default=1.0)
+    parser.add_argument('--requests', type=int, default=500)
+    parser.add_argument('--concurrency', type=int, default=50)
+    args = parser.parse_args()
+
+    port = free_port()
+    proxy = multiprocessing.Process(target=run_proxy, args=(port, args.upstream, args.latency_ms / 1000),
+                                    daemon=True)
+    proxy.start()
+    time.sleep(0.5)
+
+    credentials = f"{args.dsn_user}:{args.dsn_password}@127.0.0.1:{port}/{args.dsn_db}"
+    os.environ['SQLALCHEMY_DATABASE_URL'] = f"postgresql+{args.driver}://{credentials}"
+
+    from main import app
+    from src.services.auth import auth_service
+
+    asyncio.run(seed(f"postgresql+{args.driver}://{credentials}"))
+    token = asyncio.run(auth_service.create_access_token(data={"sub": 'bench@example.com'}, expires_delta=3600))
+    try:
+        asyncio.run(bench(app, token, args.requests, args.concurrency))
+    finally:
+        proxy.terminate()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,180 @@
+import asyncio
+import json
+import re
+import statistics
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+from unittest.mock import AsyncMock, MagicMock
+
+import pytest
+from fastapi import Request
+from fastapi.testclient import TestClient
+from sqlalchemy import insert, select, update
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+from sqlalchemy.pool import NullPool
+
+from main import app
+from src.database.db import RoutingAsyncSession, get_db, is_read_only
+from src.database.models import Base, Contact, User
+from src.services.cache import user_cache
+from src.services.rate_limit import rate_limiter
+
+SQLITE_URL = "sqlite+aiosqlite:///./bench.db"
+QUERIES = re.compile(r'db;dur=[\d.]+;desc="(\d+) queries"')
+
+
+def pytest_addoption(parser):
+    group = parser.getgroup("benchmark")
+    group.addoption("--bench-db", default=None,
+                    help="async SQLAlchemy URL of a scratch Postgres database (its tables are dropped); "
+                         "SQLite ./bench.db by default")
+    group.addoption("--bench-iterations", type=int, default=50, help="requests per endpoint")
+    group.addoption("--bench-contacts", type=int, default=2000, help="contacts seeded for the benchmark user")
+    group.addoption("--bench-baseline", default=str(Path(__file__).with_name("baseline.json")))
+    group.addoption("--bench-save", action="store_true", help="store this run as the baseline of its backend")
+    group.addoption("--bench-threshold", type=float, default=0.5,
+                    help="allowed p50 regression as a fraction of the baseline")
+    group.addoption("--bench-min-delta-ms", type=float, default=5.0,
+                    help="p50 regressions smaller than this are ignored as noise")
+
+
+class Bench:
+    """
+    Runs requests against one endpoint, records latency and the SQL statement count from the
+    Server-Timing header, and compares the result with the stored baseline of the same backend.
+    """
+
+    def __init__(self, config, backend: str):
+        self.config = config
+        self.backend = backend
+        self.path = Path(config.getoption("--bench-baseline"))
+        baselines = json.loads(self.path.read_text()) if self.path.exists() else {}
+        self.baselines = baselines
+        self.baseline = baselines.get(backend, {})
+        self.results = {}
+
+    def measure(self, name: str, request, iterations: int | None = None) -> dict:
+        iterations = iterations or self.config.getoption("--bench-iterations")
+        latencies, queries = [], []
+        for i in range(iterations):
+            started = time.perf_counter()
+            response = request(i)
+            latencies.append(time.perf_counter() - started)
+            assert response.status_code < 400, response.text
+            queries.append(int(QUERIES.search(response.headers["server-timing"]).group(1)))
+        quantiles = statistics.quantiles(latencies, n=100, method="inclusive")
+        result = {"iterations": iterations, "p50_ms": round(quantiles[49] * 1000, 2),
+                  "p95_ms": round(quantiles[94] * 1000, 2), "p99_ms": round(quantiles[98] * 1000, 2),
+                  "rps": round(iterations / sum(latencies), 1), "queries": max(queries)}
+        self.results[name] = result
+        self.check(name, result)
+        return result
+
+    def check(self, name: str, result: dict):
+        baseline = self.baseline.get(name)
+        if baseline is None or self.config.getoption("--bench-save"):
+            return
+        assert result["queries"] <= baseline["queries"], \
+            f"{name}: {result['queries']} SQL statements per request, baseline {baseline['queries']}"
+        # the median is compared: with a few dozen samples p95 and p99 are single outliers on a busy machine
+        limit = max(baseline["p50_ms"] * (1 + self.config.getoption("--bench-threshold")),
+                    baseline["p50_ms"] + self.config.getoption("--bench-min-delta-ms"))
+        assert result["p50_ms"] <= limit, f"{name}: p50 {result['p50_ms']} ms, baseline {baseline['p50_ms']} ms"
+
+    def save(self):
+        self.baselines[self.backend] = dict(sorted({**self.baseline, **self.results}.items()))
+        self.path.write_text(json.dumps(self.baselines, indent=2, sort_keys=True) + "\n")
+
+
+bench_key = pytest.StashKey[Bench]()
+
+
+@pytest.fixture(scope="session")
+def bench_engine(request):
+    url = request.config.getoption("--bench-db") or SQLITE_URL
+    engine = create_async_engine(url, poolclass=NullPool)
+
+    async def reset():
+        async with engine.begin() as connection:
+            await connection.run_sync(Base.metadata.drop_all)
+            await connection.run_sync(Base.metadata.create_all)
+
+    asyncio.run(reset())
+    yield engine
+    asyncio.run(engine.dispose())
+
+
+@pytest.fixture(scope="session")
+def bench(request, bench_engine):
+    bench = Bench(request.config, bench_engine.dialect.name)
+    request.config.stash[bench_key] = bench
+    return bench
+
+
+@pytest.fixture(scope="session")
+def client(bench_engine):
+    # the session class of the app, without replicas
+    sessions = async_sessionmaker(bind=bench_engine, class_=RoutingAsyncSession, autoflush=False,
+                                  expire_on_commit=False)
+
+    async def override_get_db(request: Request):
+        db = sessions()
+        if is_read_only(request):
+            db.info["read_only"] = True
+        try:
+            yield db
+        finally:
+            await db.close()
+
+    user_cache.local.clear()
+    app.dependency_overrides[get_db] = override_get_db
+    with pytest.MonkeyPatch.context() as mp:
+        mp.setattr(rate_limiter, "acquire", AsyncMock(return_value=0.0))
+        # there is no Redis behind the user cache here: an in-process entry expiring mid-run would add a user
+        # lookup to whichever request came next and make the statement counts depend on the machine's speed
+        mp.setattr(user_cache, "local_ttl", 3600.0)
+        mp.setattr("src.routes.auth.send_email", MagicMock())
+        mp.setattr("src.routes.users.cloudinary.uploader.upload", MagicMock(return_value={"version": 1}))
+        yield TestClient(app)
+    app.dependency_overrides.pop(get_db, None)
+
+
+@pytest.fixture(scope="session")
+def bench_user(request, client, bench_engine):
+    """
+    A confirmed user with --bench-contacts contacts, birthdays spread over the year, and fresh tokens.
+    """
+    body = {"username": "bench", "email": "bench@example.com", "password": "benchmark"}
+    client.post("/api/auth/signup", json=body)
+    count = request.config.getoption("--bench-contacts")
+
+    async def seed():
+        async with bench_engine.begin() as connection:
+            await connection.execute(update(User).where(User.email == body["email"]).values(confirmed=True))
+            user_id = await connection.scalar(select(User.id).where(User.email == body["email"]))
+            await connection.execute(insert(Contact), [
+                dict(firstname=f"First{i}", lastname=f"Last{i}", email=f"contact{i}@example.com", phone=f"+380{i:09}",
+                     birthday=datetime(1970, 1, 1) + timedelta(days=i * 7 % 365, hours=i), description="",
+                     user_id=user_id)
+                for i in range(count)])
+
+    asyncio.run(seed())
+    tokens = client.post("/api/auth/login", data={"username": body["email"], "password": body["password"]}).json()
+    return {**body, **tokens, "headers": {"Authorization": f"Bearer {tokens['access_token']}"}}
+
+
+def pytest_terminal_summary(terminalreporter, config):
+    bench = config.stash.get(bench_key, None)
+    if bench is None or not bench.results:
+        return
+    terminalreporter.section(f"endpoint benchmarks ({bench.backend})")
+    terminalreporter.write_line(f"{'endpoint':<32}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'req/s':>10}"
+                                f"{'queries':>9}{'base p50':>10}")
+    for name, result in bench.results.items():
+        baseline = bench.baseline.get(name, {}).get("p50_ms", "-")
+        terminalreporter.write_line(f"{name:<32}{result['p50_ms']:>10}{result['p95_ms']:>10}{result['p99_ms']:>10}"
+                                    f"{result['rps']:>10}{result['queries']:>9}{baseline:>10}")
+    if config.getoption("--bench-save"):
+        bench.save()
+        terminalreporter.write_line(f"baseline saved to {bench.path}")
@@ -0,0 +1,113 @@
+"""
+Memory and time per contact read.
+
+Seeds ``--rows`` synthetic contacts for one user and reads all of them in one page, once as full ``Contact`` ORM
+entities (identity map, change tracking and relationship state included) and once through
+``repository.contacts.get_contacts``. For each path it reports the time of the read, the memory still held by the
+result and the session afterwards and the peak allocated while reading, both measured with tracemalloc in separate
+runs from the timed ones:
+
+    python benchmarks/contact_reads.py --rows 10000
+    python benchmarks/contact_reads.py --url postgresql+asyncpg://postgres@/postgres?host=/tmp/pgdata
+
+Without ``--url`` a temporary SQLite database is used. Run it from the repository root; the contacts and users
+tables of the target database are dropped first.
+"""
+import argparse
+import asyncio
+import gc
+import logging
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+async def seed(engine, rows):
+    from sqlalchemy import insert
+
+    from src.database.models import Base, Contact, User
+
+    async with engine.begin() as connection:
+        await connection.run_sync(Base.metadata.drop_all)
+        await connection.run_sync(Base.metadata.create_all)
+        await connection.execute(insert(User).values(id=1, username="bench", email="bench@example.com",
+                                                     password="x", confirmed=True))
+        now = datetime.now()
+        await connection.execute(insert(Contact), [
+            dict(firstname=f"First{i}", lastname=f"Last{i}", email=f"contact{i}@example.com", phone=f"+380{i:09}",
+                 birthday=datetime(1970, 1, 1) + timedelta(days=i % 365), description=f"Synthetic contact number {i}",
+                 created_at=now, updated_at=now, user_id=1)
+            for i in range(rows)])
+
+
+async def entities(db, user, rows):
+    from sqlalchemy import select
+
+    from src.database.models import Contact
+
+    return (await db.scalars(select(Contact).where(Contact.user_id == user.id).order_by(Contact.id)
+                             .limit(rows))).all()
+
+
+async def repository(db, user, rows):
+    from src.repository.contacts import get_contacts
+
+    return await get_contacts(0, rows, user, db)
+
+
+async def measure(engine, read, rows, repeat):
+    from src.database.db import DBSession
+    from src.database.models import User
+
+    user = User(id=1)
+    timings, retained, peaks = [], [], []
+    for _ in range(repeat):
+        async with DBSession(bind=engine) as db:
+            # a first statement outside of the measurement opens the connection
+            await read(db, user, 1)
+            started = time.perf_counter()
+            await read(db, user, rows)
+            timings.append(time.perf_counter() - started)
+        async with DBSession(bind=engine) as db:
+            await read(db, user, 1)
+            gc.collect()
+            tracemalloc.start()
+            result = await read(db, user, rows)
+            gc.collect()
+            current, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            assert len(result) == rows
+            retained.append(current)
+            peaks.append(peak)
+            del result
+    return min(timings), min(retained), min(peaks)
+
+
+async def main(url, rows, repeat):
+    from sqlalchemy.ext.asyncio import create_async_engine
+
+    engine = create_async_engine(url)
+    await seed(engine, rows)
+    print(f"{rows} contacts from {engine.dialect.name}")
+    for label, read in (("ORM entities", entities), ("get_contacts", repository)):
+        elapsed, retained, peak = await measure(engine, read, rows, repeat)
+        print(f"{label:>14}: {elapsed * 1000:8.1f} ms  retained={retained / 2 ** 20:6.2f} MiB"
+              f"  peak={peak / 2 ** 20:6.2f} MiB  ({retained / rows:.0f} bytes per contact)")
+    await engine.dispose()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--url', help='async SQLAlchemy URL of a scratch database')
+    parser.add_argument('--rows', type=int, default=10000)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+    # every full read is a slow query for src.database.instrumentation
+    logging.disable(logging.WARNING)
+    with tempfile.TemporaryDirectory() as directory:
+        asyncio.run(main(args.url or f"sqlite+aiosqlite:///{directory}/reads.db", args.rows, args.repeat))
@@ -0,0 +1,138 @@
+"""
+Contact export benchmark.
+
+Seeds ``--rows`` synthetic contacts for one user in Postgres (generate_series, so seeding takes seconds) and
+compares reading all of them the way a client had to before, building every ORM object and ``ContactResponse``
+in memory, with streaming ``GET /api/contacts/export``. Each mode runs in its own process and reports wall time,
+bytes produced and the peak resident set size of the process:
+
+    python benchmarks/export_contacts.py --url postgresql+asyncpg://postgres@/postgres?host=/tmp/pgdata
+
+Run it from the repository root; the contacts and users tables of the target database are dropped first.
+"""
+import argparse
+import asyncio
+import logging
+import os
+import sys
+import time
+import resource
+import subprocess
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def measure(label, func):
+    started = time.perf_counter()
+    size = asyncio.run(func())
+    elapsed = time.perf_counter() - started
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    print(f"{label}: elapsed={elapsed:.2f}s bytes={size} peak_rss={peak:.0f}MiB", flush=True)
+
+
+async def seed(url, rows):
+    from sqlalchemy import text
+    from sqlalchemy.ext.asyncio import create_async_engine
+
+    from src.database.models import Base
+
+    engine = create_async_engine(url)
+    async with engine.begin() as connection:
+        await connection.run_sync(Base.metadata.drop_all)
+        await connection.run_sync(Base.metadata.create_all)
+        await connection.execute(text(
+            "INSERT INTO users (username, email, password, confirmed) VALUES ('bench', 'bench@example.com', 'x', true)"))
+        await connection.execute(text(
+            "INSERT INTO contacts (firstname, lastname, email, phone, birthday, description, created_at, updated_at,"
+            " user_id) SELECT 'First' || i, 'Last' || i, 'contact' || i || '@example.com', '+380' || i,"
+            " timestamp '1970-01-01' + i * interval '1 hour', 'Synthetic contact number ' || i, now(), now(), 1"
+            " FROM generate_series(1, :rows) AS i"), {"rows": rows})
+        await connection.execute(text("ANALYZE contacts"))
+    await engine.dispose()
+
+
+async def load_all():
+    from sqlalchemy import select
+
+    from src.database.db import DBSession, engine
+    from src.database.models import Contact
+    from src.schemas import ContactResponse
+
+    async with DBSession() as db:
+        contacts = (await db.scalars(select(Contact).where(Contact.user_id == 1).order_by(Contact.id))).all()
+        body = "[" + ",".join(ContactResponse.from_orm(contact).json() for contact in contacts) + "]"
+    await engine.dispose()
+    return len(body)
+
+
+async def stream(app, token, export_format):
+    from src.database.db import engine
+
+    # drive the ASGI app directly: an in-process HTTP client would buffer the whole body and hide the server's memory
+    size = 0
+    status = None
+    scope = {"type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": "GET", "scheme": "http",
+             "path": "/api/contacts/export", "raw_path": b"/api/contacts/export",
+             "query_string": f"format={export_format}".encode(), "root_path": "",
+             "headers": [(b"host", b"bench"), (b"authorization", f"Bearer {token}".encode())],
+             "client": ("127.0.0.1", 1), "server": ("bench", 80)}
+
+    requested = False
+    finished = asyncio.Event()
+
+    async def receive():
+        nonlocal requested
+        if not requested:
+            requested = True
+            return {"type": "http.request", "body": b"", "more_body": False}
+        await finished.wait()
+        return {"type": "http.disconnect"}
+
+    async def send(message):
+        nonlocal size, status
+        if message["type"] == "http.response.start":
+            status = message["status"]
+        elif message["type"] == "http.response.body":
+            size += len(message.get("body", b""))
+            if not message.get("more_body", False):
+                finished.set()
+
+    await app(scope, receive, send)
+    assert status == 200, status
+    await engine.dispose()
+    return size
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--url', required=True, help='SQLAlchemy URL of a scratch Postgres database')
+    parser.add_argument('--rows', type=int, default=1_000_000)
+    parser.add_argument('--mode', choices=['orm', 'ndjson', 'csv'], help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.mode is None:
+        asyncio.run(seed(args.url, args.rows))
+        for mode in ('orm', 'ndjson', 'csv'):
+            subprocess.run([sys.executable, __file__, '--url', args.url, '--mode', mode], check=True)
+        return
+
+    os.environ['SQLALCHEMY_DATABASE_URL'] = args.url
+    logging.disable(logging.INFO)
+
+    from unittest.mock import AsyncMock
+
+    from main import app
+    from src.services.auth import auth_service
+    from src.services.rate_limit import rate_limiter
+
+    rate_limiter.acquire = AsyncMock(return_value=0.0)
+    token = asyncio.run(auth_service.create_access_token(data={"sub": 'bench@example.com'}, expires_delta=3600))
+
+    if args.mode == 'orm':
+        measure("ORM + ContactResponse", load_all)
+    else:
+        measure(f"export {args.mode}", lambda: stream(app, token, args.mode))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,104 @@
+"""
+Event-loop responsiveness while bcrypt work is in flight.
+
+Runs ``--logins`` concurrent login loops against the app in-process for ``--seconds`` while ``--probes`` other
+clients poll ``GET /api/users/me/`` every ``--interval-ms`` (served from the user cache, so it does no password
+or DB work) and reports the probe latency percentiles and the login rate. Each run is done twice: with bcrypt called inline on the event
+loop, as the handlers used to do, and through the bounded password pool in ``Auth.run_password_job``.
+
+    python benchmarks/password_hashing.py --logins 8 --probes 10 --seconds 5 --interval-ms 10
+
+Uses a throwaway SQLite database (aiosqlite); run it from the repository root.
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def percentile(values, q):
+    return statistics.quantiles(values, n=100)[q - 1] * 1000
+
+
+async def inline_password_job(func, *args):
+    return func(*args)
+
+
+async def run(app, token, logins, probes, seconds, interval):
+    import httpx
+
+    probe_latencies = []
+    login_count = 0
+    deadline = time.perf_counter() + seconds
+
+    async with httpx.AsyncClient(app=app, base_url="http://bench") as client:
+        async def login_loop():
+            nonlocal login_count
+            while time.perf_counter() < deadline:
+                response = await client.post("/api/auth/login",
+                                             data={"username": "bench@example.com", "password": "benchmark"})
+                if response.status_code == 200:
+                    login_count += 1
+
+        async def probe_loop():
+            headers = {"Authorization": f"Bearer {token}"}
+            while time.perf_counter() < deadline:
+                started = time.perf_counter()
+                response = await client.get("/api/users/me/", headers=headers)
+                probe_latencies.append(time.perf_counter() - started)
+                assert response.status_code == 200, response.text
+                await asyncio.sleep(interval)
+
+        await asyncio.gather(*(login_loop() for _ in range(logins)), *(probe_loop() for _ in range(probes)))
+
+    return (f"logins/s={login_count / seconds:.1f} probes={len(probe_latencies)} "
+            f"p50={percentile(probe_latencies, 50):.1f}ms p95={percentile(probe_latencies, 95):.1f}ms "
+            f"p99={percentile(probe_latencies, 99):.1f}ms")
+
+
+async def seed():
+    from passlib.context import CryptContext
+
+    from src.conf.config import settings
+    from src.database.db import engine, DBSession
+    from src.database.models import Base, User
+
+    async with engine.begin() as connection:
+        await connection.run_sync(Base.metadata.create_all)
+    password = CryptContext(schemes=["bcrypt"], bcrypt__rounds=settings.bcrypt_rounds).hash("benchmark")
+    async with DBSession() as session:
+        session.add(User(username='bench', email='bench@example.com', password=password, avatar='', confirmed=True))
+        await session.commit()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--logins', type=int, default=8)
+    parser.add_argument('--probes', type=int, default=10)
+    parser.add_argument('--seconds', type=float, default=5)
+    parser.add_argument('--interval-ms', type=float, default=10)
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp()
+    os.environ['SQLALCHEMY_DATABASE_URL'] = f"sqlite+aiosqlite:///{directory}/bench.db"
+
+    from main import app
+    from src.services.auth import auth_service
+
+    asyncio.run(seed())
+    token = asyncio.run(auth_service.create_access_token(data={"sub": 'bench@example.com'}, expires_delta=3600))
+
+    pooled = auth_service.run_password_job
+    auth_service.run_password_job = inline_password_job
+    print("inline bcrypt: ", asyncio.run(run(app, token, args.logins, args.probes, args.seconds, args.interval_ms / 1000)))
+    auth_service.run_password_job = pooled
+    print("password pool: ", asyncio.run(run(app, token, args.logins, args.probes, args.seconds, args.interval_ms / 1000)))
+
+
+if __name__ == '__main__':
+    main()
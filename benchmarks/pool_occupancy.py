@@ -0,0 +1,177 @@
+"""
+Connection pool occupancy under a mixed load.
+
+Runs ``--requests`` requests, ``--concurrency`` at a time, at the app in-process, with its own session factory and
+pool (``get_db`` is not overridden) and a fake Redis for the caches and rate limits. The requests are a mix of what
+a contacts client does: single contacts (response cache misses and hits), revalidations answered 304, rate-limited
+lists, searches, /users/me, partial updates and requests failing validation. Pool checkouts and checkins are
+recorded to report how often a connection was checked out, how long it was held, and how many were held on average
+and at most. ``--send-ms`` delays sending every response body, like a slow client or network would:
+
+    python benchmarks/pool_occupancy.py --send-ms 20
+    python benchmarks/pool_occupancy.py --url postgresql+asyncpg://postgres@/postgres?host=/tmp/pgdata
+
+Without ``--url`` a temporary SQLite database is used. Run it from the repository root; the contacts and users tables
+of the target database are dropped first. Needs fakeredis (with lupa for the rate limiter's script).
+"""
+import argparse
+import asyncio
+import logging
+import os
+import random
+import sys
+import tempfile
+import time
+from collections import Counter
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+class PoolMonitor:
+
+    def __init__(self, pool):
+        from sqlalchemy import event
+
+        self.checked_out = {}
+        self.checkouts = 0
+        self.held = 0.0
+        self.peak = 0
+        event.listen(pool, "checkout", self.checkout)
+        event.listen(pool, "checkin", self.checkin)
+
+    def checkout(self, dbapi_connection, connection_record, connection_proxy):
+        self.checked_out[id(connection_record)] = time.perf_counter()
+        self.checkouts += 1
+        self.peak = max(self.peak, len(self.checked_out))
+
+    def checkin(self, dbapi_connection, connection_record):
+        started = self.checked_out.pop(id(connection_record), None)
+        if started is not None:
+            self.held += time.perf_counter() - started
+
+
+def slow_send(app, delay):
+    async def wrapped(scope, receive, send):
+        async def delayed(message):
+            if message["type"] == "http.response.body":
+                await asyncio.sleep(delay)
+            await send(message)
+
+        await app(scope, receive, delayed)
+
+    return wrapped
+
+
+async def seed(url, users, contacts):
+    from sqlalchemy import insert
+    from sqlalchemy.ext.asyncio import create_async_engine
+
+    from src.database.models import Base, Contact, User
+
+    engine = create_async_engine(url)
+    async with engine.begin() as connection:
+        await connection.run_sync(Base.metadata.drop_all)
+        await connection.run_sync(Base.metadata.create_all)
+        await connection.execute(insert(User), [dict(id=user, username=f"user{user}", email=f"user{user}@example.com",
+                                                     password="x", avatar="", confirmed=True)
+                                                for user in range(1, users + 1)])
+        await connection.execute(insert(Contact), [
+            dict(id=user * contacts + i, firstname=f"First{i}", lastname=f"Last{user}", email=f"c{user}-{i}@example.com",
+                 phone=f"+380{user:04}{i:05}", description=f"Contact {i} of user {user}", user_id=user)
+            for user in range(1, users + 1) for i in range(contacts)])
+    await engine.dispose()
+
+
+async def bench(app, tokens, contacts, requests, concurrency):
+    import httpx
+
+    etags = {}
+    statuses = Counter()
+    semaphore = asyncio.Semaphore(concurrency)
+    rng = random.Random(1)
+
+    async def one(kind, user, contact_id):
+        headers = {"Authorization": f"Bearer {tokens[user]}"}
+        path = f"/api/contacts/{contact_id}"
+        async with semaphore:
+            if kind == "contact":
+                response = await client.get(path, headers=headers)
+                etags[path] = response.headers.get("etag")
+            elif kind == "revalidate":
+                response = await client.get(path, headers={**headers, "If-None-Match": etags.get(path) or "*"})
+            elif kind == "list":
+                response = await client.get("/api/contacts/", headers=headers)
+            elif kind == "search":
+                response = await client.get("/api/contacts/search", params={"q": f"first{contact_id % 10}"},
+                                            headers=headers)
+            elif kind == "me":
+                response = await client.get("/api/users/me/", headers=headers)
+            elif kind == "patch":
+                response = await client.patch(path, json={"description": f"patched {time.time_ns()}"},
+                                              headers=headers)
+            else:
+                response = await client.get("/api/contacts/not-a-number", headers=headers)
+        statuses[f"{kind} {response.status_code}"] += 1
+
+    kinds = ["contact"] * 30 + ["revalidate"] * 15 + ["list"] * 15 + ["search"] * 10 + ["me"] * 10 \
+        + ["patch"] * 10 + ["invalid"] * 10
+    plan = []
+    for _ in range(requests):
+        user = rng.randrange(1, len(tokens) + 1)
+        plan.append((rng.choice(kinds), user, user * contacts + rng.randrange(contacts)))
+    async with httpx.AsyncClient(app=app, base_url="http://bench") as client:
+        started = time.perf_counter()
+        await asyncio.gather(*(one(*request) for request in plan))
+        elapsed = time.perf_counter() - started
+    return elapsed, statuses
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--url', help='async SQLAlchemy URL of a scratch database')
+    parser.add_argument('--requests', type=int, default=3000)
+    parser.add_argument('--concurrency', type=int, default=50)
+    parser.add_argument('--users', type=int, default=20)
+    parser.add_argument('--contacts', type=int, default=100)
+    parser.add_argument('--send-ms', type=float, default=0.0, help='time to send a response body to the client')
+    args = parser.parse_args()
+    logging.disable(logging.WARNING)
+
+    with tempfile.TemporaryDirectory() as directory:
+        url = args.url or f"sqlite+aiosqlite:///{directory}/pool.db"
+        os.environ['SQLALCHEMY_DATABASE_URL'] = url
+        os.environ.setdefault('CONTACT_SEARCH_TRIGRAM', 'false')
+
+        from fakeredis import aioredis
+
+        from main import app
+        from src.database import redis_db
+        from src.database.db import engine
+        from src.services.auth import auth_service
+
+        asyncio.run(seed(url, args.users, args.contacts))
+        tokens = {user: asyncio.run(auth_service.create_access_token(data={"sub": f"user{user}@example.com"},
+                                                                     expires_delta=3600))
+                  for user in range(1, args.users + 1)}
+        monitor = PoolMonitor(engine.sync_engine.pool)
+
+        async def run():
+            redis_db.redis_client = aioredis.FakeRedis(decode_responses=True)
+            try:
+                return await bench(slow_send(app, args.send_ms / 1000) if args.send_ms else app, tokens,
+                                   args.contacts, args.requests, args.concurrency)
+            finally:
+                await engine.dispose()
+
+        elapsed, statuses = asyncio.run(run())
+
+    print(f"{args.requests} requests, concurrency {args.concurrency}, send {args.send_ms}ms, {engine.dialect.name}: "
+          f"{elapsed:.2f}s, {args.requests / elapsed:.0f} rps")
+    print("responses: " + ", ".join(f"{name}: {count}" for name, count in sorted(statuses.items())))
+    print(f"checkouts={monitor.checkouts} ({monitor.checkouts / args.requests:.2f} per request)  "
+          f"held per checkout={monitor.held / max(monitor.checkouts, 1) * 1000:.2f}ms  "
+          f"mean checked out={monitor.held / elapsed:.2f}  peak={monitor.peak}")
+
+
+if __name__ == '__main__':
+    main()
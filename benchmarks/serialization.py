@@ -0,0 +1,70 @@
+"""
+Cost of turning a page of contacts into a JSON response body.
+
+Compares, for pages of ``--sizes`` contacts, the path list responses used to take (validating every entity into
+``ContactResponse`` through ``orm_mode``, ``jsonable_encoder`` and the stdlib ``json`` module), the same validation
+encoded with orjson, as FastAPI does with ``ORJSONResponse`` as the default response class, and the trusted fast
+path of ``src.services.serialization`` (rows copied into dicts, encoded with orjson):
+
+    python benchmarks/serialization.py --sizes 10 100 1000
+
+The contacts are built in memory, so only serialization is measured; run it from the repository root.
+"""
+import argparse
+import json
+import os
+import sys
+import timeit
+from datetime import datetime, timedelta
+from typing import List
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def make_contacts(count):
+    from src.database.models import Contact
+
+    return [Contact(id=i, firstname=f"First{i}", lastname=f"Last{i}", email=f"contact{i}@example.com",
+                    phone=f"+380{i:09}", birthday=datetime(1970, 1, 1) + timedelta(days=i % 365),
+                    description=f"Synthetic contact number {i}", created_at=datetime.now(), updated_at=datetime.now(),
+                    user_id=1)
+            for i in range(count)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10, 100, 1000])
+    parser.add_argument('--seconds', type=float, default=1.0, help='approximate time spent per measurement')
+    args = parser.parse_args()
+
+    import orjson
+    from fastapi.encoders import jsonable_encoder
+    from pydantic import parse_obj_as
+
+    from src.schemas import ContactResponse
+    from src.services.serialization import contact_dicts, dumps
+
+    paths = {
+        "pydantic + json": lambda contacts: json.dumps(
+            jsonable_encoder(parse_obj_as(List[ContactResponse], contacts))).encode(),
+        "pydantic + orjson": lambda contacts: orjson.dumps(
+            jsonable_encoder(parse_obj_as(List[ContactResponse], contacts))),
+        "fast path (orjson)": lambda contacts: dumps(contact_dicts(contacts)),
+    }
+    print(f"{'contacts':>8}  " + "".join(f"{name:>22}" for name in paths) + "  (ms per page)")
+    for size in args.sizes:
+        contacts = make_contacts(size)
+        bodies = [json.loads(path(contacts)) for path in paths.values()]
+        assert all(body == bodies[0] for body in bodies), "the paths produce different JSON"
+        timings = []
+        for path in paths.values():
+            timer = timeit.Timer(lambda: path(contacts))
+            number, elapsed = timer.autorange()
+            repeat = max(1, int(args.seconds / elapsed))
+            timings.append(min(timer.repeat(repeat=repeat, number=number)) / number * 1000)
+        print(f"{size:>8}  " + "".join(f"{timing:>22.3f}" for timing in timings)
+              + f"  {timings[0] / timings[-1]:.1f}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,109 @@
+"""
+Endpoint benchmarks: latency percentiles, throughput and SQL statements per request, checked against
+benchmarks/baseline.json. Not part of the test suite, run them explicitly:
+
+    python -m pytest benchmarks -q
+    python -m pytest benchmarks -q --bench-save
+    python -m pytest benchmarks -q --bench-db postgresql+asyncpg://postgres@localhost/bench
+
+Password endpoints (signup, login) run a tenth of --bench-iterations requests, bcrypt dominates them.
+
+The statement counts in the baseline hold on any machine. The p50_ms values only mean something on the host that
+recorded them: elsewhere, record a local baseline on the commit to compare against first,
+
+    python -m pytest benchmarks -q --bench-save --bench-baseline local.json
+    python -m pytest benchmarks -q --bench-baseline local.json
+"""
+import io
+
+CONTACT = {"firstname": "Bench", "lastname": "Mark", "phone": "+380000000000", "birthday": "1990-05-17T00:00:00",
+           "description": "Benchmark contact"}
+
+
+def password_iterations(request):
+    return max(3, request.config.getoption("--bench-iterations") // 10)
+
+
+def test_signup(request, client, bench):
+    bench.measure("POST /api/auth/signup", lambda i: client.post("/api/auth/signup", json={
+        "username": f"signup{i}", "email": f"signup{i}@example.com", "password": "benchmark"}),
+        password_iterations(request))
+
+
+def test_login(request, client, bench, bench_user):
+    bench.measure("POST /api/auth/login", lambda i: client.post("/api/auth/login", data={
+        "username": bench_user["email"], "password": bench_user["password"]}), password_iterations(request))
+    bench_user["refresh_token"] = client.post("/api/auth/login", data={
+        "username": bench_user["email"], "password": bench_user["password"]}).json()["refresh_token"]
+
+
+def test_refresh_token(client, bench, bench_user):
+    def refresh(i):
+        response = client.get("/api/auth/refresh_token",
+                              headers={"Authorization": f"Bearer {bench_user['refresh_token']}"})
+        bench_user["refresh_token"] = response.json().get("refresh_token", bench_user["refresh_token"])
+        return response
+
+    bench.measure("GET /api/auth/refresh_token", refresh)
+
+
+def test_users_me(client, bench, bench_user):
+    bench.measure("GET /api/users/me/", lambda i: client.get("/api/users/me/", headers=bench_user["headers"]))
+
+
+def test_update_avatar(client, bench, bench_user):
+    bench.measure("PATCH /api/users/avatar", lambda i: client.patch(
+        "/api/users/avatar", files={"file": ("avatar.png", io.BytesIO(b"\x89PNG"), "image/png")},
+        headers=bench_user["headers"]))
+
+
+def test_contacts_crud(client, bench, bench_user):
+    headers = bench_user["headers"]
+    created = []
+
+    def create(i):
+        response = client.post("/api/contacts/", headers=headers,
+                               json={**CONTACT, "email": f"crud{i}@example.com", "phone": f"+381{i:09}"})
+        created.append(response.json()["id"])
+        return response
+
+    bench.measure("POST /api/contacts/", create)
+    bench.measure("GET /api/contacts/{id}", lambda i: client.get(f"/api/contacts/{created[i]}", headers=headers))
+    bench.measure("PUT /api/contacts/{id}", lambda i: client.put(
+        f"/api/contacts/{created[i]}", headers=headers,
+        json={**CONTACT, "email": f"crud{i}@example.com", "phone": f"+381{i:09}", "description": "updated"}))
+    bench.measure("PATCH /api/contacts/{id}", lambda i: client.patch(
+        f"/api/contacts/{created[i]}", headers=headers, json={"description": "patched"}))
+    bench.measure("DELETE /api/contacts/{id}", lambda i: client.delete(f"/api/contacts/{created[i]}",
+                                                                        headers=headers))
+
+
+def test_list_contacts(client, bench, bench_user):
+    headers = bench_user["headers"]
+    cursor = {}
+
+    def page(i):
+        response = client.get("/api/contacts/", params={"limit": 50, **cursor}, headers=headers)
+        next_cursor = response.json()["next_cursor"]
+        cursor.clear()
+        if next_cursor:
+            cursor["cursor"] = next_cursor
+        return response
+
+    bench.measure("GET /api/contacts/", page)
+
+
+def test_search_contacts(client, bench, bench_user):
+    bench.measure("GET /api/contacts/query/", lambda i: client.get(
+        "/api/contacts/query/", params={"firstname": f"first{i % 10}", "email": "contact1"},
+        headers=bench_user["headers"]))
+
+
+def test_full_text_search(client, bench, bench_user):
+    bench.measure("GET /api/contacts/search", lambda i: client.get(
+        "/api/contacts/search", params={"q": f"first{i * 37 % 2000}"}, headers=bench_user["headers"]))
+
+
+def test_birthdays(client, bench, bench_user):
+    bench.measure("GET /api/contacts/birthdays/", lambda i: client.get(
+        "/api/contacts/birthdays/", params={"days": 7 + i % 30}, headers=bench_user["headers"]))
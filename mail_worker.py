@@ -0,0 +1,25 @@
+"""
+Outbound mail worker: sends the confirmation emails queued by the web app.
+
+    python mail_worker.py
+
+Run one or more next to the web workers; they share the Redis outbox stream.
+"""
+import asyncio
+import logging
+
+from src.database.redis_db import init_redis, close_redis
+from src.services.mail_queue import MailWorker
+
+
+async def main():
+    redis = await init_redis()
+    try:
+        await MailWorker(redis).run()
+    finally:
+        await close_redis()
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+    asyncio.run(main())
@@ -1,20 +1,26 @@
+import asyncio
 import pathlib
 
-import redis.asyncio as redis
 from fastapi import FastAPI
-from fastapi_limiter import FastAPILimiter
+from fastapi.responses import ORJSONResponse
 from starlette.middleware.cors import CORSMiddleware
 
-from src.conf.config import settings
-from src.routes import contacts, auth, users
+from src.database.db import replicas
+from src.database.redis_db import init_redis, close_redis
+from src.routes import contacts, auth, users, admin, metrics
+from src.services.profiling import ProfilingMiddleware
+from src.services.server_timing import ServerTimingMiddleware
 
-app = FastAPI()
+app = FastAPI(default_response_class=ORJSONResponse)
 
 app.include_router(contacts.router, prefix='/api')
 app.include_router(auth.router, prefix='/api')
 app.include_router(users.router, prefix='/api')
+app.include_router(admin.router, prefix='/api')
+app.include_router(metrics.router)
 
 origins = ["http://localhost:3000"]
+replica_checks: asyncio.Task | None = None
 
 
 @app.on_event("startup")
@@ -22,13 +28,29 @@ async def startup():
     """
     The startup function is called when the application starts up.
     It's a good place to initialize things that are used by the app, such as databases or caches.
+    With read replicas configured, it also starts their health checks.
 
-    :return: A fastapilimiter instance
+    :return: Nothing
     :doc-author: Trelent
     """
-    r = await redis.Redis(host=settings.redis_host, port=settings.redis_port, db=0, encoding="utf-8",
-                          decode_responses=True)
-    await FastAPILimiter.init(r)
+    global replica_checks
+    await init_redis()
+    if replicas.engines:
+        replica_checks = asyncio.create_task(replicas.run())
+
+
+@app.on_event("shutdown")
+async def shutdown():
+    """
+    The shutdown function is called when the application stops, stops the replica health checks
+    and closes the Redis connection pool.
+
+    :return: Nothing
+    :doc-author: Trelent
+    """
+    if replica_checks is not None:
+        replica_checks.cancel()
+    await close_redis()
 
 
 app.add_middleware(
@@ -38,6 +60,9 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+app.add_middleware(ServerTimingMiddleware)
+# outermost, so that a profile covers the other middleware too
+app.add_middleware(ProfilingMiddleware)
 
 
 @app.get("/")
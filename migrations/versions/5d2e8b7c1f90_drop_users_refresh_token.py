@@ -0,0 +1,25 @@
+"""drop users refresh token
+
+Revision ID: 5d2e8b7c1f90
+Revises: e3b7f2a91c5d
+Create Date: 2026-10-18 14:02:37.516204
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5d2e8b7c1f90'
+down_revision = 'e3b7f2a91c5d'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # refresh tokens live in the refresh token store (src.services.refresh_tokens) now
+    op.drop_column('users', 'refresh_token')
+
+
+def downgrade() -> None:
+    op.add_column('users', sa.Column('refresh_token', sa.String(length=255), nullable=True))
@@ -0,0 +1,31 @@
+"""contacts lower name email indexes
+
+Revision ID: a7c4e19b2f05
+Revises: 3f1a9c2d7b64
+Create Date: 2026-10-17 11:03:27.540912
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a7c4e19b2f05'
+down_revision = '3f1a9c2d7b64'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_index('ix_contacts_user_id_lower_firstname', 'contacts',
+                    ['user_id', sa.text('lower(firstname) text_pattern_ops')], unique=False)
+    op.create_index('ix_contacts_user_id_lower_lastname', 'contacts',
+                    ['user_id', sa.text('lower(lastname) text_pattern_ops')], unique=False)
+    op.create_index('ix_contacts_user_id_lower_email', 'contacts',
+                    ['user_id', sa.text('lower(email) text_pattern_ops')], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index('ix_contacts_user_id_lower_email', table_name='contacts')
+    op.drop_index('ix_contacts_user_id_lower_lastname', table_name='contacts')
+    op.drop_index('ix_contacts_user_id_lower_firstname', table_name='contacts')
@@ -0,0 +1,41 @@
+"""contacts search index
+
+Revision ID: e3b7f2a91c5d
+Revises: c52d0e8f4a13
+Create Date: 2026-10-18 09:41:12.305718
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+from src.conf.config import settings
+
+
+# revision identifiers, used by Alembic.
+revision = 'e3b7f2a91c5d'
+down_revision = 'c52d0e8f4a13'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.add_column('contacts', sa.Column('search_vector', postgresql.TSVECTOR(), sa.Computed(
+        "setweight(to_tsvector('simple', firstname || ' ' || lastname), 'A') || "
+        "setweight(to_tsvector('simple', regexp_replace(email, '\\W+', ' ', 'g')), 'B') || "
+        "setweight(to_tsvector('simple', regexp_replace(coalesce(phone, ''), '\\D+', '', 'g')), 'B') || "
+        "setweight(to_tsvector('simple', coalesce(description, '')), 'C')", persisted=True), nullable=True))
+    op.create_index('ix_contacts_search_vector', 'contacts', ['search_vector'], unique=False,
+                    postgresql_using='gin')
+    # opt-in with CONTACT_SEARCH_TRIGRAM=true: the trigram index needs the pg_trgm extension
+    if settings.contact_search_trigram:
+        op.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+        op.create_index('ix_contacts_search_text', 'contacts',
+                        [sa.text("(lower(firstname || ' ' || lastname || ' ' || email || ' ' || coalesce(phone, ''))) "
+                                 "gin_trgm_ops")], unique=False, postgresql_using='gin')
+
+
+def downgrade() -> None:
+    op.execute("DROP INDEX IF EXISTS ix_contacts_search_text")
+    op.drop_index('ix_contacts_search_vector', table_name='contacts')
+    op.drop_column('contacts', 'search_vector')
@@ -1,27 +1,221 @@
-import configparser
-import pathlib
+import asyncio
+import itertools
+import logging
+import time
 
-from fastapi import HTTPException, status
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
+from fastapi import HTTPException, Request, status
+from redis.exceptions import RedisError
+from sqlalchemy import event, text
+from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession, create_async_engine, async_sessionmaker
 from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.orm import Session, SessionTransactionOrigin
+from sqlalchemy.sql.dml import UpdateBase
 
 from src.conf.config import settings
+from src.database import redis_db
+from src.database.instrumentation import TimedQueuePool
+from src.services.cache import LRUCache
+
+logger = logging.getLogger(__name__)
+
+
+class ReplicaSet:
+    """
+    Read replicas for the sessions of read-only requests.
+
+    Replicas are used round-robin while healthy. check() probes every replica and runs every check_interval seconds
+    in the background (run()); a replica whose connection fails is also dropped right away, until the next check
+    finds it working again. Without a healthy replica, reads go to the primary.
+    A user whose own write was committed less than read_your_writes seconds ago reads from the primary, so replication
+    lag never shows them, or the response cache, their previous data. Writes are remembered in-process and, when
+    available, in Redis, which extends the window to requests served by other workers.
+    """
+
+    def __init__(self, engines: list[AsyncEngine], check_interval: float, read_your_writes: float, local_size: int):
+        self.engines = engines
+        self.healthy = list(engines)
+        self.check_interval = check_interval
+        self.read_your_writes = read_your_writes
+        self.writes = LRUCache(local_size)
+        self.turn = itertools.count()
+        for engine in engines:
+            event.listen(engine.sync_engine, "handle_error", self._failed(engine))
+
+    @staticmethod
+    def key(identity: str) -> str:
+        return f"db:written:{identity}"
+
+    def choose(self) -> AsyncEngine | None:
+        healthy = self.healthy
+        return healthy[next(self.turn) % len(healthy)] if healthy else None
+
+    def _failed(self, engine: AsyncEngine):
+        def handle_error(context):
+            if (context.is_disconnect or context.connection is None) and engine in self.healthy:
+                logger.warning("replica %s failed, reads go elsewhere until it passes a check: %s",
+                               engine.url.render_as_string(), context.original_exception)
+                self.healthy = [healthy for healthy in self.healthy if healthy is not engine]
+        return handle_error
+
+    async def check(self) -> None:
+        healthy = []
+        for engine in self.engines:
+            try:
+                await asyncio.wait_for(self.probe(engine), self.check_interval)
+            except (SQLAlchemyError, OSError, asyncio.TimeoutError) as err:
+                logger.warning("replica %s is unhealthy: %s", engine.url.render_as_string(), err)
+            else:
+                healthy.append(engine)
+        self.healthy = healthy
+
+    @staticmethod
+    async def probe(engine: AsyncEngine) -> None:
+        async with engine.connect() as connection:
+            await connection.execute(text("SELECT 1"))
+
+    async def run(self) -> None:
+        while True:
+            await self.check()
+            await asyncio.sleep(self.check_interval)
+
+    async def written(self, identity: str) -> None:
+        # without replicas every read is on the primary already
+        if not self.engines:
+            return
+        self.writes.set(identity, True, time.monotonic() + self.read_your_writes)
+        redis = redis_db.redis_client
+        if redis is not None:
+            try:
+                await redis.set(self.key(identity), "1", px=max(1, int(self.read_your_writes * 1000)))
+            except RedisError:
+                pass
+
+    async def written_recently(self, identity: str) -> bool:
+        if not self.engines:
+            return False
+        if self.writes.get(identity):
+            return True
+        redis = redis_db.redis_client
+        if redis is not None:
+            try:
+                return bool(await redis.exists(self.key(identity)))
+            except RedisError:
+                pass
+        return False
+
+
+class RoutingSession(Session):
+    """
+    Session that runs everything on its bind, the primary, except the reads of a read-only request (info["read_only"],
+    set by get_db), which go to one replica chosen at the first read. Once the session writes, or the user wrote
+    recently (info["primary"], set by identify), it stays on the primary.
+    """
+
+    def __init__(self, *args, replicas: ReplicaSet | None = None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.replicas = replicas
+
+    def get_bind(self, mapper=None, clause=None, **kwargs):
+        info = self.info
+        if self._flushing or isinstance(clause, UpdateBase):
+            info["wrote"] = True
+        elif info.get("read_only") and self.replicas is not None \
+                and not info.get("wrote") and not info.get("primary"):
+            if "replica" not in info:
+                info["replica"] = self.replicas.choose()
+            if info["replica"] is not None:
+                return info["replica"].sync_engine
+        return super().get_bind(mapper, clause=clause, **kwargs)
+
+
+class RoutingAsyncSession(AsyncSession):
+    """
+    Request session. Like every session it checks a connection out of the pool at its first statement and gives it
+    back when the transaction ends, at commit, or when the request ends. A read-only request never commits, so its
+    session ends the transaction right after each statement instead of holding the connection while the response
+    is built and sent. The results of execute() and scalar() are buffered, so nothing needs the connection
+    afterwards; the reads then run in separate transactions, which under READ COMMITTED see no less consistent data
+    than statements of one transaction do. Other sessions keep their transaction, so a read followed by a write
+    costs one checkout. Transactions begun explicitly, sessions that expire objects on commit and streamed results
+    are left alone.
+    """
+    sync_session_class = RoutingSession
+
+    async def execute(self, *args, **kwargs):
+        result = await super().execute(*args, **kwargs)
+        await self.release()
+        return result
+
+    async def scalar(self, *args, **kwargs):
+        result = await super().scalar(*args, **kwargs)
+        await self.release()
+        return result
+
+    async def release(self) -> None:
+        session = self.sync_session
+        transaction = session.get_transaction()
+        if not self.info.get("read_only") or transaction is None \
+                or transaction.origin is not SessionTransactionOrigin.AUTOBEGIN \
+                or session.expire_on_commit or self.info.get("wrote") \
+                or session.new or session.dirty or session.deleted:
+            return
+        await self.commit()
+
+    async def commit(self) -> None:
+        await super().commit()
+        replicas = self.sync_session.replicas
+        if self.info.pop("wrote", False) and replicas is not None and "identity" in self.info:
+            await replicas.written(self.info["identity"])
 
 
 URI = settings.sqlalchemy_database_url
-engine = create_engine(URI, echo=True)
+# statements are logged by src.database.instrumentation (slow and sampled ones) instead of echo
+engine = create_async_engine(URI, poolclass=TimedQueuePool, pool_size=settings.db_pool_size,
+                             max_overflow=settings.db_max_overflow)
+replicas = ReplicaSet([create_async_engine(url, poolclass=TimedQueuePool, pool_size=settings.db_pool_size,
+                                           max_overflow=settings.db_max_overflow)
+                       for url in settings.sqlalchemy_replica_urls],
+                      settings.db_replica_check_interval, settings.db_read_your_writes,
+                      settings.db_read_your_writes_local_size)
+
+# expire_on_commit=False: attributes of committed objects stay loaded, so returning them
+# from a route never triggers implicit (and, under asyncio, illegal) lazy IO
+DBSession = async_sessionmaker(bind=engine, class_=RoutingAsyncSession, replicas=replicas, autoflush=False,
+                               expire_on_commit=False)
+
+
+def read_only(endpoint):
+    """
+    Marks a route endpoint that only reads, so that get_db lets its queries run on a replica.
+    """
+    endpoint.read_only = True
+    return endpoint
+
+
+async def identify(db: AsyncSession, identity: str) -> None:
+    """
+    Tells the session whose request it serves, so that the user's writes are remembered
+    and the reads after them are served by the primary.
+    """
+    db.info["identity"] = identity
+    session_replicas = getattr(db.sync_session, "replicas", None)
+    if session_replicas is not None and db.info.get("read_only"):
+        db.info["primary"] = await session_replicas.written_recently(identity)
+
 
-DBSession = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+def is_read_only(request: Request) -> bool:
+    return getattr(getattr(request.scope.get("route"), "endpoint", None), "read_only", False)
 
 
 # Dependency
-def get_db():
+async def get_db(request: Request):
     db = DBSession()
+    if is_read_only(request):
+        db.info["read_only"] = True
     try:
         yield db
     except SQLAlchemyError as err:
-        db.rollback()
+        await db.rollback()
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(err))
     finally:
-        db.close()
+        await db.close()
@@ -0,0 +1,81 @@
+import logging
+import random
+import time
+from collections import Counter
+from contextvars import ContextVar
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+
+from src.conf.config import settings
+
+logger = logging.getLogger(__name__)
+
+
+class QueryStats:
+    """
+    SQL statements run on behalf of one request: how many, how long they took and how long the request
+    waited for pool connections. statements counts executions per SQL string; statements are compiled with
+    placeholders, so the string is the statement shape.
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+        self.pool_wait = 0.0
+        self.statements = Counter()
+
+    def server_timing(self, total: float) -> str:
+        return (f'db;dur={self.duration * 1000:.2f};desc="{self.count} queries", '
+                f'db-pool;dur={self.pool_wait * 1000:.2f}, app;dur={total * 1000:.2f}')
+
+    def repeated(self, threshold: int) -> list[tuple[str, int]]:
+        return [(statement, count) for statement, count in self.statements.items() if count > threshold]
+
+
+# set for the duration of a request by ServerTimingMiddleware; SQLAlchemy runs the event hooks below
+# in greenlets that share the calling task's context
+query_stats: ContextVar[QueryStats | None] = ContextVar("query_stats", default=None)
+
+
+@event.listens_for(Engine, "before_cursor_execute")
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("query_started", []).append(time.perf_counter())
+
+
+@event.listens_for(Engine, "after_cursor_execute")
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    duration = time.perf_counter() - conn.info["query_started"].pop()
+    stats = query_stats.get()
+    if stats is not None:
+        stats.count += 1
+        stats.duration += duration
+        stats.statements[statement] += 1
+    if duration * 1000 >= settings.sql_slow_query_ms:
+        logger.warning("slow query (%.1f ms): %s", duration * 1000, statement)
+    elif settings.sql_log_sample_rate and random.random() < settings.sql_log_sample_rate:
+        logger.info("query (%.1f ms): %s", duration * 1000, statement)
+
+
+@event.listens_for(Engine, "handle_error")
+def _handle_error(exception_context):
+    started = exception_context.connection.info.get("query_started") if exception_context.connection else None
+    if started:
+        started.pop()
+
+
+class TimedQueuePool(AsyncAdaptedQueuePool):
+    """
+    Queue pool that adds the time spent getting a connection (waiting for a free one or opening a new one)
+    to the current request's QueryStats.
+    """
+
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            stats = query_stats.get()
+            if stats is not None:
+                stats.pool_wait += time.perf_counter() - started
@@ -1,12 +1,34 @@
-from sqlalchemy import Column, Integer, String, func, ForeignKey
+from sqlalchemy import Column, Integer, String, func, ForeignKey, Index, Computed, DDL, event
+from sqlalchemy.ext.compiler import compiles
 from sqlalchemy.orm import relationship
+from sqlalchemy.sql.expression import FunctionElement
 
 from sqlalchemy.sql.sqltypes import DateTime, Boolean
 from sqlalchemy.ext.declarative import declarative_base
 
+from src.conf.config import settings
+
 Base = declarative_base()
 
 
+# month * 100 + day of a timestamp (229 for Feb 29): orders birthdays within a year regardless of birth year
+class month_day(FunctionElement):
+    type = Integer()
+    inherit_cache = True
+
+
+@compiles(month_day)
+def _month_day_default(element, compiler, **kw):
+    column = compiler.process(element.clauses, **kw)
+    return f"CAST(EXTRACT(MONTH FROM {column}) * 100 + EXTRACT(DAY FROM {column}) AS INTEGER)"
+
+
+@compiles(month_day, 'sqlite')
+def _month_day_sqlite(element, compiler, **kw):
+    column = compiler.process(element.clauses, **kw)
+    return f"CAST(strftime('%m%d', {column}) AS INTEGER)"
+
+
 class Contact(Base):
     __tablename__ = "contacts"
     id = Column(Integer, primary_key=True, index=True, nullable=False)
@@ -15,12 +37,75 @@ class Contact(Base):
     email = Column(String, unique=True, nullable=False, index=True)
     phone = Column(String, unique=True, index=True)
     birthday = Column(DateTime, default=None)
+    birthday_ordinal = Column(Integer, Computed(month_day(birthday), persisted=True))
     description = Column(String(150), default='')
     created_at = Column(DateTime, default=func.now())
     updated_at = Column(DateTime, default=func.now(), onupdate=func.now())
     user_id = Column('user_id', ForeignKey('users.id', ondelete='CASCADE'), default=None)
     user = relationship('User', backref="notes")
 
+    __table_args__ = (
+        Index('ix_contacts_user_id_id', 'user_id', 'id'),
+        # case-insensitive prefix search (lower(column) LIKE 'abc%') in querys_contacts
+        Index('ix_contacts_user_id_lower_firstname', user_id, func.lower(firstname).label('lower_firstname'),
+              postgresql_ops={'lower_firstname': 'text_pattern_ops'}),
+        Index('ix_contacts_user_id_lower_lastname', user_id, func.lower(lastname).label('lower_lastname'),
+              postgresql_ops={'lower_lastname': 'text_pattern_ops'}),
+        Index('ix_contacts_user_id_lower_email', user_id, func.lower(email).label('lower_email'),
+              postgresql_ops={'lower_email': 'text_pattern_ops'}),
+        Index('ix_contacts_user_id_birthday_ordinal', 'user_id', 'birthday_ordinal'),
+    )
+
+
+# Full-text search of contacts, see repository_contacts.search_contacts. The index lives outside the ORM model, so
+# contact queries never load it. Emails are indexed as their words and phones as their digits.
+# On Postgres: a weighted tsvector column maintained by the database with a GIN index, and with contact_search_trigram
+# (off by default, needs pg_trgm) a trigram GIN index over names, email and phone for fuzzy matches
+# (migration e3b7f2a91c5d). On SQLite: an FTS5 table kept in sync by triggers.
+SEARCH_VECTOR = "setweight(to_tsvector('simple', firstname || ' ' || lastname), 'A') || " \
+                "setweight(to_tsvector('simple', regexp_replace(email, '\\W+', ' ', 'g')), 'B') || " \
+                "setweight(to_tsvector('simple', regexp_replace(coalesce(phone, ''), '\\D+', '', 'g')), 'B') || " \
+                "setweight(to_tsvector('simple', coalesce(description, '')), 'C')"
+SEARCH_TEXT = "lower(firstname || ' ' || lastname || ' ' || email || ' ' || coalesce(phone, ''))"
+# left out of the metadata, so alembic autogenerate is told to skip them (migrations/env.py)
+SEARCH_SCHEMA_OBJECTS = {"search_vector", "ix_contacts_search_vector", "ix_contacts_search_text"}
+
+
+def _sqlite_fts_row(row: str) -> str:
+    digits = f"coalesce({row}.phone, '')"
+    for char in " -()+.":
+        digits = f"replace({digits}, '{char}', '')"
+    return f"{row}.id, {row}.firstname, {row}.lastname, {row}.email, {digits}, coalesce({row}.description, '')"
+
+
+def _trigram(ddl, target, bind, **kw):
+    return settings.contact_search_trigram
+
+
+for statement in (
+        f"ALTER TABLE contacts ADD COLUMN search_vector tsvector GENERATED ALWAYS AS ({SEARCH_VECTOR}) STORED",
+        "CREATE INDEX ix_contacts_search_vector ON contacts USING gin (search_vector)"):
+    event.listen(Contact.__table__, "after_create", DDL(statement).execute_if(dialect="postgresql"))
+for statement in (
+        "CREATE EXTENSION IF NOT EXISTS pg_trgm",
+        f"CREATE INDEX ix_contacts_search_text ON contacts USING gin (({SEARCH_TEXT}) gin_trgm_ops)"):
+    event.listen(Contact.__table__, "after_create",
+                 DDL(statement).execute_if(dialect="postgresql", callable_=_trigram))
+for statement in (
+        "CREATE VIRTUAL TABLE contacts_fts USING fts5(firstname, lastname, email, phone, description, "
+        "prefix='2 3')",
+        f"CREATE TRIGGER contacts_fts_insert AFTER INSERT ON contacts BEGIN "
+        f"INSERT INTO contacts_fts (rowid, firstname, lastname, email, phone, description) "
+        f"VALUES ({_sqlite_fts_row('new')}); END",
+        f"CREATE TRIGGER contacts_fts_update AFTER UPDATE ON contacts BEGIN "
+        f"DELETE FROM contacts_fts WHERE rowid = old.id; "
+        f"INSERT INTO contacts_fts (rowid, firstname, lastname, email, phone, description) "
+        f"VALUES ({_sqlite_fts_row('new')}); END",
+        "CREATE TRIGGER contacts_fts_delete AFTER DELETE ON contacts BEGIN "
+        "DELETE FROM contacts_fts WHERE rowid = old.id; END"):
+    event.listen(Contact.__table__, "after_create", DDL(statement).execute_if(dialect="sqlite"))
+event.listen(Contact.__table__, "after_drop", DDL("DROP TABLE IF EXISTS contacts_fts").execute_if(dialect="sqlite"))
+
 
 class User(Base):
     __tablename__ = "users"
@@ -30,5 +115,4 @@ class User(Base):
     password = Column(String(255), nullable=False)
     created_at = Column('crated_at', DateTime, default=func.now())
     avatar = Column(String(255), nullable=True)
-    refresh_token = Column(String(255), nullable=True)
     confirmed = Column(Boolean, default=False)
@@ -0,0 +1,27 @@
+import redis.asyncio as redis
+
+from src.conf.config import settings
+
+
+# one client (and connection pool) per worker, created on startup; None until then, e.g. in tests
+redis_client: redis.Redis | None = None
+
+
+async def init_redis() -> redis.Redis:
+    global redis_client
+    # a blocking pool waits for a free connection under load instead of failing with "Too many connections"
+    pool = redis.BlockingConnectionPool(host=settings.redis_host, port=settings.redis_port, db=0, encoding="utf-8",
+                                        decode_responses=True, max_connections=settings.redis_max_connections,
+                                        timeout=settings.redis_pool_timeout,
+                                        socket_timeout=settings.redis_socket_timeout,
+                                        socket_connect_timeout=settings.redis_socket_timeout,
+                                        health_check_interval=30)
+    redis_client = redis.Redis(connection_pool=pool)
+    return redis_client
+
+
+async def close_redis() -> None:
+    global redis_client
+    if redis_client is not None:
+        await redis_client.close(close_connection_pool=True)
+        redis_client = None
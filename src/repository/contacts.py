@@ -1,154 +1,382 @@
-from datetime import datetime, timedelta
-from typing import List
+import re
+from datetime import date, timedelta
+from typing import AsyncIterator, List
 
-from sqlalchemy import and_
-from sqlalchemy.orm import Session
+from sqlalchemy import Integer, Row, and_, any_, or_, case, cast, column, delete, func, insert, literal, select, update, \
+    values
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.sql import literal_column, table
+from sqlalchemy.ext.asyncio import AsyncSession
 
-from src.database.models import Contact, User
-from src.schemas import ContactModel, ContactResponse
+from src.conf.config import settings
+from src.database.models import Contact, User, SEARCH_TEXT
+from src.schemas import ContactModel, ContactResponse, ContactUpdate, ContactOperation
+from src.services.response_cache import response_cache
 
+# read paths select just what a response needs and return plain rows: no identity map entries, change tracking
+# or relationship state are built for contacts that are only serialized once
+RESPONSE_COLUMNS = tuple(getattr(Contact, field) for field in ContactResponse.__fields__)
 
-async def get_contacts(skip: int, limit: int, user: User, db: Session) -> List[Contact]:
+
+async def get_contacts(skip: int, limit: int, user: User, db: AsyncSession,
+                       after_id: int | None = None) -> List[Row]:
     """
-    The get_contacts function returns a list of contacts for the user.
+    The get_contacts function returns a page of contacts for the user, ordered by id, as rows of the
+    ContactResponse columns.
+    Pages are addressed by the id of the last contact of the previous page (keyset pagination),
+    so every page costs one index range scan on (user_id, id) no matter how deep it is.
 
-    :param skip: int: Skip the first n contacts in the database
+    :param skip: int: Skip the first n contacts (deprecated offset paging, scans every skipped row)
     :param limit: int: Limit the number of contacts returned
     :param user: User: Get the user id from the database
-    :param db: Session: Pass the database session to the function
-    :return: A list of contacts
+    :param db: AsyncSession: Pass the database session to the function
+    :param after_id: int | None: Return only contacts with an id greater than this one
+    :return: A list of contact rows
+    :doc-author: Trelent
+    """
+    stmt = select(*RESPONSE_COLUMNS).where(Contact.user_id == user.id)
+    if after_id is not None:
+        stmt = stmt.where(Contact.id > after_id)
+    elif skip:
+        stmt = stmt.offset(skip)
+    stmt = stmt.order_by(Contact.id).limit(limit)
+    contacts = await db.execute(stmt)
+    return contacts.all()
+
+
+async def stream_contacts(user: User, db: AsyncSession, columns: tuple,
+                          batch_size: int = 1000) -> AsyncIterator[List[Row]]:
+    """
+    The stream_contacts function yields all contacts of the user, ordered by id, in batches of plain rows.
+    The query runs on a server-side cursor and fetches batch_size rows at a time,
+    so memory use does not grow with the number of contacts and no ORM objects are built.
+
+    :param user: User: Get the user id from the database
+    :param db: AsyncSession: Pass the database session to the function
+    :param columns: tuple: Names of the Contact columns to select
+    :param batch_size: int: Number of rows fetched per round trip
+    :return: An async iterator over lists of rows
     :doc-author: Trelent
     """
-    return db.query(Contact).filter(Contact.user_id == user.id).offset(skip).limit(limit).all()
+    stmt = select(*(getattr(Contact, column) for column in columns)).where(Contact.user_id == user.id) \
+        .order_by(Contact.id).execution_options(yield_per=batch_size)
+    result = await db.stream(stmt)
+    try:
+        async for partition in result.partitions():
+            yield partition
+    finally:
+        await result.close()
 
 
-async def get_contact(contact_id: int, user: User, db: Session) -> Contact:
+async def get_contact(contact_id: int, user: User, db: AsyncSession) -> Row | None:
     """
-    The get_contact function takes in a contact_id and user, and returns the contact with that id.
+    The get_contact function takes in a contact_id and user, and returns the contact with that id
+    as a row of the ContactResponse columns.
         Args:
             contact_id (int): The id of the desired Contact object.
             user (User): The User object associated with this Contact.
 
     :param contact_id: int: Get the contact with a specific id
     :param user: User: Get the user's id from the database
-    :param db: Session: Pass the database session to the function
+    :param db: AsyncSession: Pass the database session to the function
     :return: The contact with the given id for the given user
     :doc-author: Trelent
     """
-    return db.query(Contact).filter(and_(Contact.id == contact_id, Contact.user_id == user.id)).first()
+    stmt = select(*RESPONSE_COLUMNS).where(and_(Contact.id == contact_id, Contact.user_id == user.id))
+    contact = await db.execute(stmt)
+    return contact.first()
 
 
-async def create_contact(body: ContactModel, user: User, db: Session) -> Contact:
+async def create_contact(body: ContactModel, user: User, db: AsyncSession) -> Contact:
     """
     The create_contact function creates a new contact in the database.
+    The generated columns come back from INSERT ... RETURNING, so the row is not read again.
 
     :param body: ContactModel: Get the data from the request body
     :param user: User: Get the user id from the token
-    :param db: Session: Access the database
+    :param db: AsyncSession: Access the database
     :return: A contact object
     :doc-author: Trelent
     """
-    contact = Contact(firstname=body.firstname, lastname=body.lastname, email=body.email, phone=body.phone,
-                      birthday=body.birthday, description=body.description, user_id=user.id)
-    db.add(contact)
-    db.commit()
-    db.refresh(contact)
+    contact = await db.scalar(insert(Contact).values(**body.dict(), user_id=user.id).returning(Contact))
+    await db.commit()
+    await response_cache.bump(user.id)
     return contact
 
 
-async def remove_contact(contact_id: int, user: User, db: Session) -> Contact | None:
+async def import_contacts(contacts: List[ContactModel], user: User, db: AsyncSession) -> List[bool]:
     """
-    The remove_contact function removes a contact from the database.
+    The import_contacts function inserts a batch of contacts for the user with a single executemany INSERT
+    and commits it. Contacts whose email or phone is already taken, in the database or earlier in the same
+    batch, are skipped through ON CONFLICT DO NOTHING instead of failing the whole batch.
+
+    :param contacts: List[ContactModel]: The validated contacts of one batch
+    :param user: User: Get the user id from the token
+    :param db: AsyncSession: Access the database
+    :return: For every contact of the batch, whether it was inserted
+    :doc-author: Trelent
+    """
+    emails, phones, rows, candidates = set(), set(), [], []
+    for body in contacts:
+        candidate = body.email not in emails and body.phone not in phones
+        if candidate:
+            rows.append(dict(firstname=body.firstname, lastname=body.lastname, email=body.email, phone=body.phone,
+                             birthday=body.birthday, description=body.description, user_id=user.id))
+            emails.add(body.email)
+            phones.add(body.phone)
+        candidates.append(candidate)
+    inserted = set()
+    if rows:
+        dialect = postgresql if db.get_bind().dialect.name == 'postgresql' else sqlite
+        stmt = dialect.insert(Contact).on_conflict_do_nothing().returning(Contact.email)
+        inserted = set(await db.scalars(stmt, rows))
+        await db.commit()
+        if inserted:
+            await response_cache.bump(user.id)
+    return [candidate and body.email in inserted for candidate, body in zip(candidates, contacts)]
+
+
+async def remove_contact(contact_id: int, user: User, db: AsyncSession) -> Contact | None:
+    """
+    The remove_contact function removes a contact from the database
+    with a single DELETE ... RETURNING statement scoped to the user.
         Args:
             contact_id (int): The id of the contact to be removed.
             user (User): The user who owns the contacts list.
-            db (Session): A connection to our database, used for querying and deleting data.
+            db (AsyncSession): A connection to our database, used for querying and deleting data.
 
     :param contact_id: int: Identify the contact to be removed
     :param user: User: Get the user's id from the database
-    :param db: Session: Pass the database session to the function
+    :param db: AsyncSession: Pass the database session to the function
     :return: The contact that was removed
     :doc-author: Trelent
     """
-    contact = db.query(Contact).filter(and_(Contact.id == contact_id, Contact.user_id == user.id)).first()
+    contact = await db.scalar(delete(Contact).where(and_(Contact.id == contact_id, Contact.user_id == user.id))
+                              .returning(Contact))
+    await db.commit()
     if contact:
-        db.delete(contact)
-        db.commit()
+        await response_cache.bump(user.id)
     return contact
 
 
-async def update_contact(contact_id: int, body: ContactResponse, user: User, db: Session) -> Contact | None:
+async def update_contact(contact_id: int, body: ContactModel | ContactUpdate, user: User,
+                         db: AsyncSession) -> Contact | Row | None:
     """
-    The update_contact function updates a contact in the database.
+    The update_contact function updates a contact in the database
+    with a single UPDATE ... RETURNING statement scoped to the user.
+    Only the fields set in the body are written, so a ContactUpdate from a PATCH request changes
+    just the fields the client sent, while a full ContactModel replaces them all.
         Args:
             contact_id (int): The id of the contact to update.
-            body (ContactResponse): The updated information for the specified contact.
+            body (ContactModel | ContactUpdate): The updated information for the specified contact.
 
     :param contact_id: int: Identify the contact that is being updated
-    :param body: ContactResponse: Pass the data from the request body to the function
+    :param body: ContactModel | ContactUpdate: Pass the data from the request body to the function
     :param user: User: Get the user id from the token
-    :param db: Session: Access the database
+    :param db: AsyncSession: Access the database
     :return: The contact object, if it exists
     :doc-author: Trelent
     """
-    contact = db.query(Contact).filter(and_(Contact.id == contact_id, Contact.user_id == user.id)).first()
+    fields = body.dict(exclude_unset=True)
+    if not fields:
+        return await get_contact(contact_id, user, db)
+    contact = await db.scalar(update(Contact).where(and_(Contact.id == contact_id, Contact.user_id == user.id))
+                              .values(**fields).returning(Contact))
+    await db.commit()
     if contact:
-        contact.firstname = body.firstname
-        contact.lastname = body.lastname
-        contact.email = body.email
-        contact.phone = body.phone
-        contact.birthday = body.birthday
-        contact.description = body.description
-        db.commit()
+        await response_cache.bump(user.id)
     return contact
 
 
-async def querys_contacts(firstname: str, lastname: str, email: str, user: User, db: Session) -> List[Contact]:
+async def batch_contacts(operations: List[ContactOperation], user: User, db: AsyncSession) -> List[Contact | None]:
+    """
+    The batch_contacts function applies a batch of update and delete operations to the user's contacts
+    in one transaction, with one statement per kind of operation instead of one per contact:
+    the updates are a single UPDATE ... FROM (VALUES ...) in which a NULL value keeps the current one,
+    the deletes a single DELETE ... WHERE id = ANY(...). Both are scoped to the user and return the rows they hit.
+
+    :param operations: List[ContactOperation]: The operations, each contact at most once
+    :param user: User: Get the user id from the token
+    :param db: AsyncSession: Access the database
+    :return: For every operation, the updated or deleted contact, or None if the user has no such contact
+    :doc-author: Trelent
+    """
+    postgres = db.get_bind().dialect.name == 'postgresql'
+    updates = [operation for operation in operations if operation.op == "update"]
+    deletes = [operation.id for operation in operations if operation.op == "delete"]
+    updated, deleted = {}, {}
+    if updates:
+        fields = list(ContactUpdate.__fields__)
+        changes = values(column("id", Integer), *(column(name, Contact.__table__.c[name].type) for name in fields),
+                         name="changes") \
+            .data([(operation.id, *(getattr(operation.data, name) for name in fields)) for operation in updates]) \
+            .cte("changes")
+
+        def change(name):
+            # Postgres types a VALUES column from its rows, an all-NULL column would be text
+            value = changes.c[name]
+            return cast(value, Contact.__table__.c[name].type) if postgres else value
+
+        stmt = update(Contact).where(and_(Contact.id == changes.c.id, Contact.user_id == user.id)) \
+            .values({name: func.coalesce(change(name), getattr(Contact, name)) for name in fields}) \
+            .returning(Contact)
+        updated = {contact.id: contact for contact in await db.scalars(stmt)}
+    if deletes:
+        # one array parameter on Postgres, so the statement text does not depend on the batch size
+        selected = Contact.id == any_(literal(deletes, postgresql.ARRAY(Integer))) if postgres \
+            else Contact.id.in_(deletes)
+        stmt = delete(Contact).where(and_(selected, Contact.user_id == user.id)).returning(Contact)
+        deleted = {contact.id: contact for contact in await db.scalars(stmt)}
+    await db.commit()
+    if updated or deleted:
+        await response_cache.bump(user.id)
+    return [(updated if operation.op == "update" else deleted).get(operation.id) for operation in operations]
+
+
+async def querys_contacts(firstname: str | None, lastname: str | None, email: str | None, user: User,
+                          db: AsyncSession, limit: int = 10, after_id: int | None = None) -> List[Row]:
     """
     The querys_contacts function takes in a firstname, lastname, email and user object.
-    It then queries the database for contacts that match any of these parameters.
-    The function returns a list of all matching contacts.
+    It then queries the database for contacts whose firstname, lastname or email starts with the given value,
+    ignoring case. Empty parameters are skipped, and all of them are combined into one query,
+    so a contact matching several fields is returned once.
 
-    :param firstname: str: Filter the contacts by firstname
-    :param lastname: str: Filter the contacts by lastname
-    :param email: str: Filter the contacts by email
+    :param firstname: str | None: Filter the contacts by firstname prefix
+    :param lastname: str | None: Filter the contacts by lastname prefix
+    :param email: str | None: Filter the contacts by email prefix
     :param user: User: Get the user_id of the logged in user
-    :param db: Session: Access the database
-    :return: A list of contacts that match the query parameters
+    :param db: AsyncSession: Access the database
+    :param limit: int: Limit the number of contacts returned
+    :param after_id: int | None: Return only contacts with an id greater than this one
+    :return: A list of contact rows that match the query parameters
+    :doc-author: Trelent
+    """
+    # the patterns are inlined rather than bound: a generic plan for LIKE $1 || '%' cannot use the prefix range of
+    # the lower(column) text_pattern_ops indexes and reads all of the user's contacts, as in search_contacts
+    filters = [func.lower(column).like(literal(re.sub(r"([/%_])", r"/\1", value.lower()) + "%",
+                                               literal_execute=True), escape="/")
+               for column, value in ((Contact.firstname, firstname), (Contact.lastname, lastname),
+                                     (Contact.email, email)) if value]
+    if not filters:
+        return []
+    stmt = select(*RESPONSE_COLUMNS).where(and_(Contact.user_id == user.id, or_(*filters)))
+    if after_id is not None:
+        stmt = stmt.where(Contact.id > after_id)
+    stmt = stmt.order_by(Contact.id).limit(limit)
+    contacts = await db.execute(stmt)
+    return contacts.all()
+
+
+def search_terms(q: str) -> List[str]:
+    """
+    Splits a search string into lowercase words the way the search index does; a phone number is one term,
+    its digits.
+    """
+    if re.fullmatch(r"[\d\s()+.-]+", q) and re.search(r"\d", q):
+        return [re.sub(r"\D", "", q)]
+    return re.findall(r"\w+", q.lower())
+
+
+async def search_contacts(q: str, user: User, db: AsyncSession, limit: int = 10,
+                          offset: int = 0) -> tuple[List[Row], bool, bool]:
+    """
+    The search_contacts function finds the user's contacts matching every word of q in the firstname, lastname,
+    email, phone or description, best matches first. The last word may be the start of a word, so results follow
+    typing; the others must match whole words, which lets the index skip through common words instead of reading
+    every contact they occur in.
+    On Postgres the words are matched against the weighted search_vector column (names count most, then email and
+    phone, then description) and ranked by ts_rank; with contact_search_trigram, contacts whose names, email or phone
+    are similar to q (pg_trgm word similarity, e.g. a misspelled name) match too and similarity adds to the rank.
+    Only the first contact_search_max_matches matches are ranked, so a word found in most contacts stays cheap
+    at the cost of ranking an arbitrary subset of them; the GIN indexes cannot hand them out best first. Pages stop
+    at the last ranked match, and the third value returned tells that more contacts match than were ranked,
+    so the client can narrow the search.
+    On SQLite the FTS5 table contacts_fts is searched and ranked by bm25 with the same column weights.
+
+    :param q: str: The search string
+    :param user: User: Get the user id from the token
+    :param db: AsyncSession: Access the database
+    :param limit: int: Limit the number of contacts returned
+    :param offset: int: Skip the first n matches
+    :return: A list of matching contact rows, best match first, whether a next page follows
+        and whether matches were left out of the ranking
     :doc-author: Trelent
     """
-    contact_with_firstname = db.query(Contact).filter(
-        and_(Contact.firstname == firstname, Contact.user_id == user.id)).all()
-    contact_with_lastname = db.query(Contact).filter(
-        and_(Contact.lastname == lastname, Contact.user_id == user.id)).all()
-    contact_with_email = db.query(Contact).filter(and_(Contact.email == email, Contact.user_id == user.id)).all()
-    result = []
-    result.extend(contact_with_firstname)
-    result.extend(contact_with_lastname)
-    result.extend(contact_with_email)
-    return result
+    terms = search_terms(q)
+    if not terms:
+        return [], False, False
+    if db.get_bind().dialect.name == 'postgresql':
+        # inlined rather than bound: Postgres can then estimate how many rows match and keeps using the GIN index,
+        # where a generic plan for a parameter falls back to scanning all of the user's contacts
+        query = func.to_tsquery(literal_column("'simple'::regconfig"),
+                                literal(' & '.join([*terms[:-1], f"{terms[-1]}:*"]), literal_execute=True))
+        vector = literal_column("contacts.search_vector", postgresql.TSVECTOR)
+        matches = vector.op("@@")(query)
+        rank = func.ts_rank(vector, query)
+        if settings.contact_search_trigram:
+            search_text = literal_column(SEARCH_TEXT)
+            pattern = literal(q.lower(), literal_execute=True)
+            matches = or_(matches, pattern.op("<%")(search_text))
+            rank = rank + func.word_similarity(pattern, search_text)
+        # ranking reads every matching search vector: a word in most contacts would rank all of them
+        # one more candidate than ranked tells whether there were more
+        candidates = select(Contact.id).where(and_(Contact.user_id == user.id, matches)) \
+            .limit(settings.contact_search_max_matches + 1)
+        stmt = select(*RESPONSE_COLUMNS, func.count().over().label("candidates")) \
+            .where(Contact.id.in_(candidates)).order_by(rank.desc(), Contact.id)
+        # one more row than the page tells whether a next page follows; pages stop at max_matches, which cuts
+        # the lowest ranked of the max_matches + 1 candidates off the last page
+        cap = settings.contact_search_max_matches
+        contacts = (await db.execute(stmt.offset(offset).limit(max(0, min(limit + 1, cap - offset))))).all()
+        if contacts:
+            found = contacts[0].candidates
+        elif offset:
+            # past the last page the window count is not there to read
+            found = await db.scalar(select(func.count()).select_from(candidates.subquery()))
+        else:
+            found = 0
+        return contacts[:limit], len(contacts) > limit, found > cap
+    else:
+        fts = table("contacts_fts", column("rowid", Integer))
+        stmt = select(*RESPONSE_COLUMNS).join(fts, fts.c.rowid == Contact.id) \
+            .where(and_(Contact.user_id == user.id,
+                        literal_column("contacts_fts").match(" ".join([*(f'"{term}"' for term in terms[:-1]),
+                                                                     f'"{terms[-1]}"*'])))) \
+            .order_by(literal_column("bm25(contacts_fts, 10.0, 10.0, 5.0, 5.0, 1.0)"), Contact.id)
+    # FTS5 ranks every match
+    contacts = (await db.execute(stmt.offset(offset).limit(limit + 1))).all()
+    return contacts[:limit], len(contacts) > limit, False
 
 
-async def birthdays(user: User, db: Session) -> List[Contact]:
+async def birthdays(user: User, db: AsyncSession, days: int = 7, today: date | None = None) -> List[Row]:
     """
-    The birthdays function returns a list of contacts whose birthdays are within the next 7 days.
+    The birthdays function returns a list of contacts whose birthdays are within the next days,
+    today included, ordered by how soon they come.
+    The window is a range on the indexed birthday_ordinal column (month * 100 + day),
+    split in two when it wraps over the new year. Feb 29 birthdays fall between Feb 28 and Mar 1,
+    contacts without a birthday are never returned.
         Args:
             user (User): The User object for which to retrieve contacts.
-            db (Session): A database session object used to query the database.
+            db (AsyncSession): A database session object used to query the database.
 
     :param user: User: Get the user_id from the database
-    :param db: Session: Access the database
-    :return: A list of contacts whose birthdays are within the next 7 days
+    :param db: AsyncSession: Access the database
+    :param days: int: Length of the window in days
+    :param today: date | None: First day of the window, today by default
+    :return: A list of contact rows whose birthdays are within the next days
     :doc-author: Trelent
     """
-    contacts = db.query(Contact).filter(Contact.user_id == user.id).all()
-    result = []
-    delta = timedelta(days=7)
-    delta_date = datetime.now() + delta
-    for contact in contacts:
-        birthday_date = datetime(year=datetime.now().year, month=contact.birthday.month, day=contact.birthday.day)
-        birthday_date_next_year = datetime(year=datetime.now().year + 1, month=contact.birthday.month,
-                                           day=contact.birthday.day)
-        if datetime.now() < birthday_date <= delta_date or datetime.now() < birthday_date_next_year <= delta_date:
-            result.append(contact)
-    return result
+    today = today or date.today()
+    # the last day of the window, both ends are included
+    end = today + timedelta(days=days - 1)
+    start_ordinal = today.month * 100 + today.day
+    end_ordinal = end.month * 100 + end.day
+    stmt = select(*RESPONSE_COLUMNS).where(and_(Contact.user_id == user.id, Contact.birthday_ordinal.is_not(None)))
+    if days < 365:
+        if start_ordinal <= end_ordinal:
+            stmt = stmt.where(Contact.birthday_ordinal.between(start_ordinal, end_ordinal))
+        else:
+            stmt = stmt.where(or_(Contact.birthday_ordinal >= start_ordinal, Contact.birthday_ordinal <= end_ordinal))
+    stmt = stmt.order_by(case((Contact.birthday_ordinal < start_ordinal, 1), else_=0), Contact.birthday_ordinal)
+    contacts = await db.execute(stmt)
+    return contacts.all()
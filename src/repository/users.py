@@ -1,33 +1,35 @@
 from libgravatar import Gravatar
-from sqlalchemy.orm import Session
+from sqlalchemy import select, update
+from sqlalchemy.ext.asyncio import AsyncSession
 
 from src.database.models import User
+from src.services.cache import user_cache
 from src.schemas import UserModel
 
 
-async def get_user_by_email(email: str, db: Session) -> User:
+async def get_user_by_email(email: str, db: AsyncSession) -> User:
     """
     The get_user_by_email function takes in an email and a database session,
     and returns the user associated with that email. If no such user exists,
     it will return None.
 
     :param email: str: Specify the type of parameter that is expected to be passed into the function
-    :param db: Session: Connect to the database
+    :param db: AsyncSession: Connect to the database
     :return: A user object
     :doc-author: Trelent
     """
-    return db.query(User).filter(User.email == email).first()
+    return await db.scalar(select(User).where(User.email == email))
 
 
-async def create_user(body: UserModel, db: Session) -> User:
+async def create_user(body: UserModel, db: AsyncSession) -> User:
     """
     The create_user function creates a new user in the database.
         Args:
             body (UserModel): The UserModel object containing the data to be inserted into the database.
-            db (Session): The SQLAlchemy Session object used to interact with our PostgreSQL database.
+            db (AsyncSession): The SQLAlchemy Session object used to interact with our PostgreSQL database.
 
     :param body: UserModel: Get the data from the request body
-    :param db: Session: Create a database session
+    :param db: AsyncSession: Create a database session
     :return: A user object
     :doc-author: Trelent
     """
@@ -39,52 +41,58 @@ async def create_user(body: UserModel, db: Session) -> User:
         print(e)
     new_user = User(**body.dict(), avatar=avatar)
     db.add(new_user)
-    db.commit()
-    db.refresh(new_user)
+    await db.commit()
+    await db.refresh(new_user)
     return new_user
 
 
-async def update_token(user: User, token: str | None, db: Session) -> None:
+async def update_password(user: User, password: str, db: AsyncSession) -> None:
     """
-    The update_token function updates the refresh token for a user.
+    The update_password function replaces the stored password hash of a user,
+    e.g. with a rehash made at login after the bcrypt cost factor changed.
 
     :param user: User: Identify the user to update
-    :param token: str | None: Pass the token to the function
-    :param db: Session: Connect to the database
-    :return: None because it is an async function
+    :param password: str: The new password hash
+    :param db: AsyncSession: Connect to the database
+    :return: Nothing
     :doc-author: Trelent
     """
-    user.refresh_token = token
-    db.commit()
+    await db.execute(update(User).where(User.id == user.id).values(password=password))
+    await db.commit()
 
 
-async def confirmed_email(email: str, db: Session) -> None:
+async def confirmed_email(email: str, db: AsyncSession) -> bool:
     """
     The confirmed_email function takes in an email and a database session,
     and sets the confirmed field of the user with that email to True.
-
+    It is a single UPDATE ... WHERE confirmed = false RETURNING statement, so confirming twice,
+    even concurrently, changes the row once.
 
     :param email: str: Get the email of the user that is trying to confirm their account
-    :param db: Session: Access the database
-    :return: Nothing
+    :param db: AsyncSession: Access the database
+    :return: True if the user was confirmed by this call, False if there is no such unconfirmed user
     :doc-author: Trelent
     """
-    user = await get_user_by_email(email, db)
-    user.confirmed = True
-    db.commit()
+    user_id = await db.scalar(update(User).where(User.email == email, User.confirmed.is_(False))
+                              .values(confirmed=True).returning(User.id))
+    await db.commit()
+    if user_id is None:
+        return False
+    await user_cache.invalidate(email)
+    return True
 
 
-async def update_avatar(email, url: str, db: Session) -> User:
+async def update_avatar(email, url: str, db: AsyncSession) -> User | None:
     """
-    The update_avatar function updates the avatar of a user.
+    The update_avatar function updates the avatar of a user with a single UPDATE ... RETURNING statement.
 
     :param email: Find the user in the database
     :param url: str: Specify that the url parameter is a string
-    :param db: Session: Connect to the database
-    :return: A user object
+    :param db: AsyncSession: Connect to the database
+    :return: The updated user object, None if there is no user with that email
     :doc-author: Trelent
     """
-    user = await get_user_by_email(email, db)
-    user.avatar = url
-    db.commit()
+    user = await db.scalar(update(User).where(User.email == email).values(avatar=url).returning(User))
+    await db.commit()
+    await user_cache.invalidate(email)
     return user
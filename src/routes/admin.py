@@ -0,0 +1,76 @@
+import os
+import time
+from datetime import datetime
+from typing import List
+
+from fastapi import APIRouter, Depends, HTTPException, Query, status
+from fastapi.responses import FileResponse
+
+from src.conf.config import settings
+from src.database.models import User
+from src.schemas import ProfileInfo, ProfileToken
+from src.services.auth import auth_service
+from src.services.metrics import MetricsRoute
+from src.services.profiling import HEADER, profiler, sign
+
+router = APIRouter(prefix="/admin", tags=["admin"], route_class=MetricsRoute)
+
+
+async def get_current_admin(current_user: User = Depends(auth_service.get_current_user)):
+    """
+    The get_current_admin function is a dependency that lets only the users listed in settings.admin_emails through.
+
+    :param current_user: User: Get the current user
+    :return: The current user, if they are an admin
+    :doc-author: Trelent
+    """
+    if current_user.email not in settings.admin_emails:
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Admin access required")
+    return current_user
+
+
+@router.get("/profiles", response_model=List[ProfileInfo], dependencies=[Depends(get_current_admin)])
+async def read_profiles():
+    """
+    The read_profiles function lists the stored request profiles, newest first.
+
+    :return: The name, size and creation time of every stored profile
+    :doc-author: Trelent
+    """
+    profiles = []
+    for name in profiler.list():
+        try:
+            stat = os.stat(os.path.join(profiler.directory, name))
+        except FileNotFoundError:
+            continue
+        profiles.append(ProfileInfo(name=name, size=stat.st_size, created_at=datetime.fromtimestamp(stat.st_mtime)))
+    return profiles
+
+
+@router.get("/profiles/{name}", dependencies=[Depends(get_current_admin)])
+async def read_profile(name: str):
+    """
+    The read_profile function returns a stored profile, to be opened in speedscope (https://www.speedscope.app).
+
+    :param name: str: The name of the profile
+    :return: The profile file
+    :doc-author: Trelent
+    """
+    path = profiler.path(name)
+    if path is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Profile not found")
+    return FileResponse(path, media_type="application/json")
+
+
+@router.post("/profiles/token", response_model=ProfileToken, dependencies=[Depends(get_current_admin)])
+async def create_profile_token(minutes: int = Query(10, ge=1, le=24 * 60)):
+    """
+    The create_profile_token function signs an X-Profile header value.
+    Requests that carry it are profiled until it expires.
+
+    :param minutes: int: How long the header value stays valid
+    :return: The header name, its value and the expiry time
+    :doc-author: Trelent
+    """
+    expires = int(time.time()) + minutes * 60
+    return ProfileToken(header=HEADER, value=sign(expires), expires_at=datetime.fromtimestamp(expires))
@@ -1,51 +1,59 @@
 from fastapi import APIRouter, HTTPException, Depends, status, Security, BackgroundTasks, Request
 from fastapi.security import OAuth2PasswordRequestForm, HTTPAuthorizationCredentials, HTTPBearer
-from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 
-from src.database.db import get_db
+from src.database.db import get_db, identify
 
 from src.repository import users as repository_users
 from src.schemas import UserModel, UserResponse, TokenModel, RequestEmail
 from src.services.auth import auth_service
+from src.services.cache import user_cache
 from src.services.email import send_email
+from src.services.mail_queue import enqueue_email
+from src.services.metrics import MetricsRoute, add_task
+from src.services.refresh_tokens import refresh_tokens
 
-router = APIRouter(prefix='/auth', tags=["auth"])
+router = APIRouter(prefix='/auth', tags=["auth"], route_class=MetricsRoute)
 security = HTTPBearer()
 
 
 @router.post("/signup", response_model=UserResponse, status_code=status.HTTP_201_CREATED)
-async def signup(body: UserModel, background_tasks: BackgroundTasks, request: Request, db: Session = Depends(get_db)):
+async def signup(body: UserModel, background_tasks: BackgroundTasks, request: Request,
+                 db: AsyncSession = Depends(get_db)):
     """
     The signup function creates a new user in the database.
         It takes in a UserModel object, which is validated by pydantic.
         If the email already exists, it will return an HTTP 409 error code (conflict).
-        Otherwise, it will create a new user and send them an email to verify their account.
+        Otherwise, it will create a new user and queue an email to verify their account for the mail worker
+        (or send it in the background when the queue is not available).
 
     :param body: UserModel: Get the data from the request body
     :param background_tasks: BackgroundTasks: Add a task to the background tasks queue
     :param request: Request: Get the base url of the request
-    :param db: Session: Get the database session
+    :param db: AsyncSession: Get the database session
     :return: A dictionary with the new user and a message
     :doc-author: Trelent
     """
     exist_user = await repository_users.get_user_by_email(body.email, db)
     if exist_user:
         raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail="Account already exists")
-    body.password = auth_service.get_password_hash(body.password)
+    body.password = await auth_service.get_password_hash(body.password)
     new_user = await repository_users.create_user(body, db)
-    background_tasks.add_task(send_email, new_user.email, new_user.username, str(request.base_url))
+    if not await enqueue_email(new_user.email, new_user.username, str(request.base_url)):
+        add_task(background_tasks, send_email, new_user.email, new_user.username, str(request.base_url))
     return {"user": new_user, "detail": "User successfully created"}
 
 
 @router.post("/login", response_model=TokenModel)
-async def login(body: OAuth2PasswordRequestForm = Depends(), db: Session = Depends(get_db)):
+async def login(body: OAuth2PasswordRequestForm = Depends(), db: AsyncSession = Depends(get_db)):
     """
     The login function is used to authenticate a user.
         It takes the username and password from the request body,
         verifies that they are correct, and returns an access token.
+        Every login starts a new refresh token family, a session of its own; the user row is not written.
 
     :param body: OAuth2PasswordRequestForm: Validate the request body
-    :param db: Session: Get a database session
+    :param db: AsyncSession: Get a database session
     :return: A dict with the access_token, refresh_token and token type
     :doc-author: Trelent
     """
@@ -54,79 +62,88 @@ async def login(body: OAuth2PasswordRequestForm = Depends(), db: Session = Depen
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid email")
     if not user.confirmed:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Email not confirmed")
-    if not auth_service.verify_password(body.password, user.password):
+    valid, new_hash = await auth_service.verify_and_update_password(body.password, user.password)
+    if not valid:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid password")
+    if new_hash:
+        await repository_users.update_password(user, new_hash, db)
     # Generate JWT
     access_token = await auth_service.create_access_token(data={"sub": user.email})
-    refresh_token = await auth_service.create_refresh_token(data={"sub": user.email})
-    await repository_users.update_token(user, refresh_token, db)
+    family, token_id = await refresh_tokens.start()
+    refresh_token = await auth_service.create_refresh_token(data={"sub": user.email, "fam": family, "jti": token_id})
     return {"access_token": access_token, "refresh_token": refresh_token, "token_type": "bearer"}
 
 
 @router.get('/refresh_token', response_model=TokenModel)
-async def refresh_token(credentials: HTTPAuthorizationCredentials = Security(security), db: Session = Depends(get_db)):
+async def refresh_token(credentials: HTTPAuthorizationCredentials = Security(security),
+                        db: AsyncSession = Depends(get_db)):
     """
     The refresh_token function is used to refresh the access token.
         The function takes in a refresh token and returns an access_token, a new refresh_token, and the type of token.
-        If there is no valid user associated with the given email address or if there are any errors during decoding
-        or creating tokens then an HTTPException will be raised.
+        The refresh token can be used once: it is spent in the refresh token store and replaced by the next one
+        of its family. An unknown, expired or already spent token is refused,
+        and presenting a spent one again revokes its whole family.
+        The user is looked up like for an access token, through the user cache, so a deleted user is refused too.
 
     :param credentials: HTTPAuthorizationCredentials: Get the token from the request header
-    :param db: Session: Access the database
+    :param db: AsyncSession: Get the database session, when the user is not cached
     :return: A dictionary with the access_token, refresh_token and token type
     :doc-author: Trelent
     """
-    token = credentials.credentials
-    email = await auth_service.decode_refresh_token(token)
-    user = await repository_users.get_user_by_email(email, db)
-    if user.refresh_token != token:
-        await repository_users.update_token(user, None, db)
+    payload = await auth_service.decode_refresh_token(credentials.credentials)
+    email, family = payload["sub"], payload.get("fam")
+    await identify(db, email)
+    user = await user_cache.get(email)
+    if user is None:
+        user = await repository_users.get_user_by_email(email, db)
+        if user is None:
+            raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid refresh token")
+        await user_cache.set(user)
+    token_id = await refresh_tokens.rotate(family, payload.get("jti"))
+    if token_id is None:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid refresh token")
 
     access_token = await auth_service.create_access_token(data={"sub": email})
-    refresh_token = await auth_service.create_refresh_token(data={"sub": email})
-    await repository_users.update_token(user, refresh_token, db)
+    refresh_token = await auth_service.create_refresh_token(data={"sub": email, "fam": family, "jti": token_id})
     return {"access_token": access_token, "refresh_token": refresh_token, "token_type": "bearer"}
 
 
 @router.get('/confirmed_email/{token}')
-async def confirmed_email(token: str, db: Session = Depends(get_db)):
+async def confirmed_email(token: str, db: AsyncSession = Depends(get_db)):
     """
     The confirmed_email function is used to confirm a user's email address.
         It takes the token from the URL and uses it to get the user's email address.
-        The function then checks if there is a user with that email in our database, and if not, returns an error message.
-        If there is a user with that email in our database, we check whether their account has already been confirmed or not.
-            If it has been confirmed already, we return another error message saying so; otherwise we call repository_users'
-            confirmed_email function which sets the 'confirmed' field of that particular User object
+        The function then confirms the unconfirmed user with that email in one UPDATE statement.
+        Only if nothing was updated does it look the user up, to tell an already confirmed account
+        from an unknown email, which is an error.
 
     :param token: str: Get the token from the url
-    :param db: Session: Get the database session
+    :param db: AsyncSession: Get the database session
     :return: A message to the user
     :doc-author: Trelent
     """
     email = auth_service.get_email_from_token(token)
+    if await repository_users.confirmed_email(email, db):
+        return {"message": "Email confirmed"}
     user = await repository_users.get_user_by_email(email, db)
     if user is None:
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Verification error")
-    if user.confirmed:
-        return {"message": "Your email is already confirmed"}
-    await repository_users.confirmed_email(email, db)
-    return {"message": "Email confirmed"}
+    return {"message": "Your email is already confirmed"}
 
 
 @router.post('/request_email')
 async def request_email(body: RequestEmail, background_tasks: BackgroundTasks, request: Request,
-                        db: Session = Depends(get_db)):
+                        db: AsyncSession = Depends(get_db)):
     """
     The request_email function is used to send an email to the user with a link that they can click on
     to confirm their email address. The function takes in a RequestEmail object, which contains the
     email of the user who wants to confirm their account. It then checks if there is already an account
-    with that email address and if so, it sends them an email with a confirmation link.
+    with that email address and if so, it queues an email with a confirmation link, like signup.
 
     :param body: RequestEmail: Get the email from the request body
     :param background_tasks: BackgroundTasks: Add a task to the background tasks queue
     :param request: Request: Get the base_url of the application
-    :param db: Session: Pass the database session to the repository layer
+    :param db: AsyncSession: Pass the database session to the repository layer
     :return: A message to the user
     :doc-author: Trelent
     """
@@ -135,5 +152,6 @@ async def request_email(body: RequestEmail, background_tasks: BackgroundTasks, r
     if user:
         if user.confirmed:
             return {"message": "Your email is already confirmed"}
-        background_tasks.add_task(send_email, user.email, user.username, request.base_url)
+        if not await enqueue_email(user.email, user.username, str(request.base_url)):
+            add_task(background_tasks, send_email, user.email, user.username, str(request.base_url))
     return {"message": "Check your email for confirmation."}
@@ -1,76 +1,218 @@
+from datetime import date
 from typing import List
 
-from fastapi import APIRouter, HTTPException, Depends, status, Path
-from fastapi_limiter.depends import RateLimiter
-from sqlalchemy.orm import Session
+from fastapi import APIRouter, HTTPException, Depends, status, Path, Query, UploadFile, File, Request
+from fastapi.responses import StreamingResponse
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
 
-from src.database.db import get_db
+from src.conf.config import settings
+from src.database.db import get_db, read_only
 from src.database.models import User
 from src.repository import contacts as repository_contacts
-from src.schemas import ContactResponse, ContactModel
+from src.schemas import ContactResponse, ContactModel, ContactUpdate, ContactPage, ContactSearchPage, \
+    ContactImportReport, ContactImportError, ContactBatch, ContactBatchReport, ContactOperationResult
 from src.services.auth import auth_service
+from src.services import contact_export
+from src.services.contact_import import iter_contacts, batches
+from src.services.metrics import MetricsRoute
+from src.services.pagination import decode_cursor, encode_cursor, next_cursor
+from src.services.rate_limit import RateLimit
+from src.services.response_cache import response_cache
+from src.services.serialization import contact_dict, contact_dicts
 
-router = APIRouter(prefix='/contacts', tags=["contacts"])
+router = APIRouter(prefix='/contacts', tags=["contacts"], route_class=MetricsRoute)
 
 
 @router.post("/", response_model=ContactResponse, status_code=status.HTTP_201_CREATED,
              description='No more than 1 contact per minute',
-             dependencies=[Depends(RateLimiter(seconds=60))])
-async def create_contact(body: ContactModel, db: Session = Depends(get_db),
-                         _current_user: User = Depends(auth_service.get_current_user)):
+             dependencies=[Depends(RateLimit("contacts:create"))])
+async def create_contact(body: ContactModel, db: AsyncSession = Depends(get_db),
+                         current_user: User = Depends(auth_service.get_current_user)):
     """
     The create_contact function creates a new contact in the database.
         The function takes a ContactModel object as input, and returns the newly created contact.
 
     :param body: ContactModel: Validate the request body
-    :param db: Session: Pass the database session to the repository layer
-    :param _current_user: User: Get the current user from the database
+    :param db: AsyncSession: Pass the database session to the repository layer
+    :param current_user: User: Get the current user from the database
     :return: A contactmodel object
     :doc-author: Trelent
     """
-    return await repository_contacts.create_contact(body, db)
+    return await repository_contacts.create_contact(body, current_user, db)
 
 
-@router.get("/", response_model=List[ContactResponse], description='No more than 10 requests per minute',
-            dependencies=[Depends(RateLimiter(times=10, seconds=60))])
-async def read_contacts(skip: int = 0, limit: int = 10, db: Session = Depends(get_db),
-                        _current_user: User = Depends(auth_service.get_current_user)):
+@router.post("/import", response_model=ContactImportReport, description='No more than 1 import per minute',
+             dependencies=[Depends(RateLimit("contacts:import"))])
+async def import_contacts(file: UploadFile = File(), db: AsyncSession = Depends(get_db),
+                          current_user: User = Depends(auth_service.get_current_user)):
     """
-    The read_contacts function returns a list of contacts.
+    The import_contacts function loads contacts from an uploaded CSV or NDJSON file.
+        CSV files need a header row with the ContactModel field names, NDJSON files hold one JSON object per line.
+        The file is parsed as a stream and valid rows are inserted in batches of contact_import_batch_size,
+        each batch in its own transaction. Rows that fail validation or whose email or phone is already taken
+        are skipped and listed in the report, up to contact_import_max_errors of them.
 
-    :param skip: int: Skip the first n contacts in the database
+    :param file: UploadFile: The CSV (.csv) or NDJSON (.ndjson, .jsonl) file
+    :param db: AsyncSession: Pass the database session to the repository layer
+    :param current_user: User: Get the current user from the database
+    :return: The number of imported and failed rows and the errors of the failed ones
+    :doc-author: Trelent
+    """
+    report = ContactImportReport()
+    async for batch in batches(iter_contacts(file), settings.contact_import_batch_size):
+        valid = [(row, contact) for row, contact in batch if not isinstance(contact, str)]
+        inserted = await repository_contacts.import_contacts([contact for _, contact in valid], current_user, db)
+        report.imported += sum(inserted)
+        failed = [(row, contact) for row, contact in batch if isinstance(contact, str)]
+        failed += [(row, "Contact with this email or phone already exists")
+                   for (row, _), ok in zip(valid, inserted) if not ok]
+        report.failed += len(failed)
+        for row, detail in sorted(failed)[:settings.contact_import_max_errors - len(report.errors)]:
+            report.errors.append(ContactImportError(row=row, detail=detail))
+    return report
+
+
+@router.post("/batch", response_model=ContactBatchReport)
+async def batch_contacts(body: ContactBatch, db: AsyncSession = Depends(get_db),
+                         current_user: User = Depends(auth_service.get_current_user)):
+    """
+    The batch_contacts function updates and deletes up to contact_batch_max_operations contacts in one request.
+        Updates write only the fields they send, like PATCH. The whole batch runs in one transaction:
+        if an update would give a contact an email or phone that is already taken, nothing is applied.
+        Operations on contacts the user does not have are reported with status 404, the others with 200.
+
+    :param body: ContactBatch: The update and delete operations, each contact at most once
+    :param db: AsyncSession: Pass the database session to the repository layer
+    :param current_user: User: Get the current user from the database
+    :return: The result of every operation, in the order of the request
+    :doc-author: Trelent
+    """
+    try:
+        contacts = await repository_contacts.batch_contacts(body.operations, current_user, db)
+    except IntegrityError:
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT,
+                            detail="Contact with this email or phone already exists")
+    return ContactBatchReport(results=[
+        ContactOperationResult(op=operation.op, id=operation.id, status=status.HTTP_200_OK, contact=contact)
+        if contact is not None else
+        ContactOperationResult(op=operation.op, id=operation.id, status=status.HTTP_404_NOT_FOUND,
+                               detail="Contact not found")
+        for operation, contact in zip(body.operations, contacts)])
+
+
+@router.get("/", response_model=ContactPage, description='No more than 10 requests per minute',
+            dependencies=[Depends(RateLimit("contacts:list"))])
+@read_only
+async def read_contacts(request: Request, cursor: str | None = None, limit: int = Query(10, ge=1, le=100),
+                        skip: int = Query(0, ge=0, deprecated=True), db: AsyncSession = Depends(get_db),
+                        current_user: User = Depends(auth_service.get_current_user)):
+    """
+    The read_contacts function returns a page of contacts.
+        Pass the next_cursor of a page as cursor to get the next one; next_cursor is null on the last page.
+        skip is kept for old clients only and is ignored when a cursor is given.
+        Responses are cached and carry an ETag; a request with a current If-None-Match gets a 304.
+
+    :param request: Request: Get the query string and the If-None-Match header
+    :param cursor: str | None: Opaque cursor returned as next_cursor by the previous page
+    :param limit: int: Limit the number of contacts returned
+    :param skip: int: Skip the first n contacts in the database (deprecated)
+    :param db: AsyncSession: Pass the database session to the function
+    :param current_user: User: Get the user from the database
+    :return: A page of contacts and the cursor of the next page
+    :doc-author: Trelent
+    """
+    async def build():
+        after_id = decode_cursor(cursor) if cursor else None
+        contacts = await repository_contacts.get_contacts(skip, limit, current_user, db, after_id)
+        return {"items": contact_dicts(contacts), "next_cursor": next_cursor(contacts, limit)}
+
+    return await response_cache.respond(request, current_user.id, build)
+
+
+@router.get("/export", response_class=StreamingResponse, description='No more than 1 export per minute',
+            dependencies=[Depends(RateLimit("contacts:export"))])
+@read_only
+async def export_contacts(format: str = Query("ndjson", regex="^(csv|ndjson)$"), db: AsyncSession = Depends(get_db),
+                          current_user: User = Depends(auth_service.get_current_user)):
+    """
+    The export_contacts function streams all contacts of the current user as CSV or NDJSON, ordered by id.
+        Rows are read from a server-side cursor and written out batch by batch,
+        so memory use stays the same however many contacts there are.
+
+    :param format: str: Export format, csv or ndjson
+    :param db: AsyncSession: Pass the database session to the repository layer
+    :param current_user: User: Get the current user from the database
+    :return: A streaming response with one line per contact
+    :doc-author: Trelent
+    """
+    rows = repository_contacts.stream_contacts(current_user, db, contact_export.FIELDS,
+                                               settings.contact_export_batch_size)
+    return StreamingResponse(contact_export.export(format, rows), media_type=contact_export.MEDIA_TYPES[format],
+                             headers={"Content-Disposition": f'attachment; filename="contacts.{format}"'})
+
+
+@router.get("/search", response_model=ContactSearchPage)
+@read_only
+async def search_contacts(request: Request, q: str = Query(min_length=1, max_length=100), cursor: str | None = None,
+                          limit: int = Query(10, ge=1, le=50), db: AsyncSession = Depends(get_db),
+                          current_user: User = Depends(auth_service.get_current_user)):
+    """
+    The search_contacts function searches the user's contacts by firstname, lastname, email, phone and description.
+        Every word of q must match the start of a word in one of the fields; the best matches come first.
+        With contact_search_trigram on Postgres, contacts whose names, email or phone are similar to q also match,
+        so typos are tolerated.
+        Results are paged and cached like read_contacts. On Postgres only the first contact_search_max_matches
+        matches are ranked; truncated is then true, the rest cannot be paged to and q should be narrowed.
+
+    :param request: Request: Get the query string and the If-None-Match header
+    :param q: str: The words to search for
+    :param cursor: str | None: Opaque cursor returned as next_cursor by the previous page
     :param limit: int: Limit the number of contacts returned
-    :param db: Session: Pass the database session to the function
-    :param _current_user: User: Get the user from the database
-    :return: A list of contacts
+    :param db: AsyncSession: Pass the database session to the repository layer
+    :param current_user: User: Get the current user logged in
+    :return: A page of contacts, best match first, the cursor of the next page and whether matches were left out
     :doc-author: Trelent
     """
-    contacts = await repository_contacts.get_contacts(skip, limit, db)
-    return contacts
+    async def build():
+        # ranked results have no stable key order, so the cursor holds the offset of the next page
+        offset = decode_cursor(cursor) if cursor else 0
+        contacts, more, truncated = await repository_contacts.search_contacts(q, current_user, db, limit, offset)
+        return {"items": contact_dicts(contacts),
+                "next_cursor": encode_cursor(offset + limit) if more else None,
+                "truncated": truncated}
+
+    return await response_cache.respond(request, current_user.id, build)
 
 
 @router.get("/{contact_id}", response_model=ContactResponse)
-async def read_contact(contact_id: int, db: Session = Depends(get_db),
-                       _current_user: User = Depends(auth_service.get_current_user)):
+@read_only
+async def read_contact(request: Request, contact_id: int, db: AsyncSession = Depends(get_db),
+                       current_user: User = Depends(auth_service.get_current_user)):
     """
     The read_contact function is used to retrieve a single contact from the database.
     It takes in an integer representing the ID of the contact, and returns a Contact object.
+    The response is cached and carries an ETag like read_contacts.
 
+    :param request: Request: Get the If-None-Match header
     :param contact_id: int: Specify the type of data that is expected in the url path
-    :param db: Session: Pass the database connection to the repository layer
-    :param _current_user: User: Get the current user
+    :param db: AsyncSession: Pass the database connection to the repository layer
+    :param current_user: User: Get the current user
     :return: A contact object
     :doc-author: Trelent
     """
-    contact = await repository_contacts.get_contact(contact_id, db)
-    if contact is None:
-        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Contact not found")
-    return contact
+    async def build():
+        contact = await repository_contacts.get_contact(contact_id, current_user, db)
+        if contact is None:
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Contact not found")
+        return contact_dict(contact)
+
+    return await response_cache.respond(request, current_user.id, build)
 
 
 @router.put("/{contact_id}", response_model=ContactResponse)
-async def update_contact(body: ContactModel, contact_id: int = Path(ge=1), db: Session = Depends(get_db),
-                         _current_user: User = Depends(auth_service.get_current_user)):
+async def update_contact(body: ContactModel, contact_id: int = Path(ge=1), db: AsyncSession = Depends(get_db),
+                         current_user: User = Depends(auth_service.get_current_user)):
     """
     The update_contact function updates a contact in the database.
         The function takes an id and a body as input, and returns the updated contact.
@@ -78,64 +220,106 @@ async def update_contact(body: ContactModel, contact_id: int = Path(ge=1), db: S
 
     :param body: ContactModel: Get the data from the request body
     :param contact_id: int: Specify the contact id that is being updated
-    :param db: Session: Get the database session
-    :param _current_user: User: Get the current user from the auth_service
+    :param db: AsyncSession: Get the database session
+    :param current_user: User: Get the current user from the auth_service
+    :return: The updated contact
+    :doc-author: Trelent
+    """
+    contact = await repository_contacts.update_contact(contact_id, body, current_user, db)
+    if contact is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Contact not found")
+    return contact
+
+
+@router.patch("/{contact_id}", response_model=ContactResponse)
+async def patch_contact(body: ContactUpdate, contact_id: int = Path(ge=1), db: AsyncSession = Depends(get_db),
+                        current_user: User = Depends(auth_service.get_current_user)):
+    """
+    The patch_contact function partially updates a contact in the database.
+        Only the fields present in the request body are written; the others keep their values.
+        If no contact is found with that id, it raises an HTTPException.
+
+    :param body: ContactUpdate: Get the fields to change from the request body
+    :param contact_id: int: Specify the contact id that is being updated
+    :param db: AsyncSession: Get the database session
+    :param current_user: User: Get the current user from the auth_service
     :return: The updated contact
     :doc-author: Trelent
     """
-    contact = await repository_contacts.update_contact(contact_id, body, db)
+    contact = await repository_contacts.update_contact(contact_id, body, current_user, db)
     if contact is None:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Contact not found")
     return contact
 
 
 @router.delete("/{contact_id}", response_model=ContactResponse)
-async def remove_contact(contact_id: int, db: Session = Depends(get_db),
-                         _current_user: User = Depends(auth_service.get_current_user)):
+async def remove_contact(contact_id: int, db: AsyncSession = Depends(get_db),
+                         current_user: User = Depends(auth_service.get_current_user)):
     """
     The remove_contact function removes a contact from the database.
 
     :param contact_id: int: Specify the contact to be removed
-    :param db: Session: Pass the database session to the function
-    :param _current_user: User: Get the current user from the auth_service
+    :param db: AsyncSession: Pass the database session to the function
+    :param current_user: User: Get the current user from the auth_service
     :return: The removed contact
     :doc-author: Trelent
     """
-    contact = await repository_contacts.remove_contact(contact_id, db)
+    contact = await repository_contacts.remove_contact(contact_id, current_user, db)
     if contact is None:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Contact not found")
     return contact
 
 
-@router.get("/query/", response_model=List[ContactResponse])
-async def querys_contacts(firstname: str = '', lastname: str = '', email: str = '', db: Session = Depends(get_db),
-                          _current_user: User = Depends(auth_service.get_current_user)):
+@router.get("/query/", response_model=ContactPage)
+@read_only
+async def querys_contacts(request: Request, firstname: str | None = None, lastname: str | None = None, email: str | None = None,
+                          cursor: str | None = None, limit: int = Query(10, ge=1, le=100),
+                          db: AsyncSession = Depends(get_db),
+                          current_user: User = Depends(auth_service.get_current_user)):
     """
     The querys_contacts function is used to query the contacts table in the database.
         The function takes three parameters: firstname, lastname and email.
-        If a parameter is not provided, it will be set to an empty string by default.
-
-    :param firstname: str: Pass the firstname of the contact to be queried
-    :param lastname: str: Search for a contact by lastname
-    :param email: str: Query the database for a specific contact
-    :param db: Session: Pass the database session to the repository layer
-    :param _current_user: User: Get the current user logged in
-    :return: A list of contacts
+        A contact matches when any given field starts with the parameter, ignoring case; empty parameters are skipped.
+        Results are paged and cached like read_contacts.
+
+    :param request: Request: Get the query string and the If-None-Match header
+    :param firstname: str | None: Pass the firstname prefix of the contact to be queried
+    :param lastname: str | None: Search for a contact by lastname prefix
+    :param email: str | None: Query the database for a contact by email prefix
+    :param cursor: str | None: Opaque cursor returned as next_cursor by the previous page
+    :param limit: int: Limit the number of contacts returned
+    :param db: AsyncSession: Pass the database session to the repository layer
+    :param current_user: User: Get the current user logged in
+    :return: A page of contacts and the cursor of the next page
     :doc-author: Trelent
     """
-    contacts = await repository_contacts.querys_contacts(firstname, lastname, email, db)
-    return contacts
+    async def build():
+        after_id = decode_cursor(cursor) if cursor else None
+        contacts = await repository_contacts.querys_contacts(firstname, lastname, email, current_user, db, limit,
+                                                             after_id)
+        return {"items": contact_dicts(contacts), "next_cursor": next_cursor(contacts, limit)}
+
+    return await response_cache.respond(request, current_user.id, build)
 
 
 @router.get("/birthdays/", response_model=List[ContactResponse])
-async def birthdays(db: Session = Depends(get_db), _current_user: User = Depends(auth_service.get_current_user)):
+@read_only
+async def birthdays(request: Request, days: int = Query(7, ge=1, le=365), db: AsyncSession = Depends(get_db),
+                    current_user: User = Depends(auth_service.get_current_user)):
     """
-    The birthdays function returns a list of contacts with birthdays in the current month.
+    The birthdays function returns a list of contacts with birthdays in the next days, today included.
+    The response is cached like read_contacts; the window moves every day, so the date is part of the ETag.
 
-    :param db: Session: Get the database session
-    :param _current_user: User: Get the current user,
-    :return: A list of contacts that have birthdays today
+    :param request: Request: Get the query string and the If-None-Match header
+    :param days: int: Length of the window in days
+    :param db: AsyncSession: Get the database session
+    :param current_user: User: Get the current user,
+    :return: A list of contacts that have birthdays within the window, soonest first
     :doc-author: Trelent
     """
-    contacts = await repository_contacts.birthdays(db)
-    return contacts
+    today = date.today()
+
+    async def build():
+        return contact_dicts(await repository_contacts.birthdays(current_user, db, days, today))
+
+    return await response_cache.respond(request, current_user.id, build, [("today", today.isoformat())])
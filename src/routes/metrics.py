@@ -0,0 +1,76 @@
+import logging
+
+from fastapi import APIRouter, Response
+from redis.exceptions import RedisError
+from sqlalchemy.pool import QueuePool
+
+from src.conf.config import settings
+from src.database import redis_db
+from src.database.db import engine, replicas
+from src.services import metrics
+from src.services.auth import auth_service
+from src.services.cache import user_cache
+
+logger = logging.getLogger(__name__)
+
+router = APIRouter(tags=["metrics"])
+
+
+def collect_pools():
+    """
+    The collect_pools function sets the pool gauges of the primary database and of every read replica.
+
+    :return: Nothing
+    :doc-author: Trelent
+    """
+    engines = [("primary", engine)] + [(f"replica{i}", replica) for i, replica in enumerate(replicas.engines)]
+    for name, db_engine in engines:
+        pool = db_engine.pool
+        if isinstance(pool, QueuePool):
+            metrics.pool_size.set(name, value=pool.size())
+            metrics.pool_checked_out.set(name, value=pool.checkedout())
+            # negative while the pool itself is not full yet
+            metrics.pool_overflow.set(name, value=max(0, pool.overflow()))
+
+
+async def collect_email_queue():
+    """
+    The collect_email_queue function sets the email queue gauges from the outbox stream,
+    its retry set and its dead-letter stream. Without Redis they are left as they were.
+
+    :return: Nothing
+    :doc-author: Trelent
+    """
+    redis = redis_db.redis_client
+    if redis is None:
+        return
+    try:
+        async with redis.pipeline(transaction=False) as pipe:
+            pipe.xlen(settings.mail_stream)
+            pipe.zcard(f"{settings.mail_stream}:retry")
+            pipe.xlen(f"{settings.mail_stream}:dead")
+            outbox, retry, dead = await pipe.execute()
+    except RedisError as err:
+        logger.warning("email queue depth unavailable: %s", err)
+        return
+    metrics.email_queue.set("outbox", value=outbox)
+    metrics.email_queue.set("retry", value=retry)
+    metrics.email_queue.set("dead", value=dead)
+
+
+@router.get("/metrics", include_in_schema=False)
+async def read_metrics():
+    """
+    The read_metrics function returns the metrics of this worker in the Prometheus text format.
+    Gauges of state kept elsewhere, the database pools, the password hashing pool, the user cache and the email queue,
+    are sampled first.
+
+    :return: The metrics
+    :doc-author: Trelent
+    """
+    collect_pools()
+    metrics.password_jobs.set(value=auth_service.password_jobs)
+    metrics.password_workers.set(value=settings.password_hash_workers)
+    metrics.user_cache_size.set(value=len(user_cache.local))
+    await collect_email_queue()
+    return Response(metrics.registry.render(), media_type=metrics.CONTENT_TYPE)
@@ -1,19 +1,21 @@
 from fastapi import APIRouter, Depends, status, UploadFile, File
-from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 import cloudinary
 import cloudinary.uploader
 
-from src.database.db import get_db
+from src.database.db import get_db, read_only
 from src.database.models import User
 from src.repository import users as repository_users
 from src.services.auth import auth_service
+from src.services.metrics import MetricsRoute
 from src.conf.config import settings
 from src.schemas import UserDb
 
-router = APIRouter(prefix="/users", tags=["users"])
+router = APIRouter(prefix="/users", tags=["users"], route_class=MetricsRoute)
 
 
 @router.get("/me/", response_model=UserDb)
+@read_only
 async def read_users_me(current_user: User = Depends(auth_service.get_current_user)):
     """
     The read_users_me function is a GET endpoint that returns the current user's information.
@@ -28,17 +30,17 @@ async def read_users_me(current_user: User = Depends(auth_service.get_current_us
 
 @router.patch('/avatar', response_model=UserDb)
 async def update_avatar_user(file: UploadFile = File(), current_user: User = Depends(auth_service.get_current_user),
-                             db: Session = Depends(get_db)):
+                             db: AsyncSession = Depends(get_db)):
     """
     The update_avatar_user function updates the avatar of a user.
         Args:
             file (UploadFile): The image to be uploaded as an avatar.
             current_user (User): The user whose avatar is being updated.  This is passed in by the auth_service dependency, which uses JWT tokens to authenticate users and pass them into functions that require authentication.  See auth/auth_service for more details on how this works under the hood!
-            db (Session): A database session object used for querying and updating data in our PostgreSQL database using SQLAlchemy's ORM syntax!
+            db (AsyncSession): A database session object used for querying and updating data in our PostgreSQL database using SQLAlchemy's ORM syntax!
 
     :param file: UploadFile: Get the file from the request body
     :param current_user: User: Get the current user's information
-    :param db: Session: Get the database session
+    :param db: AsyncSession: Get the database session
     :return: The updated user object
     :doc-author: Trelent
     """
@@ -1,5 +1,9 @@
 from datetime import datetime
-from pydantic import BaseModel, Field, EmailStr
+from typing import List, Literal
+
+from pydantic import BaseModel, Field, EmailStr, validator
+
+from src.conf.config import settings
 
 
 class ContactModel(BaseModel):
@@ -11,13 +15,28 @@ class ContactModel(BaseModel):
     description: str = Field(max_length=150)
 
 
+class ContactUpdate(BaseModel):
+    firstname: str = Field(None, max_length=25)
+    lastname: str = Field(None, max_length=25)
+    email: EmailStr = None
+    phone: str = None
+    birthday: datetime = None
+    description: str = Field(None, max_length=150)
+
+    @validator("*", pre=True)
+    def not_null(cls, value):
+        if value is None:
+            raise ValueError("may be omitted but not null")
+        return value
+
+
 class ContactResponse(BaseModel):
     id: int
     firstname: str
     lastname: str
     email: EmailStr
     phone: str
-    birthday: datetime
+    birthday: datetime | None
     description: str
     created_at: datetime
     updated_at: datetime
@@ -26,6 +45,60 @@ class ContactResponse(BaseModel):
         orm_mode = True
 
 
+class ContactPage(BaseModel):
+    items: List[ContactResponse]
+    next_cursor: str | None = None
+
+
+class ContactSearchPage(ContactPage):
+    truncated: bool = False
+
+
+class ContactImportError(BaseModel):
+    row: int
+    detail: str
+
+
+class ContactImportReport(BaseModel):
+    imported: int = 0
+    failed: int = 0
+    errors: List[ContactImportError] = []
+
+
+class ContactOperation(BaseModel):
+    op: Literal["update", "delete"]
+    id: int = Field(ge=1)
+    data: ContactUpdate | None = None
+
+    @validator("data", always=True)
+    def data_for_update(cls, value, values):
+        if values.get("op") == "update" and value is None:
+            raise ValueError("required for update")
+        return value
+
+
+class ContactBatch(BaseModel):
+    operations: List[ContactOperation] = Field(min_items=1, max_items=settings.contact_batch_max_operations)
+
+    @validator("operations")
+    def unique_contacts(cls, value):
+        if len({operation.id for operation in value}) < len(value):
+            raise ValueError("each contact may appear only once per batch")
+        return value
+
+
+class ContactOperationResult(BaseModel):
+    op: str
+    id: int
+    status: int
+    contact: ContactResponse | None = None
+    detail: str | None = None
+
+
+class ContactBatchReport(BaseModel):
+    results: List[ContactOperationResult]
+
+
 class UserModel(BaseModel):
     username: str = Field(min_length=3, max_length=16)
     email: str
@@ -56,3 +129,15 @@ class TokenModel(BaseModel):
 
 class RequestEmail(BaseModel):
     email: EmailStr
+
+
+class ProfileInfo(BaseModel):
+    name: str
+    size: int
+    created_at: datetime
+
+
+class ProfileToken(BaseModel):
+    header: str
+    value: str
+    expires_at: datetime
@@ -0,0 +1,134 @@
+import json
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+from typing import Any, Hashable
+
+from redis.exceptions import RedisError
+
+from src.conf.config import settings
+from src.database import redis_db
+from src.database.models import User
+from src.services.metrics import user_cache_lookups
+
+
+class LRUCache:
+    """
+    Bounded, thread-safe LRU map whose entries expire at a given time.monotonic() deadline.
+    """
+
+    def __init__(self, maxsize: int):
+        self.maxsize = maxsize
+        self._data: OrderedDict[Hashable, tuple[float, Any]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable) -> Any | None:
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return None
+            expires_at, value = item
+            if expires_at <= time.monotonic():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key: Hashable, value: Any, expires_at: float) -> None:
+        with self._lock:
+            self._data[key] = (expires_at, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def delete(self, key: Hashable) -> None:
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+
+class UserCache:
+    """
+    Two-level cache of the user record looked up on every authenticated request.
+
+    L1 is a small in-process LRU with a TTL of a few seconds, L2 is Redis with a longer TTL.
+    Only the fields routes read from the current user are cached: never the password hash.
+    Writes to the user row must call invalidate(); other workers' L1 copies age out within local_ttl.
+    """
+    FIELDS = ("id", "username", "email", "created_at", "avatar", "confirmed")
+
+    def __init__(self, ttl: int, local_ttl: float, local_maxsize: int):
+        self.ttl = ttl
+        self.local_ttl = local_ttl
+        self.local = LRUCache(local_maxsize)
+        self.local_hits = 0
+        self.redis_hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def key(email: str) -> str:
+        return f"user:{email}"
+
+    async def get(self, email: str) -> User | None:
+        data = self.local.get(email)
+        if data is not None:
+            self.local_hits += 1
+            user_cache_lookups.inc("local")
+            return self._to_user(data)
+        redis = redis_db.redis_client
+        if redis is not None:
+            try:
+                raw = await redis.get(self.key(email))
+            except RedisError:
+                raw = None
+            if raw is not None:
+                self.redis_hits += 1
+                user_cache_lookups.inc("redis")
+                data = json.loads(raw)
+                self.local.set(email, data, time.monotonic() + self.local_ttl)
+                return self._to_user(data)
+        self.misses += 1
+        user_cache_lookups.inc("miss")
+        return None
+
+    async def set(self, user: User) -> None:
+        data = {field: getattr(user, field) for field in self.FIELDS}
+        if data["created_at"] is not None:
+            data["created_at"] = data["created_at"].isoformat()
+        self.local.set(user.email, data, time.monotonic() + self.local_ttl)
+        redis = redis_db.redis_client
+        if redis is not None:
+            try:
+                await redis.set(self.key(user.email), json.dumps(data), ex=self.ttl)
+            except RedisError:
+                pass
+
+    async def invalidate(self, email: str) -> None:
+        self.local.delete(email)
+        redis = redis_db.redis_client
+        if redis is not None:
+            try:
+                await redis.delete(self.key(email))
+            except RedisError:
+                pass
+
+    def stats(self) -> dict:
+        return {"local_hits": self.local_hits, "redis_hits": self.redis_hits, "misses": self.misses,
+                "local_size": len(self.local)}
+
+    @staticmethod
+    def _to_user(data: dict) -> User:
+        data = dict(data)
+        if data["created_at"] is not None:
+            data["created_at"] = datetime.fromisoformat(data["created_at"])
+        return User(**data)
+
+
+user_cache = UserCache(settings.user_cache_ttl, settings.user_cache_local_ttl, settings.user_cache_local_size)
@@ -0,0 +1,37 @@
+import csv
+import io
+from datetime import datetime
+from typing import AsyncIterator, List
+
+import orjson
+from sqlalchemy import Row
+
+FIELDS = ("id", "firstname", "lastname", "email", "phone", "birthday", "description", "created_at", "updated_at")
+MEDIA_TYPES = {"csv": "text/csv; charset=utf-8", "ndjson": "application/x-ndjson"}
+
+
+def _isoformat(value):
+    return value.isoformat() if isinstance(value, datetime) else value
+
+
+async def to_csv(batches: AsyncIterator[List[Row]]) -> AsyncIterator[bytes]:
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(FIELDS)
+    async for rows in batches:
+        writer.writerows([_isoformat(value) for value in row] for row in rows)
+        # one chunk per fetched batch, the buffer is reset so it never holds more than one batch
+        yield buffer.getvalue().encode()
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue().encode()
+
+
+async def to_ndjson(batches: AsyncIterator[List[Row]]) -> AsyncIterator[bytes]:
+    async for rows in batches:
+        yield b"".join(orjson.dumps(dict(zip(FIELDS, row))) + b"\n" for row in rows)
+
+
+def export(export_format: str, batches: AsyncIterator[List[Row]]) -> AsyncIterator[bytes]:
+    return to_csv(batches) if export_format == "csv" else to_ndjson(batches)
@@ -0,0 +1,103 @@
+import codecs
+import csv
+import json
+from typing import AsyncIterator, List, Tuple
+
+from fastapi import HTTPException, UploadFile, status
+from pydantic import ValidationError
+
+from src.schemas import ContactModel
+
+CSV_TYPES = ("text/csv", "application/csv", "application/vnd.ms-excel")
+NDJSON_TYPES = ("application/x-ndjson", "application/ndjson", "application/jsonl", "application/json-lines")
+
+
+def detect_format(file: UploadFile) -> str:
+    filename = (file.filename or "").lower()
+    content_type = (file.content_type or "").split(";")[0].strip().lower()
+    if content_type in CSV_TYPES or filename.endswith(".csv"):
+        return "csv"
+    if content_type in NDJSON_TYPES or filename.endswith((".ndjson", ".jsonl")):
+        return "ndjson"
+    raise HTTPException(status_code=status.HTTP_415_UNSUPPORTED_MEDIA_TYPE,
+                        detail="Upload a CSV (.csv) or NDJSON (.ndjson, .jsonl) file")
+
+
+async def iter_lines(file: UploadFile, chunk_size: int = 64 * 1024) -> AsyncIterator[str]:
+    # the upload is spooled to a temporary file by the multipart parser; only one chunk is decoded at a time
+    decoder = codecs.getincrementaldecoder("utf-8-sig")()
+    tail = ""
+    while chunk := await file.read(chunk_size):
+        lines = (tail + decoder.decode(chunk)).splitlines(keepends=True)
+        tail = lines.pop() if lines and not lines[-1].endswith(("\n", "\r")) else ""
+        for line in lines:
+            yield line
+    tail += decoder.decode(b"", final=True)
+    if tail:
+        yield tail
+
+
+async def iter_csv(lines: AsyncIterator[str]) -> AsyncIterator[Tuple[int, dict | str]]:
+    header = None
+    record = []
+    row = 0
+    async for line in lines:
+        record.append(line)
+        # a quoted field may contain line breaks: the record ends once its quotes are balanced
+        if sum(part.count('"') for part in record) % 2:
+            continue
+        values = next(csv.reader(record), [])
+        record = []
+        if not any(value.strip() for value in values):
+            continue
+        if header is None:
+            header = [value.strip().lower() for value in values]
+            continue
+        row += 1
+        if len(values) != len(header):
+            yield row, f"Expected {len(header)} columns, got {len(values)}"
+        else:
+            yield row, dict(zip(header, values))
+    if record:
+        yield row + 1, "Unterminated quoted field"
+
+
+async def iter_ndjson(lines: AsyncIterator[str]) -> AsyncIterator[Tuple[int, dict | str]]:
+    row = 0
+    async for line in lines:
+        if not line.strip():
+            continue
+        row += 1
+        try:
+            data = json.loads(line)
+        except ValueError as e:
+            yield row, f"Invalid JSON: {e}"
+            continue
+        yield row, data if isinstance(data, dict) else "Expected a JSON object"
+
+
+async def iter_contacts(file: UploadFile) -> AsyncIterator[Tuple[int, ContactModel | str]]:
+    """
+    Yields (row number, ContactModel) for every valid record of the upload and (row number, error) for the rest.
+    Rows are numbered from 1, not counting the CSV header and blank lines.
+    """
+    parse = iter_csv if detect_format(file) == "csv" else iter_ndjson
+    async for row, data in parse(iter_lines(file)):
+        if isinstance(data, str):
+            yield row, data
+            continue
+        try:
+            yield row, ContactModel(**data)
+        except ValidationError as e:
+            yield row, "; ".join(f"{'.'.join(map(str, error['loc']))}: {error['msg']}" for error in e.errors())
+
+
+async def batches(items: AsyncIterator, size: int) -> AsyncIterator[List]:
+    batch = []
+    async for item in items:
+        batch.append(item)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
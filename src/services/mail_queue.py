@@ -0,0 +1,199 @@
+import asyncio
+import json
+import logging
+import os
+import socket
+import time
+from email.message import EmailMessage
+from email.utils import formataddr
+
+import aiosmtplib
+from redis.exceptions import RedisError, ResponseError
+
+from src.conf.config import settings
+from src.database import redis_db
+from src.services.auth import auth_service
+from src.services.email import conf
+
+logger = logging.getLogger(__name__)
+
+GROUP = "mailers"
+
+# Moves job ARGV[1] from retry set KEYS[1] back to stream KEYS[2], with fields ARGV[2..]: at once, so a crash
+# in between cannot lose it, and only if it was still in the set, so a job due for several workers is queued once.
+REQUEUE = """
+if redis.call('ZREM', KEYS[1], ARGV[1]) == 0 then
+    return 0
+end
+redis.call('XADD', KEYS[2], '*', unpack(ARGV, 2))
+return 1
+"""
+
+
+async def enqueue_email(email: str, username: str, host: str) -> bool:
+    """
+    Adds a confirmation email to the outbox stream. Returns False when Redis is not available,
+    so the caller can fall back to sending the email itself.
+    """
+    redis = redis_db.redis_client
+    if redis is None:
+        return False
+    try:
+        await redis.xadd(settings.mail_stream, {"email": email, "username": username, "host": str(host),
+                                                "attempts": 0})
+    except RedisError as err:
+        logger.warning("could not queue email to %s: %s", email, err)
+        return False
+    return True
+
+
+def build_message(email: str, username: str, host: str) -> EmailMessage:
+    token = auth_service.create_email_token({"sub": email})
+    template = conf.template_engine().get_template("email_template.html")
+    message = EmailMessage()
+    message["Subject"] = "Confirm your email"
+    message["From"] = formataddr((conf.MAIL_FROM_NAME, conf.MAIL_FROM))
+    message["To"] = email
+    message.set_content(template.render(host=host, username=username, token=token), subtype="html")
+    return message
+
+
+class MailWorker:
+    """
+    Sends the emails queued in the outbox stream over one persistent SMTP connection.
+
+    Jobs are read in batches through a consumer group and acknowledged once sent, so a crashed worker's jobs
+    are picked up again (by itself on restart, or by another worker once they have been idle for
+    mail_claim_idle_ms). Temporary failures are retried with exponential backoff through a sorted set of due
+    times; permanent (5xx) failures and jobs out of attempts go to the dead-letter stream.
+    At most mail_rate_limit messages are sent per second.
+    """
+
+    def __init__(self, redis, hostname: str = settings.mail_server, port: int = settings.mail_port,
+                 use_tls: bool = True, username: str | None = settings.mail_username,
+                 password: str | None = settings.mail_password, consumer: str | None = None):
+        self.redis = redis
+        self.smtp = aiosmtplib.SMTP(hostname=hostname, port=port, use_tls=use_tls)
+        self.username = username
+        self.password = password
+        self.consumer = consumer or f"{socket.gethostname()}-{os.getpid()}"
+        self.stream = settings.mail_stream
+        self.retry_key = f"{self.stream}:retry"
+        self.dead_stream = f"{self.stream}:dead"
+        self.interval = 1 / settings.mail_rate_limit
+        self.last_sent = 0.0
+        self.pending = True
+        self.requeue = redis.register_script(REQUEUE)
+
+    async def setup(self):
+        try:
+            await self.redis.xgroup_create(self.stream, GROUP, id="0", mkstream=True)
+        except ResponseError as err:
+            if "BUSYGROUP" not in str(err):
+                raise
+
+    async def connect(self):
+        if not self.smtp.is_connected:
+            await self.smtp.connect()
+            if self.username:
+                await self.smtp.login(self.username, self.password)
+
+    async def close(self):
+        if self.smtp.is_connected:
+            try:
+                await self.smtp.quit()
+            except aiosmtplib.SMTPException:
+                self.smtp.close()
+
+    async def send(self, job: dict):
+        message = build_message(job["email"], job["username"], job["host"])
+        delay = self.last_sent + self.interval - time.monotonic()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        try:
+            await self.connect()
+            await self.smtp.send_message(message)
+        except aiosmtplib.SMTPServerDisconnected:
+            # the server dropped the idle connection: reconnect once
+            self.smtp.close()
+            await self.connect()
+            await self.smtp.send_message(message)
+        finally:
+            self.last_sent = time.monotonic()
+
+    async def fail(self, job: dict, err: Exception):
+        attempts = int(job.get("attempts", 0)) + 1
+        permanent = isinstance(err, aiosmtplib.SMTPResponseException) and err.code >= 500
+        if permanent or attempts >= settings.mail_max_attempts:
+            logger.error("giving up on email to %s after %d attempts: %s", job.get("email"), attempts, err)
+            await self.redis.xadd(self.dead_stream, {**job, "attempts": attempts, "error": str(err)})
+            return
+        due = time.time() + settings.mail_retry_backoff * 2 ** (attempts - 1)
+        logger.warning("email to %s failed (attempt %d), retrying in %.0fs: %s", job.get("email"), attempts,
+                       due - time.time(), err)
+        await self.redis.zadd(self.retry_key, {json.dumps({**job, "attempts": attempts}): due})
+
+    async def requeue_due(self):
+        due = await self.redis.zrangebyscore(self.retry_key, "-inf", time.time(), start=0,
+                                             num=settings.mail_batch_size)
+        for job in due:
+            fields = [item for field in json.loads(job).items() for item in field]
+            await self.requeue(keys=[self.retry_key, self.stream], args=[job, *fields])
+
+    async def read_batch(self, block: int | None) -> list:
+        if self.pending:
+            # jobs this consumer read but did not acknowledge before a restart
+            entries = await self.redis.xreadgroup(GROUP, self.consumer, {self.stream: "0"},
+                                                  count=settings.mail_batch_size)
+            batch = entries[0][1] if entries else []
+            if batch:
+                return batch
+            self.pending = False
+        _, claimed, *_ = await self.redis.xautoclaim(self.stream, GROUP, self.consumer,
+                                                     settings.mail_claim_idle_ms, "0-0",
+                                                     count=settings.mail_batch_size)
+        if claimed:
+            return claimed
+        entries = await self.redis.xreadgroup(GROUP, self.consumer, {self.stream: ">"},
+                                              count=settings.mail_batch_size, block=block)
+        return entries[0][1] if entries else []
+
+    async def run_once(self, block: int | None = None) -> int:
+        """
+        Sends one batch and returns the number of jobs processed.
+        """
+        await self.requeue_due()
+        batch = await self.read_batch(block)
+        done = []
+        for message_id, job in batch:
+            if not job:
+                # deleted from the stream after being read, i.e. already handled
+                done.append(message_id)
+                continue
+            try:
+                await self.send(job)
+            except (aiosmtplib.SMTPException, OSError) as err:
+                await self.fail(job, err)
+            except Exception as err:
+                # e.g. a template error: retried and dead-lettered like any failure, instead of stopping
+                # the worker on the same job again at every restart
+                logger.exception("unexpected error sending email to %s", job.get("email"))
+                await self.fail(job, err)
+            done.append(message_id)
+        if done:
+            await self.redis.xack(self.stream, GROUP, *done)
+            await self.redis.xdel(self.stream, *done)
+        return len(batch)
+
+    async def run(self):
+        await self.setup()
+        logger.info("mail worker %s started", self.consumer)
+        try:
+            while True:
+                try:
+                    await self.run_once(block=1000)
+                except RedisError as err:
+                    logger.error("redis error: %s", err)
+                    await asyncio.sleep(1)
+        finally:
+            await self.close()
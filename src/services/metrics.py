@@ -0,0 +1,192 @@
+import time
+from bisect import bisect_left
+
+from fastapi import BackgroundTasks
+from fastapi.exceptions import RequestValidationError
+from fastapi.routing import APIRoute
+from starlette.background import BackgroundTask
+from starlette.exceptions import HTTPException
+from starlette.types import Message, Receive, Scope, Send
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.075, 0.1, 0.25, 0.5, 0.75, 1.0, 2.5, 5.0, 7.5, 10.0)
+REDIS_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0)
+
+
+def escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def render_labels(names: tuple[str, ...], values: tuple, extra: str = "") -> str:
+    labels = [f'{name}="{escape(str(value))}"' for name, value in zip(names, values)]
+    if extra:
+        labels.append(extra)
+    return "{" + ",".join(labels) + "}" if labels else ""
+
+
+class Metric:
+    """
+    A metric family: one value, or one series per combination of label values.
+
+    Metrics are only changed on the event loop thread of the worker, so an update is a plain dict lookup and
+    increment with no lock to take, and a scrape, which runs on the same thread, never sees half an update.
+    Each worker process exposes its own metrics.
+    """
+    kind = ""
+
+    def __init__(self, name: str, description: str, labels: tuple[str, ...] = ()):
+        self.name = name
+        self.description = description
+        self.labels = labels
+        self.values: dict[tuple, float] = {}
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} {self.kind}"]
+        for values, value in self.values.items():
+            lines.append(f"{self.name}{render_labels(self.labels, values)} {value}")
+        return lines
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, *labels, amount: float = 1) -> None:
+        self.values[labels] = self.values.get(labels, 0) + amount
+
+
+class Gauge(Metric):
+    kind = "gauge"
+
+    def set(self, *labels, value: float) -> None:
+        self.values[labels] = value
+
+    def inc(self, *labels, amount: float = 1) -> None:
+        self.values[labels] = self.values.get(labels, 0) + amount
+
+    def dec(self, *labels, amount: float = 1) -> None:
+        self.values[labels] = self.values.get(labels, 0) - amount
+
+
+class Histogram(Metric):
+    """
+    Observations counted per bucket (not cumulative, so an observation touches one bucket), plus their sum;
+    the cumulative counts Prometheus expects are added up at scrape time.
+    """
+    kind = "histogram"
+
+    def __init__(self, name: str, description: str, labels: tuple[str, ...] = (),
+                 buckets: tuple[float, ...] = LATENCY_BUCKETS):
+        super().__init__(name, description, labels)
+        self.buckets = buckets
+        self.series: dict[tuple, list[float]] = {}
+
+    def observe(self, value: float, *labels) -> None:
+        series = self.series.get(labels)
+        if series is None:
+            # one count per bucket, one for +Inf, then the sum
+            series = self.series[labels] = [0] * (len(self.buckets) + 2)
+        series[bisect_left(self.buckets, value)] += 1
+        series[-1] += value
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} {self.kind}"]
+        for values, series in self.series.items():
+            total = 0
+            for bound, count in zip((*self.buckets, "+Inf"), series):
+                total += count
+                le = f'le="{bound}"'
+                lines.append(f"{self.name}_bucket{render_labels(self.labels, values, le)} {total}")
+            lines.append(f"{self.name}_sum{render_labels(self.labels, values)} {series[-1]}")
+            lines.append(f"{self.name}_count{render_labels(self.labels, values)} {total}")
+        return lines
+
+
+class Registry:
+
+    def __init__(self):
+        self.metrics: list[Metric] = []
+
+    def register(self, metric: Metric) -> Metric:
+        self.metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        return "\n".join(line for metric in self.metrics for line in metric.render()) + "\n"
+
+
+registry = Registry()
+requests_in_flight = registry.register(Gauge(
+    "http_requests_in_flight", "Requests being handled, response sending included", ("method", "route")))
+request_duration = registry.register(Histogram(
+    "http_request_duration_seconds", "Time to handle a request and send its response", ("method", "route", "status")))
+redis_duration = registry.register(Histogram(
+    "redis_command_duration_seconds", "Latency of Redis commands", ("client",), buckets=REDIS_BUCKETS))
+background_tasks = registry.register(Gauge(
+    "background_tasks", "Background tasks added to responses and not finished yet", ("task",)))
+password_jobs_rejected = registry.register(Counter(
+    "password_hash_rejected_total", "Password hashing jobs refused because the pool and its queue were full"))
+user_cache_lookups = registry.register(Counter(
+    "user_cache_lookups_total", "Current user lookups by the cache level that answered, or miss", ("level",)))
+# set when scraped
+password_jobs = registry.register(Gauge(
+    "password_hash_jobs", "Password hashing jobs running or queued"))
+password_workers = registry.register(Gauge(
+    "password_hash_workers", "Threads of the password hashing pool"))
+pool_size = registry.register(Gauge(
+    "db_pool_size", "Connections the database pool keeps", ("db",)))
+pool_checked_out = registry.register(Gauge(
+    "db_pool_checked_out", "Database connections in use", ("db",)))
+pool_overflow = registry.register(Gauge(
+    "db_pool_overflow", "Database connections open beyond the pool size", ("db",)))
+user_cache_size = registry.register(Gauge(
+    "user_cache_local_size", "Users in this worker's in-process user cache"))
+email_queue = registry.register(Gauge(
+    "email_queue_depth", "Emails waiting in the outbox stream, for a retry or in the dead-letter stream", ("queue",)))
+
+
+class MetricsRoute(APIRoute):
+    """
+    Route that counts its requests in flight and observes their latency, labelled with the route's path template.
+    Routers that use it as their route_class are measured.
+    """
+
+    async def handle(self, scope: Scope, receive: Receive, send: Send) -> None:
+        method = scope["method"]
+        status = 500
+
+        async def send_with_status(message: Message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        requests_in_flight.inc(method, self.path)
+        started = time.perf_counter()
+        try:
+            await super().handle(scope, receive, send_with_status)
+        except HTTPException as err:
+            status = err.status_code
+            raise
+        except RequestValidationError:
+            status = 422
+            raise
+        finally:
+            requests_in_flight.dec(method, self.path)
+            request_duration.observe(time.perf_counter() - started, method, self.path, status)
+
+
+def add_task(tasks: BackgroundTasks, func, *args, **kwargs) -> None:
+    """
+    BackgroundTasks.add_task, counting the task in background_tasks until it ends.
+    """
+    name = getattr(func, "__name__", "task")
+    task = BackgroundTask(func, *args, **kwargs)
+    background_tasks.inc(name)
+
+    async def run():
+        try:
+            await task()
+        finally:
+            background_tasks.dec(name)
+
+    tasks.add_task(run)
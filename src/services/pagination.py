@@ -0,0 +1,23 @@
+import base64
+import binascii
+
+from fastapi import HTTPException, status
+
+
+# cursors are opaque to clients: the id of the last row of the previous page, base64url encoded
+def encode_cursor(last_id: int) -> str:
+    return base64.urlsafe_b64encode(str(last_id).encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor: str) -> int:
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        return int(base64.urlsafe_b64decode(padded.encode()).decode())
+    except (binascii.Error, UnicodeDecodeError, ValueError):
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid cursor")
+
+
+def next_cursor(rows: list, limit: int) -> str | None:
+    if len(rows) < limit:
+        return None
+    return encode_cursor(rows[-1].id)
@@ -0,0 +1,263 @@
+import asyncio
+import hashlib
+import hmac
+import json
+import logging
+import os
+import random
+import re
+import secrets
+import sys
+import threading
+import time
+from datetime import datetime
+from types import FrameType
+
+from starlette.datastructures import MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from src.conf.config import settings
+
+logger = logging.getLogger(__name__)
+
+HEADER = "X-Profile"
+SUFFIX = ".speedscope.json"
+NAME = re.compile(r"^[\w.-]+\.speedscope\.json$")
+
+# the first category found walking a sample's stack from the innermost frame outwards takes the sample
+CATEGORIES = (
+    ("db", ("/src/repository/", "/src/database/", "/sqlalchemy/", "/asyncpg/", "/aiosqlite/", "/sqlite3/")),
+    ("auth", ("/src/services/auth.py", "/src/services/refresh_tokens.py", "/src/services/rate_limit.py",
+              "/passlib/", "/bcrypt/", "/jose/")),
+    ("serialization", ("/src/services/serialization.py", "/src/services/contact_export.py", "/orjson",
+                       "/pydantic/", "/fastapi/encoders.py", "/json/")),
+    ("external", ("/src/services/email.py", "/src/services/mail_queue.py", "/redis/", "/cloudinary/",
+                  "/urllib3/", "/httpx/", "/libgravatar/", "/fastapi_mail/", "/smtplib.py")),
+)
+
+
+def sign(expires: int) -> str:
+    """
+    The X-Profile header value that asks for requests to be profiled until the unix time expires.
+    """
+    mac = hmac.new(settings.secret_key.encode(), f"profile:{expires}".encode(), hashlib.sha256).hexdigest()
+    return f"{expires}.{mac}"
+
+
+def verify(value: str) -> bool:
+    expires, _, mac = value.partition(".")
+    if not expires.isdigit() or int(expires) < time.time():
+        return False
+    return hmac.compare_digest(sign(int(expires)), value)
+
+
+def category(stack: list[FrameType]) -> str:
+    for frame in reversed(stack):
+        filename = frame.f_code.co_filename.replace(os.sep, "/")
+        for name, patterns in CATEGORIES:
+            if any(pattern in filename for pattern in patterns):
+                return name
+    return "app"
+
+
+def coroutine_stack(coro) -> list[FrameType]:
+    """
+    Frames of a suspended coroutine and of everything it awaits, outermost first.
+    """
+    stack = []
+    while coro is not None:
+        frame = getattr(coro, "cr_frame", None) or getattr(coro, "gi_frame", None) or getattr(coro, "ag_frame", None)
+        if frame is None:
+            break
+        stack.append(frame)
+        coro = getattr(coro, "cr_await", None) or getattr(coro, "gi_yieldfrom", None) or getattr(coro, "ag_await", None)
+    return stack
+
+
+class Profile:
+    """
+    Samples of one request. Each sample is the stack of the request's task, with the time since the previous sample
+    as its weight, so waiting on a query, Redis or the password hashing pool counts like running does.
+    """
+
+    def __init__(self, name: str, filename: str):
+        self.name = name
+        self.filename = filename
+        self.task = asyncio.current_task()
+        self.thread_id = threading.get_ident()
+        self.started = self.last = time.perf_counter()
+        self.frames: dict[tuple, int] = {}
+        self.samples: list[list[int]] = []
+        self.weights: list[float] = []
+        self.categories: dict[str, float] = {}
+
+    def stack(self, running: FrameType | None) -> list[FrameType]:
+        coro = self.task.get_coro()
+        # a task's coroutine is running while the event loop runs a step of the task
+        if running is None or not getattr(coro, "cr_running", False):
+            return coroutine_stack(coro)
+        # the task runs: its live stack, below the event loop's frames, includes synchronous calls
+        root = getattr(coro, "cr_frame", None)
+        stack = []
+        frame = running
+        while frame is not None and frame is not root:
+            stack.append(frame)
+            frame = frame.f_back
+        if frame is None:
+            # inside a greenlet of SQLAlchemy's asyncio layer, its frames do not lead back to the task
+            return coroutine_stack(coro) + stack[::-1]
+        stack.append(root)
+        return stack[::-1]
+
+    def sample(self, running: FrameType | None, now: float) -> None:
+        if self.task.done():
+            return
+        stack = self.stack(running)
+        if not stack:
+            return
+        weight = (now - self.last) * 1000
+        self.last = now
+        name = category(stack)
+        self.categories[name] = self.categories.get(name, 0.0) + weight
+        self.samples.append([self.frame(f"[{name}]", "", 0)]
+                            + [self.frame(getattr(frame.f_code, "co_qualname", frame.f_code.co_name),
+                                          frame.f_code.co_filename, frame.f_code.co_firstlineno) for frame in stack])
+        self.weights.append(weight)
+
+    def frame(self, name: str, file: str, line: int) -> int:
+        return self.frames.setdefault((name, file, line), len(self.frames))
+
+    def speedscope(self) -> dict:
+        total = sum(self.weights)
+        return {
+            "$schema": "https://www.speedscope.app/file-format-schema.json",
+            "name": self.name,
+            "exporter": "contacts-api",
+            "shared": {"frames": [{"name": name, "file": file, "line": line} if file else {"name": name}
+                                  for name, file, line in self.frames]},
+            "profiles": [{
+                "type": "sampled",
+                "name": f"{self.name} ({', '.join(f'{name} {ms:.1f}ms' for name, ms in self.summary())})",
+                "unit": "milliseconds",
+                "startValue": 0,
+                "endValue": total,
+                "samples": self.samples,
+                "weights": self.weights,
+            }],
+        }
+
+    def summary(self) -> list[tuple[str, float]]:
+        return sorted(self.categories.items(), key=lambda item: -item[1])
+
+
+class Profiler:
+    """
+    Wall-clock sampling profiler for single requests.
+
+    One daemon thread, started with the first profile, samples every profiled request each interval seconds and
+    sleeps while there is none, so requests that are not profiled pay nothing but the check of their header.
+    A finished profile is written to directory in speedscope's format (https://www.speedscope.app), with every
+    sample filed under a root frame of its category: auth, db, serialization, external or app. Only the newest
+    max_files profiles are kept.
+    """
+
+    def __init__(self, directory: str, interval: float, max_files: int):
+        self.directory = directory
+        self.interval = interval
+        self.max_files = max_files
+        self.active: dict[int, Profile] = {}
+        # held while sampling, so a profile taken out of active gets no more samples
+        self.lock = threading.Lock()
+        self.wake = threading.Event()
+        self.thread = None
+
+    def start(self, name: str) -> Profile:
+        slug = re.sub(r"[^\w-]+", "-", name).strip("-")[:80]
+        profile = Profile(name, f"{datetime.now():%Y%m%dT%H%M%S%f}-{secrets.token_hex(4)}-{slug}{SUFFIX}")
+        with self.lock:
+            self.active[id(profile)] = profile
+        if self.thread is None:
+            self.thread = threading.Thread(target=self.run, name="request-profiler", daemon=True)
+            self.thread.start()
+        self.wake.set()
+        return profile
+
+    async def finish(self, profile: Profile) -> None:
+        with self.lock:
+            self.active.pop(id(profile), None)
+        # saved even without samples, the response named the file
+        await asyncio.to_thread(self.save, profile)
+        logger.info("profiled %s: %s", profile.name,
+                    ", ".join(f"{name} {ms:.1f}ms" for name, ms in profile.summary()))
+
+    def run(self) -> None:
+        while True:
+            if not self.active:
+                self.wake.clear()
+                if not self.active:
+                    self.wake.wait()
+                continue
+            time.sleep(self.interval)
+            with self.lock:
+                frames = sys._current_frames()
+                now = time.perf_counter()
+                for profile in self.active.values():
+                    profile.sample(frames.get(profile.thread_id), now)
+                del frames
+
+    def save(self, profile: Profile) -> None:
+        os.makedirs(self.directory, exist_ok=True)
+        with open(os.path.join(self.directory, profile.filename), "w") as file:
+            json.dump(profile.speedscope(), file)
+        for name in self.list()[self.max_files:]:
+            os.remove(os.path.join(self.directory, name))
+
+    def list(self) -> list[str]:
+        """
+        Stored profiles, newest first.
+        """
+        if not os.path.isdir(self.directory):
+            return []
+        return sorted((name for name in os.listdir(self.directory) if name.endswith(SUFFIX)), reverse=True)
+
+    def path(self, name: str) -> str | None:
+        if not NAME.match(name) or not os.path.isfile(os.path.join(self.directory, name)):
+            return None
+        return os.path.join(self.directory, name)
+
+
+profiler = Profiler(settings.profile_dir, settings.profile_interval_ms / 1000, settings.profile_max_files)
+
+
+class ProfilingMiddleware:
+    """
+    Profiles a request carrying a valid signed X-Profile header (see sign()) and a profile_sample_rate share of the
+    others. A profiled response names its profile in its own X-Profile header.
+    """
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http" or not self.wanted(scope):
+            await self.app(scope, receive, send)
+            return
+
+        profile = profiler.start(f"{scope['method']} {scope['path']}")
+
+        async def send_with_profile(message: Message):
+            if message["type"] == "http.response.start":
+                MutableHeaders(scope=message).append(HEADER, profile.filename)
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_profile)
+        finally:
+            await profiler.finish(profile)
+
+    @staticmethod
+    def wanted(scope: Scope) -> bool:
+        for name, value in scope["headers"]:
+            if name == b"x-profile":
+                return verify(value.decode("latin-1"))
+        return settings.profile_sample_rate > 0 and random.random() < settings.profile_sample_rate
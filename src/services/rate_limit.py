@@ -0,0 +1,149 @@
+import logging
+import math
+import time
+
+from fastapi import Depends, HTTPException, status
+from redis.exceptions import RedisError
+
+from src.conf.config import settings
+from src.database import redis_db
+from src.database.models import User
+from src.services.auth import auth_service
+from src.services.cache import LRUCache
+from src.services.metrics import redis_duration
+
+logger = logging.getLogger(__name__)
+
+# Token bucket shared by all workers. Takes up to ARGV[3] tokens at once and returns how many were granted and,
+# if none were, how many milliseconds until the next one. Redis' clock is used so that workers agree on time.
+TAKE = """
+local capacity = tonumber(ARGV[1])
+local rate = tonumber(ARGV[2])
+local requested = tonumber(ARGV[3])
+local clock = redis.call('TIME')
+local now = tonumber(clock[1]) + tonumber(clock[2]) / 1000000
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(state[1]) or capacity
+local ts = tonumber(state[2]) or now
+tokens = math.min(capacity, tokens + math.max(0, now - ts) * rate)
+local granted = math.min(requested, math.floor(tokens))
+tokens = tokens - granted
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'ts', tostring(now))
+redis.call('PEXPIRE', KEYS[1], math.ceil((capacity - tokens) / rate * 1000) + 1000)
+local wait = 0
+if granted == 0 then
+    wait = math.ceil((1 - tokens) / rate * 1000)
+end
+return {granted, wait}
+"""
+
+
+def parse_rule(rule: str) -> tuple[int, float]:
+    """
+    Parses "<requests>/<seconds>" into the bucket capacity and its refill rate in tokens per second.
+    """
+    times, seconds = rule.split("/")
+    return int(times), int(times) / float(seconds)
+
+
+class Lease:
+    __slots__ = ("tokens", "expires_at")
+
+    def __init__(self, tokens: int, expires_at: float):
+        self.tokens = tokens
+        self.expires_at = expires_at
+
+
+class RateLimiter:
+    """
+    Per-user token buckets kept in Redis and spent from in-process leases.
+
+    A worker takes up to rate_limit_lease of a bucket's capacity from Redis in one script call and admits that many
+    requests locally; once it is told the bucket is empty it refuses requests locally until the next token is due.
+    Allowed requests therefore cost one Redis call per lease and refused ones almost none.
+    A lease is at least one token, so a rule with a capacity below 1 / rate_limit_lease, like every shipped rule,
+    costs one call per admitted request; its Redis traffic is bounded by the rule itself (capacity calls per
+    period and per user, plus one per refusal period) however many requests are refused.
+    Every admitted request spends a token taken atomically from the shared bucket, so all workers together never
+    exceed the limit; a leased token may be spent up to rate_limit_lease_ttl after it was taken, and the unspent
+    tokens of an expired lease are lost, which can refuse a client up to workers * (lease - 1) requests early.
+    Without Redis, or when it fails, the same buckets are kept in-process and each worker enforces the limit alone.
+    """
+
+    def __init__(self, rules: dict[str, str], lease: float, lease_ttl: float, local_size: int):
+        self.rules = {name: parse_rule(rule) for name, rule in rules.items()}
+        self.lease = lease
+        self.lease_ttl = lease_ttl
+        self.leases = LRUCache(local_size)
+        self.buckets = LRUCache(local_size)
+        self.script = None
+
+    async def acquire(self, name: str, identity: int | str) -> float:
+        """
+        Spends one token of the identity's bucket for the named rule.
+        Returns 0 if the request is allowed, otherwise the number of seconds until it can be retried.
+        """
+        capacity, rate = self.rules[name]
+        key = f"ratelimit:{name}:{identity}"
+        now = time.monotonic()
+        lease = self.leases.get(key)
+        if lease is not None:
+            if not lease.tokens:
+                return lease.expires_at - now
+            lease.tokens -= 1
+            if not lease.tokens:
+                self.leases.delete(key)
+            return 0.0
+        granted, wait = await self.take(key, capacity, rate, max(1, int(capacity * self.lease)))
+        if granted:
+            if granted > 1:
+                self.leases.set(key, Lease(granted - 1, now + self.lease_ttl), now + self.lease_ttl)
+            return 0.0
+        self.leases.set(key, Lease(0, now + wait), now + wait)
+        return wait
+
+    async def take(self, key: str, capacity: int, rate: float, requested: int) -> tuple[int, float]:
+        redis = redis_db.redis_client
+        if redis is not None:
+            try:
+                if self.script is None or self.script.registered_client is not redis:
+                    self.script = redis.register_script(TAKE)
+                started = time.perf_counter()
+                try:
+                    granted, wait = await self.script(keys=[key], args=[capacity, rate, requested])
+                finally:
+                    redis_duration.observe(time.perf_counter() - started, "rate_limit")
+                return int(granted), int(wait) / 1000
+            except RedisError as err:
+                logger.warning("rate limit falls back to the local bucket: %s", err)
+        return self.take_local(key, capacity, rate, requested)
+
+    def take_local(self, key: str, capacity: int, rate: float, requested: int) -> tuple[int, float]:
+        now = time.monotonic()
+        tokens, ts = self.buckets.get(key) or (capacity, now)
+        tokens = min(capacity, tokens + (now - ts) * rate)
+        granted = min(requested, math.floor(tokens))
+        tokens -= granted
+        self.buckets.set(key, (tokens, now), now + (capacity - tokens) / rate)
+        return granted, 0.0 if granted else (1 - tokens) / rate
+
+
+rate_limiter = RateLimiter(settings.rate_limits, settings.rate_limit_lease, settings.rate_limit_lease_ttl,
+                           settings.rate_limit_local_size)
+
+
+class RateLimit:
+    """
+    Route dependency enforcing the named rule of settings.rate_limits for the current user.
+    """
+
+    def __init__(self, name: str):
+        if name not in rate_limiter.rules:
+            raise KeyError(f"no rate limit rule {name!r} in settings.rate_limits")
+        self.name = name
+
+    async def __call__(self, current_user: User = Depends(auth_service.get_current_user)):
+        retry_after = await rate_limiter.acquire(self.name, current_user.id)
+        if retry_after > 0:
+            raise HTTPException(status_code=status.HTTP_429_TOO_MANY_REQUESTS, detail="Too Many Requests",
+                                headers={"Retry-After": str(math.ceil(retry_after))})
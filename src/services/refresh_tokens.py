@@ -0,0 +1,122 @@
+import logging
+import secrets
+import time
+
+from fastapi import HTTPException, status
+from redis.exceptions import RedisError
+
+from src.conf.config import settings
+from src.database import redis_db
+from src.services.cache import LRUCache
+
+logger = logging.getLogger(__name__)
+
+# Spends refresh token KEYS[1] of family KEYS[2] and issues KEYS[3] in its place. A token is "0" until it is spent
+# and "1" after; presenting a spent token again deletes the family, which invalidates every token of it.
+ROTATE = """
+local spent = redis.call('GET', KEYS[1])
+if not spent or redis.call('EXISTS', KEYS[2]) == 0 then
+    return 'invalid'
+end
+if spent == '1' then
+    redis.call('DEL', KEYS[2])
+    return 'reused'
+end
+redis.call('SET', KEYS[1], '1', 'KEEPTTL')
+redis.call('SET', KEYS[3], '0', 'PX', ARGV[1])
+redis.call('PEXPIRE', KEYS[2], ARGV[1])
+return 'rotated'
+"""
+
+
+class RefreshTokenStore:
+    """
+    Refresh tokens by token id, grouped in rotation families.
+
+    Login starts a family, every refresh spends the presented token and issues the next one of the same family,
+    so each login is a session of its own. A spent token stays known until it would have expired: presenting it
+    again means it was copied, and revokes the family, ending the session for both the thief and the user.
+    Tokens expire after refresh_token_ttl, a family with its newest token.
+    Without Redis the store is kept in-process, which only suits a single worker. When Redis fails, logins and
+    refreshes are refused with 503 rather than handing out or accepting tokens that cannot be tracked.
+    """
+
+    def __init__(self, ttl: int, local_size: int):
+        self.ttl = ttl
+        self.tokens = LRUCache(local_size)
+        self.families = LRUCache(local_size)
+        self.script = None
+
+    @staticmethod
+    def token_key(token_id: str) -> str:
+        return f"refresh:token:{token_id}"
+
+    @staticmethod
+    def family_key(family: str) -> str:
+        return f"refresh:family:{family}"
+
+    async def start(self) -> tuple[str, str]:
+        """
+        Starts a family and returns its id and the id of its first token.
+        """
+        family, token_id = secrets.token_hex(16), secrets.token_hex(16)
+        redis = redis_db.redis_client
+        if redis is None:
+            expires_at = time.monotonic() + self.ttl
+            self.families.set(family, True, expires_at)
+            self.tokens.set(token_id, (False, expires_at), expires_at)
+            return family, token_id
+        try:
+            async with redis.pipeline(transaction=True) as pipe:
+                pipe.set(self.family_key(family), "1", ex=self.ttl)
+                pipe.set(self.token_key(token_id), "0", ex=self.ttl)
+                await pipe.execute()
+        except RedisError as err:
+            self.unavailable(err)
+        return family, token_id
+
+    async def rotate(self, family: str | None, token_id: str | None) -> str | None:
+        """
+        Spends the token and returns the id of the next token of its family,
+        or None if the token is unknown, expired, already spent or of a revoked family.
+        """
+        if family is None or token_id is None:
+            return None
+        new_token_id = secrets.token_hex(16)
+        redis = redis_db.redis_client
+        if redis is None:
+            result = self.rotate_local(family, token_id, new_token_id)
+        else:
+            try:
+                if self.script is None or self.script.registered_client is not redis:
+                    self.script = redis.register_script(ROTATE)
+                result = await self.script(keys=[self.token_key(token_id), self.family_key(family),
+                                                 self.token_key(new_token_id)], args=[self.ttl * 1000])
+            except RedisError as err:
+                self.unavailable(err)
+        if result == "reused":
+            logger.warning("refresh token %s was used twice, family %s revoked", token_id, family)
+        return new_token_id if result == "rotated" else None
+
+    def rotate_local(self, family: str, token_id: str, new_token_id: str) -> str:
+        token = self.tokens.get(token_id)
+        if token is None or self.families.get(family) is None:
+            return "invalid"
+        spent, expires_at = token
+        if spent:
+            self.families.delete(family)
+            return "reused"
+        self.tokens.set(token_id, (True, expires_at), expires_at)
+        expires_at = time.monotonic() + self.ttl
+        self.tokens.set(new_token_id, (False, expires_at), expires_at)
+        self.families.set(family, True, expires_at)
+        return "rotated"
+
+    @staticmethod
+    def unavailable(err: RedisError):
+        logger.warning("refresh token store unavailable: %s", err)
+        raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail="Server is busy, try again later",
+                            headers={"Retry-After": "1"})
+
+
+refresh_tokens = RefreshTokenStore(settings.refresh_token_ttl, settings.refresh_token_local_size)
@@ -0,0 +1,101 @@
+import hashlib
+import time
+from typing import Awaitable, Callable, Iterable
+
+from fastapi import Request, Response, status
+from redis.exceptions import RedisError
+
+from src.conf.config import settings
+from src.database import redis_db
+from src.services.serialization import dumps
+
+
+class ResponseCache:
+    """
+    Redis cache of serialized contact read responses with strong ETags.
+
+    Every user has a version counter; cache keys and ETags include it, so bumping the counter after a write
+    invalidates all of the user's cached responses at once, and the old entries simply expire.
+    A response is fully determined by (user, version, path, query), which makes the ETag computable
+    from the counter alone: a matching If-None-Match is answered 304 without reading the cache or the database.
+    When Redis is not available responses are built and returned uncached, without an ETag.
+    Responses are returned as ready Response objects, so FastAPI does not validate them against the route's
+    response_model: build must return trusted plain data, see src.services.serialization.
+    """
+
+    def __init__(self, ttl: int):
+        self.ttl = ttl
+
+    @staticmethod
+    def version_key(user_id: int) -> str:
+        return f"contacts:version:{user_id}"
+
+    async def version(self, user_id: int) -> str | None:
+        redis = redis_db.redis_client
+        if redis is None:
+            return None
+        key = self.version_key(user_id)
+        try:
+            version = await redis.get(key)
+            if version is None:
+                # start from the clock, not from 1, so a lost counter never repeats an old version (and ETag)
+                await redis.set(key, time.time_ns(), nx=True)
+                version = await redis.get(key)
+        except RedisError:
+            return None
+        return version
+
+    async def bump(self, user_id: int) -> None:
+        redis = redis_db.redis_client
+        if redis is None:
+            return
+        try:
+            key = self.version_key(user_id)
+            async with redis.pipeline(transaction=True) as pipe:
+                await pipe.set(key, time.time_ns(), nx=True).incr(key).execute()
+        except RedisError:
+            pass
+
+    @staticmethod
+    def etag(user_id: int, version: str, path: str, params: Iterable[tuple[str, str]]) -> str:
+        digest = hashlib.sha256(f"{user_id}:{path}?{sorted(params)}".encode()).hexdigest()[:32]
+        return f'"{version}-{digest}"'
+
+    @staticmethod
+    def matches(request: Request, etag: str) -> bool:
+        header = request.headers.get("if-none-match")
+        if not header:
+            return False
+        tags = [tag.strip().removeprefix("W/") for tag in header.split(",")]
+        return "*" in tags or etag in tags
+
+    async def respond(self, request: Request, user_id: int, build: Callable[[], Awaitable],
+                      extra: Iterable[tuple[str, str]] = ()) -> Response:
+        """
+        Returns a 304 if the client's ETag is current, otherwise the cached or freshly built response body.
+        extra holds inputs of the response other than the query string, e.g. the current date.
+        """
+        version = await self.version(user_id)
+        if version is None:
+            return Response(content=dumps(await build()), media_type="application/json")
+        etag = self.etag(user_id, version, request.url.path, [*request.query_params.multi_items(), *extra])
+        headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+        if self.matches(request, etag):
+            return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+
+        redis = redis_db.redis_client
+        key = f"contacts:response:{user_id}:{etag[1:-1]}"
+        try:
+            body = await redis.get(key)
+        except RedisError:
+            body = None
+        if body is None:
+            body = dumps(await build())
+            try:
+                await redis.set(key, body, ex=self.ttl)
+            except RedisError:
+                pass
+        return Response(content=body, media_type="application/json", headers=headers)
+
+
+response_cache = ResponseCache(settings.response_cache_ttl)
@@ -0,0 +1,26 @@
+import operator
+from typing import Any, Iterable
+
+import orjson
+
+from src.schemas import ContactResponse
+
+CONTACT_FIELDS = tuple(ContactResponse.__fields__)
+_contact_values = operator.attrgetter(*CONTACT_FIELDS)
+
+
+def contact_dict(contact: Any) -> dict:
+    """
+    Trusted fast path for contact responses: copies the ContactResponse fields of a row or entity loaded by our own
+    queries into a dict, without validating them again. The columns already satisfy ContactResponse.
+    """
+    return dict(zip(CONTACT_FIELDS, _contact_values(contact)))
+
+
+def contact_dicts(contacts: Iterable[Any]) -> list[dict]:
+    return [dict(zip(CONTACT_FIELDS, _contact_values(contact))) for contact in contacts]
+
+
+def dumps(content: Any) -> bytes:
+    # orjson writes datetimes in ISO 8601 like the default encoder, and is several times faster
+    return orjson.dumps(content)
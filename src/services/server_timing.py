@@ -0,0 +1,42 @@
+import time
+
+from starlette.datastructures import MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from src.conf.config import settings
+from src.database.instrumentation import QueryStats, query_stats, logger
+
+
+class ServerTimingMiddleware:
+    """
+    Collects the SQL statements of every HTTP request and reports them in a Server-Timing response header:
+    ``db`` (statement count and total time), ``db-pool`` (connection checkout wait) and ``app`` (time until
+    the response started). Once the response is sent, statements that ran more than sql_n_plus_one_threshold
+    times in the request are logged as a likely N+1 pattern.
+    """
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        stats = QueryStats()
+        token = query_stats.set(stats)
+        started = time.perf_counter()
+
+        async def send_with_timing(message: Message):
+            if message["type"] == "http.response.start":
+                headers = MutableHeaders(scope=message)
+                headers.append("Server-Timing", stats.server_timing(time.perf_counter() - started))
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            query_stats.reset(token)
+            for statement, count in stats.repeated(settings.sql_n_plus_one_threshold):
+                logger.warning("possible N+1: %s %s ran the same statement %d times: %s",
+                               scope["method"], scope["path"], count, statement)
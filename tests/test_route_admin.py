@@ -0,0 +1,47 @@
+import pytest
+
+from src.services.profiling import profiler
+
+
+@pytest.fixture()
+def admin(user, monkeypatch, tmp_path):
+    monkeypatch.setattr("src.routes.admin.settings.admin_emails", [user.get('email')])
+    monkeypatch.setattr(profiler, "directory", str(tmp_path))
+
+
+def test_profiles_require_admin(client, token):
+    headers = {"Authorization": f"Bearer {token}"}
+    response = client.get("/api/admin/profiles", headers=headers)
+    assert response.status_code == 403, response.text
+    response = client.post("/api/admin/profiles/token", headers=headers)
+    assert response.status_code == 403, response.text
+    response = client.get("/api/admin/profiles")
+    assert response.status_code == 401, response.text
+
+
+def test_profile_request(client, token, admin):
+    headers = {"Authorization": f"Bearer {token}"}
+    response = client.get("/api/admin/profiles", headers=headers)
+    assert response.status_code == 200, response.text
+    assert response.json() == []
+
+    response = client.post("/api/admin/profiles/token", params={"minutes": 5}, headers=headers)
+    assert response.status_code == 200, response.text
+    data = response.json()
+    assert data["header"] == "X-Profile"
+
+    response = client.get("/api/contacts/", headers={**headers, "X-Profile": data["value"]})
+    assert response.status_code == 200, response.text
+    name = response.headers["x-profile"]
+    response = client.get("/api/contacts/", headers=headers)
+    assert "x-profile" not in response.headers
+    response = client.get("/api/contacts/", headers={**headers, "X-Profile": data["value"] + "0"})
+    assert "x-profile" not in response.headers
+
+    response = client.get("/api/admin/profiles", headers=headers)
+    assert [profile["name"] for profile in response.json()] == [name]
+    response = client.get(f"/api/admin/profiles/{name}", headers=headers)
+    assert response.status_code == 200, response.text
+    assert response.json()["profiles"][0]["type"] == "sampled"
+    response = client.get("/api/admin/profiles/missing.speedscope.json", headers=headers)
+    assert response.status_code == 404, response.text
@@ -1,6 +1,11 @@
+import asyncio
 from unittest.mock import MagicMock
 
+from passlib.context import CryptContext
+
 from src.database.models import User
+from src.services.auth import auth_service
+from src.services.refresh_tokens import refresh_tokens
 
 
 def test_create_user(client, user, monkeypatch):
@@ -49,6 +54,29 @@ def test_login_user(client, session, user):
     assert data["token_type"] == "bearer"
 
 
+def test_login_rehashes_password(client, session, user, monkeypatch):
+    monkeypatch.setattr(auth_service, "pwd_context", CryptContext(schemes=["bcrypt"], deprecated="auto",
+                                                                  bcrypt__rounds=4))
+    response = client.post(
+        "/api/auth/login",
+        data={"username": user.get('email'), "password": user.get('password')},
+    )
+    assert response.status_code == 200, response.text
+    session.expire_all()
+    current_user: User = session.query(User).filter(User.email == user.get('email')).first()
+    assert current_user.password.startswith("$2b$04$")
+
+
+def test_login_password_queue_full(client, user, monkeypatch):
+    monkeypatch.setattr(auth_service, "password_jobs", 10 ** 6)
+    response = client.post(
+        "/api/auth/login",
+        data={"username": user.get('email'), "password": user.get('password')},
+    )
+    assert response.status_code == 503, response.text
+    assert response.headers["Retry-After"] == "1"
+
+
 def test_login_wrong_password(client, user):
     response = client.post(
         "/api/auth/login",
@@ -67,3 +95,94 @@ def test_login_wrong_email(client, user):
     assert response.status_code == 401, response.text
     data = response.json()
     assert data["detail"] == "Invalid email"
+
+
+def test_signup_statements(client, monkeypatch, queries):
+    monkeypatch.setattr("src.routes.auth.send_email", MagicMock())
+    response = client.post("/api/auth/signup",
+                           json={"username": "statements", "email": "statements@example.com", "password": "123456"})
+    assert response.status_code == 201, response.text
+    # existing email check, INSERT, reload of the server defaults
+    assert queries(response) == 3
+
+
+def test_login_statements(client, user, queries):
+    data = {"username": user.get('email'), "password": user.get('password')}
+    client.post("/api/auth/login", data=data)
+    response = client.post("/api/auth/login", data=data)
+    assert response.status_code == 200, response.text
+    # user lookup only, the refresh token is not stored in the user row
+    assert queries(response) == 1
+
+
+def refresh(client, token):
+    return client.get("/api/auth/refresh_token", headers={"Authorization": f"Bearer {token}"})
+
+
+def test_refresh_token_statements(client, user, queries):
+    tokens = client.post("/api/auth/login",
+                         data={"username": user.get('email'), "password": user.get('password')}).json()
+    response = refresh(client, tokens['refresh_token'])
+    assert response.status_code == 200, response.text
+    # user lookup, then the user is cached
+    assert queries(response) == 1
+    response = refresh(client, response.json()['refresh_token'])
+    assert response.status_code == 200, response.text
+    assert queries(response) == 0
+
+
+def test_refresh_token_rotation(client, user):
+    data = {"username": user.get('email'), "password": user.get('password')}
+    first = client.post("/api/auth/login", data=data).json()["refresh_token"]
+    other_session = client.post("/api/auth/login", data=data).json()["refresh_token"]
+    rotated = refresh(client, first).json()["refresh_token"]
+    assert rotated != first
+    # reusing the spent token revokes its family, the token that replaced it included
+    response = refresh(client, first)
+    assert response.status_code == 401, response.text
+    assert response.json()["detail"] == "Invalid refresh token"
+    assert refresh(client, rotated).status_code == 401
+    # other logins are separate families
+    assert refresh(client, other_session).status_code == 200
+
+
+def test_refresh_token_without_family(client, user):
+    token = asyncio.run(auth_service.create_refresh_token(data={"sub": user.get('email')}))
+    assert refresh(client, token).status_code == 401
+
+
+def test_refresh_token_unknown_user(client):
+    family, token_id = asyncio.run(refresh_tokens.start())
+    token = asyncio.run(auth_service.create_refresh_token(data={"sub": "deleted@example.com", "fam": family,
+                                                                "jti": token_id}))
+    response = refresh(client, token)
+    assert response.status_code == 401, response.text
+    assert response.json()["detail"] == "Invalid refresh token"
+
+
+def test_confirmed_email(client, session, queries):
+    token = auth_service.create_email_token({"sub": "statements@example.com"})
+    response = client.get(f"/api/auth/confirmed_email/{token}")
+    assert response.status_code == 200, response.text
+    assert response.json()["message"] == "Email confirmed"
+    assert queries(response) == 1
+    current_user: User = session.query(User).filter(User.email == "statements@example.com").first()
+    assert current_user.confirmed
+
+    response = client.get(f"/api/auth/confirmed_email/{token}")
+    assert response.json()["message"] == "Your email is already confirmed"
+    assert queries(response) == 2
+
+
+def test_confirmed_email_unknown_user(client):
+    token = auth_service.create_email_token({"sub": "nobody@example.com"})
+    response = client.get(f"/api/auth/confirmed_email/{token}")
+    assert response.status_code == 400, response.text
+    assert response.json()["detail"] == "Verification error"
+
+
+def test_request_email_statements(client, user, queries):
+    response = client.post("/api/auth/request_email", json={"email": user.get('email')})
+    assert response.status_code == 200, response.text
+    assert response.json()["message"] == "Your email is already confirmed"
+    assert queries(response) == 1
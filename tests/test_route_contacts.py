@@ -0,0 +1,329 @@
+import asyncio
+import csv
+import io
+import json
+from datetime import datetime
+from unittest.mock import AsyncMock
+
+import httpx
+import pytest
+from fakeredis import aioredis
+
+from main import app
+from src.database.models import Contact, User
+from src.services.pagination import encode_cursor
+from src.services.rate_limit import rate_limiter
+
+
+CONTACT = {"firstname": "Wade", "lastname": "Wilson", "email": "wade@example.com", "phone": "0501234567",
+           "birthday": "1990-05-17T00:00:00", "description": "Merc with a mouth"}
+
+
+@pytest.fixture(scope="module", autouse=True)
+def no_rate_limit():
+    with pytest.MonkeyPatch.context() as mp:
+        mp.setattr(rate_limiter, "acquire", AsyncMock(return_value=0.0))
+        yield
+
+
+def test_create_contact(client, token):
+    response = client.post("/api/contacts/", json=CONTACT, headers={"Authorization": f"Bearer {token}"})
+    assert response.status_code == 201, response.text
+    data = response.json()
+    assert data["email"] == CONTACT["email"]
+    assert "id" in data
+
+
+def test_read_contacts(client, token):
+    response = client.get("/api/contacts/", headers={"Authorization": f"Bearer {token}"})
+    assert response.status_code == 200, response.text
+    data = response.json()
+    assert len(data["items"]) == 1
+    assert data["items"][0]["firstname"] == CONTACT["firstname"]
+    assert data["next_cursor"] is None
+
+
+def test_read_contacts_cursor(client, session, token, user):
+    owner = session.query(User).filter(User.email == user.get('email')).first()
+    for i in range(4):
+        session.add(Contact(firstname=f"Page{i}", lastname="Test", email=f"page{i}@example.com", phone=f"050000000{i}",
+                            birthday=datetime(1990, 1, 1), description="", user_id=owner.id))
+    session.commit()
+
+    seen = []
+    cursor = None
+    while True:
+        params = {"limit": 2} if cursor is None else {"limit": 2, "cursor": cursor}
+        response = client.get("/api/contacts/", params=params, headers={"Authorization": f"Bearer {token}"})
+        assert response.status_code == 200, response.text
+        data = response.json()
+        seen.extend(contact["id"] for contact in data["items"])
+        cursor = data["next_cursor"]
+        if cursor is None:
+            break
+    assert seen == sorted(seen)
+    assert len(seen) == 5
+
+    session.query(Contact).filter(Contact.firstname.like("Page%")).delete(synchronize_session=False)
+    session.commit()
+
+
+def test_read_contacts_invalid_cursor(client, token):
+    response = client.get("/api/contacts/", params={"cursor": "not a cursor"},
+                          headers={"Authorization": f"Bearer {token}"})
+    assert response.status_code == 400, response.text
+    assert response.json()["detail"] == "Invalid cursor"
+
+
+def test_read_contact(client, token):
+    response = client.get("/api/contacts/1", headers={"Authorization": f"Bearer {token}"})
+    assert response.status_code == 200, response.text
+    assert response.json()["lastname"] == CONTACT["lastname"]
+
+
+def test_read_contact_not_found(client, token):
+    response = client.get("/api/contacts/2", headers={"Authorization": f"Bearer {token}"})
+    assert response.status_code == 404, response.text
+    assert response.json()["detail"] == "Contact not found"
+
+
+def test_querys_contacts(client, token):
+    response = client.get("/api/contacts/query/", params={"firstname": "wa", "lastname": "WIL", "email": ""},
+                          headers={"Authorization": f"Bearer {token}"})
+    assert response.status_code == 200, response.text
+    data = response.json()
+    assert [contact["email"] for contact in data["items"]] == [CONTACT["email"]]
+    assert data["next_cursor"] is None
+
+
+def test_querys_contacts_no_filters(client, token):
+    response = client.get("/api/contacts/query/", headers={"Authorization": f"Bearer {token}"})
+    assert response.status_code == 200, response.text
+    assert response.json()["items"] == []
+
+
+def test_search_contacts(client, token):
+    response = client.get("/api/contacts/search", params={"q": "merc WADE"},
+                          headers={"Authorization": f"Bearer {token}"})
+    assert response.status_code == 200, response.text
+    data = response.json()
+    assert [contact["email"] for contact in data["items"]] == [CONTACT["email"]]
+    assert data["next_cursor"] is None
+    assert data["truncated"] is False
+
+
+def test_search_contacts_cursor(client, token):
+    response = client.get("/api/contacts/search", params={"q": "wilson", "limit": 1},
+                          headers={"Authorization": f"Bearer {token}"})
+    assert response.status_code == 200, response.text
+    # the only match fills the page, no empty page follows it
+    assert len(response.json()["items"]) == 1
+    assert response.json()["next_cursor"] is None
+    response = client.get("/api/contacts/search", params={"q": "wade", "limit": 1, "cursor": encode_cursor(1)},
+                          headers={"Authorization": f"Bearer {token}"})
+    assert response.status_code == 200, response.text
+    assert response.json() == {"items": [], "next_cursor": None, "truncated": False}
+
+
+@pytest.mark.parametrize("params", [{}, {"q": ""}, {"q": "x" * 101}])
+def test_search_contacts_invalid(client, token, params):
+    response = client.get("/api/contacts/search", params=params, headers={"Authorization": f"Bearer {token}"})
+    assert response.status_code == 422, response.text
+
+
+def test_birthdays(client, token):
+    response = client.get("/api/contacts/birthdays/", params={"days": 365},
+                          headers={"Authorization": f"Bearer {token}"})
+    assert response.status_code == 200, response.text
+    assert [contact["email"] for contact in response.json()] == [CONTACT["email"]]
+
+
+def test_birthdays_invalid_days(client, token):
+    response = client.get("/api/contacts/birthdays/", params={"days": 0},
+                          headers={"Authorization": f"Bearer {token}"})
+    assert response.status_code == 422, response.text
+
+
+def test_update_contact(client, token, queries):
+    response = client.put("/api/contacts/1", json={**CONTACT, "description": "Updated"},
+                          headers={"Authorization": f"Bearer {token}"})
+    assert response.status_code == 200, response.text
+    assert response.json()["description"] == "Updated"
+    assert queries(response) == 1
+
+
+def test_patch_contact(client, token, queries):
+    response = client.patch("/api/contacts/1", json={"phone": "0671234567"},
+                            headers={"Authorization": f"Bearer {token}"})
+    assert response.status_code == 200, response.text
+    data = response.json()
+    assert data["phone"] == "0671234567"
+    assert data["description"] == "Updated"
+    assert data["email"] == CONTACT["email"]
+    assert queries(response) == 1
+
+
+def test_patch_contact_null(client, token):
+    response = client.patch("/api/contacts/1", json={"email": None}, headers={"Authorization": f"Bearer {token}"})
+    assert response.status_code == 422, response.text
+
+
+def test_patch_contact_not_found(client, token):
+    response = client.patch("/api/contacts/999", json={"phone": "0671234567"},
+                            headers={"Authorization": f"Bearer {token}"})
+    assert response.status_code == 404, response.text
+
+
+def test_remove_contact(client, token, queries):
+    response = client.delete("/api/contacts/1", headers={"Authorization": f"Bearer {token}"})
+    assert response.status_code == 200, response.text
+    assert response.json()["email"] == CONTACT["email"]
+    assert queries(response) == 1
+    response = client.get("/api/contacts/1", headers={"Authorization": f"Bearer {token}"})
+    assert response.status_code == 404, response.text
+
+
+def test_import_contacts_csv(client, session, token):
+    body = ("firstname,lastname,email,phone,birthday,description\n"
+            "Peter,Parker,peter@example.com,0500000101,2001-08-10T00:00:00,\"Friendly,\n neighbourhood\"\n"
+            "Bad,Email,not-an-email,0500000102,2001-08-10T00:00:00,\n"
+            "Mary,Jane,peter@example.com,0500000103,2001-08-10T00:00:00,same email\n"
+            "\n"
+            "Miles,Morales,miles@example.com,0500000104,2003-08-03T00:00:00,\n")
+    response = client.post("/api/contacts/import", files={"file": ("contacts.csv", body, "text/csv")},
+                           headers={"Authorization": f"Bearer {token}"})
+    assert response.status_code == 200, response.text
+    data = response.json()
+    assert data["imported"] == 2
+    assert data["failed"] == 2
+    assert [error["row"] for error in data["errors"]] == [2, 3]
+    assert data["errors"][0]["detail"].startswith("email")
+    peter = session.query(Contact).filter(Contact.email == "peter@example.com").first()
+    assert peter.description == "Friendly,\n neighbourhood"
+
+    session.query(Contact).filter(Contact.email.in_(["peter@example.com", "miles@example.com"])).delete()
+    session.commit()
+
+
+def test_import_contacts_ndjson(client, session, token):
+    body = "\n".join([
+        '{"firstname": "Gwen", "lastname": "Stacy", "email": "gwen@example.com", "phone": "0500000201", '
+        '"birthday": "2002-04-13T00:00:00", "description": ""}',
+        '{"firstname": "Gwen", "lastname": "Stacy", "email": "gwen2@example.com", "phone": "0500000201", '
+        '"birthday": "2002-04-13T00:00:00", "description": ""}',
+        'not json',
+    ])
+    response = client.post("/api/contacts/import", files={"file": ("contacts.ndjson", body, "application/x-ndjson")},
+                           headers={"Authorization": f"Bearer {token}"})
+    assert response.status_code == 200, response.text
+    data = response.json()
+    assert data["imported"] == 1
+    assert [error["row"] for error in data["errors"]] == [2, 3]
+
+
+def test_import_contacts_unsupported_type(client, token):
+    response = client.post("/api/contacts/import", files={"file": ("contacts.xml", "<contacts/>", "text/xml")},
+                           headers={"Authorization": f"Bearer {token}"})
+    assert response.status_code == 415, response.text
+
+
+def test_export_contacts_ndjson(client, token):
+    response = client.get("/api/contacts/export", headers={"Authorization": f"Bearer {token}"})
+    assert response.status_code == 200, response.text
+    assert response.headers["content-type"] == "application/x-ndjson"
+    rows = [json.loads(line) for line in response.text.splitlines()]
+    assert [row["email"] for row in rows] == ["gwen@example.com"]
+    assert rows[0]["birthday"] == "2002-04-13T00:00:00"
+
+
+def test_export_contacts_csv(client, token):
+    response = client.get("/api/contacts/export", params={"format": "csv"},
+                          headers={"Authorization": f"Bearer {token}"})
+    assert response.status_code == 200, response.text
+    assert response.headers["content-disposition"] == 'attachment; filename="contacts.csv"'
+    rows = list(csv.DictReader(io.StringIO(response.text)))
+    assert [row["email"] for row in rows] == ["gwen@example.com"]
+
+
+def test_export_contacts_invalid_format(client, token):
+    response = client.get("/api/contacts/export", params={"format": "xml"},
+                          headers={"Authorization": f"Bearer {token}"})
+    assert response.status_code == 422, response.text
+
+
+def test_read_contacts_etag(client, token):
+    # one event loop for the whole scenario: the fake Redis connections must not cross loops like TestClient does
+    headers = {"Authorization": f"Bearer {token}"}
+
+    async def scenario():
+        async with httpx.AsyncClient(app=app, base_url="http://test") as ac:
+            response = await ac.get("/api/contacts/", headers=headers)
+            assert response.status_code == 200, response.text
+            etag = response.headers["etag"]
+
+            response = await ac.get("/api/contacts/", headers={**headers, "If-None-Match": etag})
+            assert response.status_code == 304
+            assert response.content == b""
+
+            contact = {**CONTACT, "email": "etag@example.com", "phone": "0509999999"}
+            created = (await ac.post("/api/contacts/", json=contact, headers=headers)).json()
+            response = await ac.get("/api/contacts/", headers={**headers, "If-None-Match": etag})
+            assert response.status_code == 200
+            assert response.headers["etag"] != etag
+            assert created["id"] in [item["id"] for item in response.json()["items"]]
+
+            await ac.delete(f"/api/contacts/{created['id']}", headers=headers)
+
+    with pytest.MonkeyPatch.context() as mp:
+        mp.setattr("src.database.redis_db.redis_client", aioredis.FakeRedis(decode_responses=True))
+        asyncio.run(scenario())
+
+
+def test_batch_contacts(client, token, queries):
+    headers = {"Authorization": f"Bearer {token}"}
+    ids = [client.post("/api/contacts/", headers=headers,
+                       json={**CONTACT, "email": f"batch{i}@example.com", "phone": f"050000000{i}"}).json()["id"]
+           for i in range(3)]
+    response = client.post("/api/contacts/batch", headers=headers, json={"operations": [
+        {"op": "update", "id": ids[0], "data": {"description": "Batched"}},
+        {"op": "delete", "id": ids[1]},
+        {"op": "update", "id": 999, "data": {"description": "Batched"}},
+        {"op": "update", "id": ids[2], "data": {"firstname": "Peter", "lastname": "Parker"}},
+    ]})
+    assert response.status_code == 200, response.text
+    results = response.json()["results"]
+    assert [(result["op"], result["id"], result["status"]) for result in results] == \
+        [("update", ids[0], 200), ("delete", ids[1], 200), ("update", 999, 404), ("update", ids[2], 200)]
+    assert results[0]["contact"]["description"] == "Batched"
+    assert results[0]["contact"]["email"] == "batch0@example.com"
+    assert results[2]["detail"] == "Contact not found"
+    assert (results[3]["contact"]["firstname"], results[3]["contact"]["lastname"]) == ("Peter", "Parker")
+    assert queries(response) == 2
+    assert client.get(f"/api/contacts/{ids[1]}", headers=headers).status_code == 404
+
+
+def test_batch_contacts_conflict(client, token):
+    headers = {"Authorization": f"Bearer {token}"}
+    first, second = [client.post("/api/contacts/", headers=headers,
+                                 json={**CONTACT, "email": f"conflict{i}@example.com", "phone": f"067000000{i}"})
+                     .json()["id"] for i in range(2)]
+    response = client.post("/api/contacts/batch", headers=headers, json={"operations": [
+        {"op": "delete", "id": first},
+        {"op": "update", "id": second, "data": {"email": "batch0@example.com"}},
+    ]})
+    assert response.status_code == 409, response.text
+    # the batch is one transaction: the delete was rolled back too
+    assert client.get(f"/api/contacts/{first}", headers=headers).status_code == 200
+
+
+@pytest.mark.parametrize("operations", [
+    [],
+    [{"op": "delete", "id": 1}, {"op": "update", "id": 1, "data": {"phone": "1"}}],
+    [{"op": "update", "id": 1}],
+    [{"op": "upsert", "id": 1}],
+    [{"op": "delete", "id": i} for i in range(1, 102)],
+])
+def test_batch_contacts_invalid(client, token, operations):
+    response = client.post("/api/contacts/batch", json={"operations": operations},
+                           headers={"Authorization": f"Bearer {token}"})
+    assert response.status_code == 422, response.text
@@ -0,0 +1,48 @@
+import re
+
+import fakeredis
+from fakeredis import aioredis
+
+from src.conf.config import settings
+
+
+def sample(text, name, **labels):
+    for line in text.splitlines():
+        match = re.match(r"(\w+)(?:\{(.*)\})? (\S+)$", line)
+        if match and match.group(1) == name \
+                and dict(re.findall(r'(\w+)="([^"]*)"', match.group(2) or "")) == labels:
+            return float(match.group(3))
+    return None
+
+
+def test_metrics(client, token):
+    headers = {"Authorization": f"Bearer {token}"}
+    response = client.get("/metrics")
+    before = sample(response.text, "http_request_duration_seconds_count",
+                    method="GET", route="/api/contacts/{contact_id}", status="404") or 0
+    client.get("/api/contacts/1000", headers=headers)
+    client.get("/api/contacts/1000", headers=headers)
+
+    response = client.get("/metrics")
+    assert response.status_code == 200, response.text
+    assert response.headers["content-type"].startswith("text/plain; version=0.0.4")
+    text = response.text
+    assert sample(text, "http_request_duration_seconds_count",
+                  method="GET", route="/api/contacts/{contact_id}", status="404") == before + 2
+    assert sample(text, "http_requests_in_flight", method="GET", route="/api/contacts/{contact_id}") == 0
+    assert sample(text, "db_pool_size", db="primary") is not None
+    assert sample(text, "db_pool_checked_out", db="primary") == 0
+    assert sample(text, "password_hash_jobs") == 0
+    assert sample(text, "password_hash_workers") > 0
+    # the second request found the user in the in-process cache
+    assert sample(text, "user_cache_lookups_total", level="local") >= 1
+    assert sample(text, "user_cache_local_size") >= 1
+
+
+def test_metrics_email_queue(client, monkeypatch):
+    server = fakeredis.FakeServer()
+    monkeypatch.setattr("src.database.redis_db.redis_client", aioredis.FakeRedis(server=server, decode_responses=True))
+    fakeredis.FakeRedis(server=server).xadd(settings.mail_stream, {"email": "user@mail.ua"})
+    response = client.get("/metrics")
+    assert sample(response.text, "email_queue_depth", queue="outbox") == 1
+    assert sample(response.text, "email_queue_depth", queue="retry") == 0
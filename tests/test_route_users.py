@@ -0,0 +1,26 @@
+from unittest.mock import MagicMock
+
+from src.database.models import User
+
+
+def test_read_users_me(client, token, user, queries):
+    headers = {"Authorization": f"Bearer {token}"}
+    client.get("/api/users/me/", headers=headers)
+    response = client.get("/api/users/me/", headers=headers)
+    assert response.status_code == 200, response.text
+    assert response.json()["email"] == user.get('email')
+    # served from the user cache
+    assert queries(response) == 0
+
+
+def test_update_avatar(client, session, token, user, monkeypatch, queries):
+    monkeypatch.setattr("src.routes.users.cloudinary.uploader.upload", MagicMock(return_value={"version": 1}))
+    response = client.patch("/api/users/avatar", files={"file": ("avatar.png", b"\x89PNG", "image/png")},
+                            headers={"Authorization": f"Bearer {token}"})
+    assert response.status_code == 200, response.text
+    assert "ContactsApp/deadpool" in response.json()["avatar"]
+    # a single UPDATE ... RETURNING
+    assert queries(response) == 1
+    session.expire_all()
+    current_user: User = session.query(User).filter(User.email == user.get('email')).first()
+    assert current_user.avatar == response.json()["avatar"]
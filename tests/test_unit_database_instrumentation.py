@@ -0,0 +1,79 @@
+import logging
+import unittest
+
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from sqlalchemy import create_engine, text
+
+from src.database.instrumentation import QueryStats, query_stats
+from src.services.server_timing import ServerTimingMiddleware
+
+
+class TestQueryStats(unittest.TestCase):
+
+    def setUp(self):
+        self.engine = create_engine("sqlite://")
+
+    def test_counts_statements_of_current_context(self):
+        stats = QueryStats()
+        token = query_stats.set(stats)
+        try:
+            with self.engine.connect() as connection:
+                connection.execute(text("SELECT 1"))
+                connection.execute(text("SELECT 2"))
+        finally:
+            query_stats.reset(token)
+        self.assertEqual(stats.count, 2)
+        self.assertGreater(stats.duration, 0)
+        self.assertEqual(stats.statements["SELECT 1"], 1)
+
+    def test_no_stats_outside_request(self):
+        with self.engine.connect() as connection:
+            connection.execute(text("SELECT 1"))
+        self.assertIsNone(query_stats.get())
+
+    def test_failed_statement_is_not_counted(self):
+        stats = QueryStats()
+        token = query_stats.set(stats)
+        try:
+            with self.engine.connect() as connection:
+                with self.assertRaises(Exception):
+                    connection.execute(text("SELECT * FROM missing"))
+                connection.execute(text("SELECT 1"))
+        finally:
+            query_stats.reset(token)
+        self.assertEqual(stats.count, 1)
+
+
+class TestServerTimingMiddleware(unittest.TestCase):
+
+    def setUp(self):
+        engine = create_engine("sqlite://")
+        app = FastAPI()
+
+        @app.get("/contacts")
+        def contacts(n: int):
+            with engine.connect() as connection:
+                for i in range(n):
+                    connection.execute(text("SELECT :i"), {"i": i})
+            return {}
+
+        app.add_middleware(ServerTimingMiddleware)
+        self.client = TestClient(app)
+
+    def test_server_timing_header(self):
+        response = self.client.get("/contacts", params={"n": 3})
+        self.assertEqual(response.status_code, 200)
+        timing = response.headers["server-timing"]
+        self.assertIn('desc="3 queries"', timing)
+        self.assertIn("db-pool;dur=", timing)
+        self.assertIn("app;dur=", timing)
+
+    def test_repeated_statement_warning(self):
+        with self.assertLogs("src.database.instrumentation", level=logging.WARNING) as logs:
+            self.client.get("/contacts", params={"n": 6})
+        self.assertIn("possible N+1: GET /contacts ran the same statement 6 times", logs.output[0])
+
+
+if __name__ == '__main__':
+    unittest.main()
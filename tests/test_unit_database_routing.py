@@ -0,0 +1,141 @@
+import os
+import tempfile
+import unittest
+from types import SimpleNamespace
+from unittest.mock import AsyncMock, patch
+
+from sqlalchemy import insert, select, update
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from starlette.requests import Request
+
+from src.database.db import ReplicaSet, RoutingAsyncSession, get_db, identify
+from src.database.models import Base, Contact, User
+from src.routes.contacts import read_contacts, update_contact
+
+
+class TestReadReplicaRouting(unittest.IsolatedAsyncioTestCase):
+
+    async def asyncSetUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        # same schema and contact id, the firstname tells which database answered
+        self.primary = await self.database("primary")
+        self.replica = await self.database("replica")
+        self.replicas = ReplicaSet([self.replica], check_interval=1, read_your_writes=60, local_size=100)
+        self.sessions = async_sessionmaker(bind=self.primary, class_=RoutingAsyncSession, replicas=self.replicas,
+                                           expire_on_commit=False)
+
+    async def asyncTearDown(self):
+        for engine in (self.primary, *self.replicas.engines):
+            await engine.dispose()
+
+    async def database(self, name, directory=None):
+        engine = create_async_engine(f"sqlite+aiosqlite:///{os.path.join(directory or self.directory.name, name)}.db")
+        if directory is None:
+            async with engine.begin() as connection:
+                await connection.run_sync(Base.metadata.create_all)
+                await connection.execute(insert(User).values(id=1, email="owner@mail.ua", password="secret"))
+                await connection.execute(insert(Contact).values(id=1, firstname=name, lastname="test",
+                                                                email="contact@mail.ua", phone="1", user_id=1))
+        return engine
+
+    async def read(self, read_only=True, identity=None):
+        async with self.sessions() as db:
+            if read_only:
+                db.info["read_only"] = True
+            if identity is not None:
+                await identify(db, identity)
+            return await db.scalar(select(Contact.firstname).where(Contact.id == 1))
+
+    async def write(self, identity):
+        async with self.sessions() as db:
+            await identify(db, identity)
+            await db.execute(update(Contact).where(Contact.id == 1).values(lastname="updated"))
+            await db.commit()
+
+    async def test_read_only_sessions_use_the_replica(self):
+        self.assertEqual(await self.read(read_only=False), "primary")
+        self.assertEqual(await self.read(), "replica")
+
+    async def test_writes_stay_on_the_primary(self):
+        async with self.sessions() as db:
+            db.info["read_only"] = True
+            await db.execute(update(Contact).where(Contact.id == 1).values(lastname="updated"))
+            self.assertEqual(await db.scalar(select(Contact.lastname).where(Contact.id == 1)), "updated")
+            await db.commit()
+        self.assertEqual(await self.read(read_only=False), "primary")
+
+    async def test_read_your_writes(self):
+        await self.write("owner@mail.ua")
+        self.assertEqual(await self.read(identity="owner@mail.ua"), "primary")
+        self.assertEqual(await self.read(identity="other@mail.ua"), "replica")
+        self.replicas.read_your_writes = 0
+        await self.write("other@mail.ua")
+        self.assertEqual(await self.read(identity="other@mail.ua"), "replica")
+
+    async def test_no_replicas_no_redis_calls(self):
+        redis = AsyncMock()
+        self.sessions.configure(replicas=ReplicaSet([], check_interval=1, read_your_writes=60, local_size=100))
+        with patch("src.database.redis_db.redis_client", redis):
+            await self.write("owner@mail.ua")
+            self.assertEqual(await self.read(identity="owner@mail.ua"), "primary")
+        self.assertEqual(redis.mock_calls, [])
+
+    async def test_failover_to_the_primary(self):
+        missing = await self.database("replica", directory=os.path.join(self.directory.name, "missing"))
+        self.replicas = ReplicaSet([self.replica, missing], check_interval=1, read_your_writes=60, local_size=100)
+        self.sessions.configure(replicas=self.replicas)
+        await self.replicas.check()
+        self.assertEqual(self.replicas.healthy, [self.replica])
+        self.assertEqual({await self.read() for _ in range(4)}, {"replica"})
+
+        self.replicas.healthy = [missing]
+        with self.assertRaises(OperationalError):
+            await self.read()
+        # the failed replica was dropped without waiting for the next check
+        self.assertEqual(self.replicas.healthy, [])
+        self.assertEqual(await self.read(), "primary")
+
+    async def test_read_only_sessions_release_the_connection(self):
+        async with self.sessions() as db:
+            db.info["read_only"] = True
+            user = await db.scalar(select(User).where(User.id == 1))
+            self.assertFalse(db.in_transaction())
+            self.assertEqual(self.primary.pool.checkedout(), 0)
+            # committed, not expired
+            self.assertEqual(user.email, "owner@mail.ua")
+            await db.execute(select(Contact.id))
+            self.assertEqual(self.primary.pool.checkedout(), 0)
+
+    async def test_writes_keep_the_connection_until_commit(self):
+        async with self.sessions() as db:
+            # a read may be followed by a write
+            await db.execute(select(Contact.id))
+            self.assertEqual(self.primary.pool.checkedout(), 1)
+            await db.commit()
+        async with self.sessions() as db:
+            db.info["read_only"] = True
+            await db.execute(update(Contact).where(Contact.id == 1).values(lastname="updated"))
+            await db.execute(select(Contact.id))
+            self.assertTrue(db.in_transaction())
+            self.assertEqual(self.primary.pool.checkedout(), 1)
+            await db.commit()
+            self.assertEqual(self.primary.pool.checkedout(), 0)
+        async with self.sessions() as db:
+            db.info["read_only"] = True
+            async with db.begin():
+                await db.execute(select(Contact.id))
+                self.assertTrue(db.in_transaction())
+
+    async def test_get_db_marks_read_only_routes(self):
+        for endpoint, expected in ((read_contacts, True), (update_contact, False)):
+            request = Request({"type": "http", "route": SimpleNamespace(endpoint=endpoint)})
+            dependency = get_db(request)
+            db = await dependency.__anext__()
+            self.assertEqual(db.info.get("read_only", False), expected)
+            await dependency.aclose()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,17 +1,23 @@
 from datetime import datetime, date, timedelta
 import unittest
-from unittest.mock import MagicMock
+from types import SimpleNamespace
+from unittest.mock import MagicMock, AsyncMock, patch
 
-from sqlalchemy.orm import Session
+from sqlalchemy.dialects.postgresql import asyncpg
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+from sqlalchemy.pool import StaticPool
 
-from src.database.models import Contact, User
-from src.schemas import ContactModel, ContactResponse
+from src.database.models import Base, Contact, User
+from src.schemas import ContactModel, ContactResponse, ContactUpdate, ContactBatch
 from src.repository.contacts import (
     get_contacts,
     get_contact,
     create_contact,
     remove_contact,
     update_contact,
+    batch_contacts,
+    search_contacts,
+    search_terms,
     querys_contacts,
     birthdays,
 )
@@ -20,23 +26,27 @@ from src.repository.contacts import (
 class TestContacts(unittest.IsolatedAsyncioTestCase):
 
     def setUp(self):
-        self.session = MagicMock(spec=Session)
+        self.session = AsyncMock(spec=AsyncSession)
         self.user = User(id=1)
 
     async def test_get_contacts(self):
         contacts = [Contact(), Contact(), Contact()]
-        self.session.query().filter().offset().limit().all.return_value = contacts
+        self.session.execute.return_value = MagicMock(all=MagicMock(return_value=contacts))
         result = await get_contacts(skip=0, limit=10, user=self.user, db=self.session)
         self.assertEqual(result, contacts)
+        statement = self.session.execute.await_args.args[0]
+        self.assertEqual([column.name for column in statement.selected_columns], list(ContactResponse.__fields__))
 
     async def test_get_contact_found(self):
         contact = Contact()
-        self.session.query().filter().first.return_value = contact
+        self.session.execute.return_value = MagicMock(first=MagicMock(return_value=contact))
         result = await get_contact(contact_id=1, user=self.user, db=self.session)
         self.assertEqual(result, contact)
+        statement = self.session.execute.await_args.args[0]
+        self.assertEqual([column.name for column in statement.selected_columns], list(ContactResponse.__fields__))
 
     async def test_get_contact_not_found(self):
-        self.session.query().filter().first.return_value = None
+        self.session.execute.return_value = MagicMock(first=MagicMock(return_value=None))
         result = await get_contact(contact_id=1, user=self.user, db=self.session)
         self.assertIsNone(result)
 
@@ -44,6 +54,8 @@ class TestContacts(unittest.IsolatedAsyncioTestCase):
         bd = datetime(year=2000, month=1, day=1)
         body = ContactModel(firstname="testfn", lastname="testln", email="tester@mail.ua", phone="1234567890",
                             birthday=bd, description="testd")
+        # the row INSERT ... RETURNING would give back
+        self.session.scalar.side_effect = lambda statement: Contact(id=1, **statement.compile().params)
         result = await create_contact(body=body, user=self.user, db=self.session)
         self.assertEqual(result.firstname, body.firstname)
         self.assertEqual(result.lastname, body.lastname)
@@ -52,15 +64,17 @@ class TestContacts(unittest.IsolatedAsyncioTestCase):
         self.assertEqual(result.birthday, body.birthday)
         self.assertEqual(result.description, body.description)
         self.assertTrue(hasattr(result, "id"))
+        self.assertEqual(result.user_id, self.user.id)
+        self.session.refresh.assert_not_awaited()
 
     async def test_remove_contact_found(self):
         contact = Contact()
-        self.session.query().filter().first.return_value = contact
+        self.session.scalar.return_value = contact
         result = await remove_contact(contact_id=1, user=self.user, db=self.session)
         self.assertEqual(result, contact)
 
     async def test_remove_contact_not_found(self):
-        self.session.query().filter().first.return_value = None
+        self.session.scalar.return_value = None
         result = await remove_contact(contact_id=1, user=self.user, db=self.session)
         self.assertIsNone(result)
 
@@ -69,32 +83,282 @@ class TestContacts(unittest.IsolatedAsyncioTestCase):
         body = ContactModel(firstname="testfn", lastname="testln", email="tester@mail.ua", phone="1234567890",
                             birthday=bd, description="testd", done=True)
         contact = Contact()
-        self.session.query().filter().first.return_value = contact
-        self.session.commit.return_value = None
+        self.session.scalar.return_value = contact
         result = await update_contact(contact_id=1, body=body, user=self.user, db=self.session)
         self.assertEqual(result, contact)
+        self.session.scalar.assert_awaited_once()
+        self.session.refresh.assert_not_awaited()
+
+    async def test_update_contact_partial(self):
+        contact = Contact()
+        self.session.scalar.return_value = contact
+        result = await update_contact(contact_id=1, body=ContactUpdate(phone="0987654321"), user=self.user,
+                                      db=self.session)
+        self.assertEqual(result, contact)
+        statement = self.session.scalar.await_args.args[0]
+        self.assertEqual(statement.compile().params["phone"], "0987654321")
+        self.assertNotIn("firstname", statement.compile().params)
+
+    async def test_update_contact_empty(self):
+        contact = Contact()
+        self.session.execute.return_value = MagicMock(first=MagicMock(return_value=contact))
+        result = await update_contact(contact_id=1, body=ContactUpdate(), user=self.user, db=self.session)
+        self.assertEqual(result, contact)
+        self.session.commit.assert_not_awaited()
 
     async def test_update_contact_not_found(self):
         bd = datetime(year=2000, month=1, day=1)
         body = ContactModel(firstname="testfn", lastname="testln", email="tester@mail.ua", phone="1234567890",
                              birthday=bd, description="testd")
-        self.session.query().filter().first.return_value = None
-        self.session.commit.return_value = None
+        self.session.scalar.return_value = None
         result = await update_contact(contact_id=1, body=body, user=self.user, db=self.session)
         self.assertIsNone(result)
 
+    async def test_querys_contacts(self):
+        contacts = [Contact(), Contact()]
+        self.session.execute.return_value = MagicMock(all=MagicMock(return_value=contacts))
+        result = await querys_contacts(firstname="test", lastname=None, email="", user=self.user, db=self.session)
+        self.assertEqual(result, contacts)
+        self.session.execute.assert_awaited_once()
+
+    async def test_querys_contacts_inlines_patterns(self):
+        self.session.execute.return_value = MagicMock(all=MagicMock(return_value=[]))
+        await querys_contacts(firstname="Te_st", lastname=None, email="50%/", user=self.user, db=self.session)
+        statement = self.session.execute.await_args.args[0]
+        sql = str(statement.compile(dialect=asyncpg.dialect(), compile_kwargs={"render_postcompile": True}))
+        self.assertIn("lower(contacts.firstname) LIKE 'te/_st%' ESCAPE '/'", sql)
+        self.assertIn("lower(contacts.email) LIKE '50/%//%' ESCAPE '/'", sql)
+
+    async def test_querys_contacts_no_filters(self):
+        result = await querys_contacts(firstname="", lastname=None, email="", user=self.user, db=self.session)
+        self.assertEqual(result, [])
+        self.session.execute.assert_not_awaited()
+
+
+class TestBirthdays(unittest.IsolatedAsyncioTestCase):
+
+    async def asyncSetUp(self):
+        self.engine = create_async_engine("sqlite+aiosqlite://", poolclass=StaticPool)
+        async with self.engine.begin() as connection:
+            await connection.run_sync(Base.metadata.create_all)
+        self.session = AsyncSession(self.engine, expire_on_commit=False)
+        self.user = User(id=1, email="owner@mail.ua", password="secret")
+        self.session.add(self.user)
+        await self.session.commit()
+
+    async def asyncTearDown(self):
+        await self.session.close()
+        await self.engine.dispose()
+
+    async def add_contacts(self, *birthdays):
+        contacts = [Contact(firstname=f'Contact {i}', lastname='test', email=f'contact{i}@mail.ua', phone=str(i),
+                            birthday=birthday, user_id=self.user.id) for i, birthday in enumerate(birthdays)]
+        self.session.add_all(contacts)
+        await self.session.commit()
+        return contacts
+
     async def test_birthdays(self):
-        contact1 = Contact(id=1, firstname='Contact 1', birthday=date.today() + timedelta(days=1), user_id=self.user.id)
-        contact2 = Contact(id=2, firstname='Contact 2', birthday=date.today() + timedelta(days=3), user_id=self.user.id)
-        contact3 = Contact(id=3, firstname='Contact 3', birthday=date.today() + timedelta(days=6), user_id=self.user.id)
-        contact4 = Contact(id=4, firstname='Contact 4', birthday=date.today() + timedelta(days=10), user_id=self.user.id)
-        self.session.query().filter().all.return_value = [contact1, contact2, contact3, contact4]
-        result = await birthdays(self.user, self.session)
+        today = datetime.combine(date.today(), datetime.min.time())
+        contact1, contact2, contact3, contact4 = await self.add_contacts(
+            today + timedelta(days=1), today + timedelta(days=3), today + timedelta(days=6), today + timedelta(days=10))
+        result = [contact.id for contact in await birthdays(self.user, self.session)]
         self.assertEqual(len(result), 3)
-        self.assertIn(contact1, result)
-        self.assertIn(contact2, result)
-        self.assertIn(contact3, result)
-        self.assertNotIn(contact4, result)
+        self.assertIn(contact1.id, result)
+        self.assertIn(contact2.id, result)
+        self.assertIn(contact3.id, result)
+        self.assertNotIn(contact4.id, result)
+
+    async def test_birthdays_window_length(self):
+        today, last_day, outside = await self.add_contacts(
+            datetime(1990, 3, 10), datetime(1990, 3, 16), datetime(1990, 3, 17))
+        result = await birthdays(self.user, self.session, days=7, today=date(2023, 3, 10))
+        self.assertEqual([contact.id for contact in result], [today.id, last_day.id])
+        result = await birthdays(self.user, self.session, days=1, today=date(2023, 3, 10))
+        self.assertEqual([contact.id for contact in result], [today.id])
+
+    async def test_birthdays_year_wrap(self):
+        jan_2, dec_30, jan_10, dec_27 = await self.add_contacts(
+            datetime(1990, 1, 2), datetime(1985, 12, 30), datetime(1980, 1, 10), datetime(1999, 12, 27))
+        result = await birthdays(self.user, self.session, days=7, today=date(2023, 12, 28))
+        self.assertEqual([contact.id for contact in result], [dec_30.id, jan_2.id])
+
+    async def test_birthdays_feb_29_and_missing_birthday(self):
+        leap, missing = await self.add_contacts(datetime(2000, 2, 29), None)
+        result = await birthdays(self.user, self.session, days=2, today=date(2023, 2, 28))
+        self.assertEqual([contact.id for contact in result], [leap.id])
+
+    async def test_birthdays_whole_year(self):
+        contacts = await self.add_contacts(datetime(1990, 3, 1), datetime(1990, 2, 1), datetime(1990, 6, 1))
+        result = await birthdays(self.user, self.session, days=365, today=date(2023, 2, 15))
+        self.assertEqual([contact.id for contact in result], [contacts[0].id, contacts[2].id, contacts[1].id])
+
+    async def test_reads_return_rows(self):
+        contact, = await self.add_contacts(datetime(1990, 3, 1))
+        self.session.expunge_all()
+        page = await get_contacts(0, 10, self.user, self.session)
+        single = await get_contact(contact.id, self.user, self.session)
+        self.assertEqual(page, [single])
+        self.assertEqual(single._fields, tuple(ContactResponse.__fields__))
+        self.assertEqual(ContactResponse.from_orm(single).email, contact.email)
+        # nothing was loaded into the session
+        self.assertEqual(len(self.session.identity_map), 0)
+
+
+
+class TestBatchContacts(unittest.IsolatedAsyncioTestCase):
+    asyncSetUp = TestBirthdays.asyncSetUp
+    asyncTearDown = TestBirthdays.asyncTearDown
+    add_contacts = TestBirthdays.add_contacts
+
+    async def test_batch_contacts(self):
+        first, second, third = await self.add_contacts(datetime(1990, 1, 2), None, None)
+        batch = ContactBatch(operations=[
+            {"op": "update", "id": first.id, "data": {"phone": "0501234567"}},
+            {"op": "delete", "id": third.id},
+            {"op": "update", "id": second.id, "data": {"firstname": "Renamed", "birthday": "1985-12-30T00:00:00"}},
+            {"op": "delete", "id": 100},
+            {"op": "update", "id": 101, "data": {"phone": "1"}},
+        ])
+        updated_first, deleted, updated_second, missing_delete, missing_update = \
+            await batch_contacts(batch.operations, self.user, self.session)
+        self.assertEqual((updated_first.phone, updated_first.firstname, updated_first.birthday),
+                         ("0501234567", "Contact 0", datetime(1990, 1, 2)))
+        self.assertEqual((updated_second.firstname, updated_second.phone, updated_second.birthday),
+                         ("Renamed", "1", datetime(1985, 12, 30)))
+        self.assertEqual(deleted.id, third.id)
+        self.assertIsNone(missing_delete)
+        self.assertIsNone(missing_update)
+        self.assertIsNone(await get_contact(third.id, self.user, self.session))
+
+    async def test_batch_contacts_other_user(self):
+        contact, = await self.add_contacts(None)
+        other = User(id=2, email="other@mail.ua", password="secret")
+        batch = ContactBatch(operations=[{"op": "delete", "id": contact.id}])
+        self.assertEqual(await batch_contacts(batch.operations, other, self.session), [None])
+        self.assertIsNotNone(await get_contact(contact.id, self.user, self.session))
+
+
+
+class TestSearchContacts(unittest.IsolatedAsyncioTestCase):
+    asyncSetUp = TestBirthdays.asyncSetUp
+    asyncTearDown = TestBirthdays.asyncTearDown
+
+    async def add_contact(self, firstname, lastname, email, phone=None, description=''):
+        contact = Contact(firstname=firstname, lastname=lastname, email=email, phone=phone, description=description,
+                          user_id=self.user.id)
+        self.session.add(contact)
+        await self.session.commit()
+        return contact
+
+    async def search(self, q, **kwargs):
+        contacts, more, truncated = await search_contacts(q, self.user, self.session, **kwargs)
+        self.assertFalse(truncated)
+        return [contact.firstname for contact in contacts]
+
+    def test_search_terms(self):
+        self.assertEqual(search_terms("Wade  WILSON!"), ["wade", "wilson"])
+        self.assertEqual(search_terms("+38 (050) 123-45-67"), ["380501234567"])
+        self.assertEqual(search_terms("--"), [])
+
+    async def test_ranked_prefix_match(self):
+        await self.add_contact("Peter", "Parker", "spidey@dailybugle.com", description="Photographer, knows Wade")
+        await self.add_contact("Wade", "Wilson", "wade.w@example.com", description="Merc with a mouth")
+        await self.add_contact("Wanda", "Maximoff", "wanda@avengers.org")
+        self.assertEqual(await self.search("wade"), ["Wade", "Peter"])
+        self.assertEqual(await self.search("wanda max"), ["Wanda"])
+        # only the last word is a prefix
+        self.assertEqual(await self.search("wa max"), [])
+        self.assertEqual(await self.search("example"), ["Wade"])
+        self.assertEqual(await self.search("photo"), ["Peter"])
+        self.assertEqual(await self.search("nobody"), [])
+        self.assertEqual(await self.search("?!"), [])
+
+    async def test_phone(self):
+        await self.add_contact("Wade", "Wilson", "wade@example.com", phone="+38 (050) 123-45-67")
+        self.assertEqual(await self.search("380501234567"), ["Wade"])
+        self.assertEqual(await self.search("+38 050"), ["Wade"])
+
+    async def test_paging(self):
+        for i in range(5):
+            await self.add_contact(f"Page{i}", "Test", f"page{i}@example.com")
+        self.assertEqual(await self.search("test", limit=2, offset=2), ["Page2", "Page3"])
+        self.assertEqual((await search_contacts("test", self.user, self.session, limit=2, offset=2))[1], True)
+        self.assertEqual((await search_contacts("test", self.user, self.session, limit=1, offset=4))[1], False)
+
+    async def test_index_follows_updates_and_deletes(self):
+        contact = await self.add_contact("Peter", "Parker", "spidey@dailybugle.com")
+        await update_contact(contact.id, ContactUpdate(firstname="Miles"), self.user, self.session)
+        self.assertEqual(await self.search("peter"), [])
+        self.assertEqual(await self.search("miles"), ["Miles"])
+        await remove_contact(contact.id, self.user, self.session)
+        self.assertEqual(await self.search("miles"), [])
+
+    async def test_other_user(self):
+        await self.add_contact("Wade", "Wilson", "wade@example.com")
+        other = User(id=2, email="other@mail.ua", password="secret")
+        self.assertEqual(await search_contacts("wade", other, self.session), ([], False, False))
+
+
+class TestSearchContactsCap(unittest.IsolatedAsyncioTestCase):
+    """
+    The Postgres branch against a session that serves the ranked candidates from a list,
+    as many as the statement's OFFSET and LIMIT ask for.
+    """
+
+    def setUp(self):
+        self.user = User(id=1)
+        self.session = AsyncMock(spec=AsyncSession)
+        self.session.get_bind = MagicMock()
+        self.session.get_bind.return_value.dialect.name = 'postgresql'
+        self.session.execute.side_effect = self.execute
+        self.limits = []
+        patcher = patch.multiple("src.repository.contacts.settings", contact_search_max_matches=5,
+                                 contact_search_trigram=False)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def match(self, found):
+        # the candidates subquery stops at max_matches + 1
+        found = min(found, 6)
+        self.rows = [SimpleNamespace(firstname=f"Contact{i}", candidates=found) for i in range(found)]
+        self.session.scalar.return_value = found
+
+    async def execute(self, stmt):
+        self.limits.append(stmt._limit)
+        return MagicMock(all=MagicMock(return_value=self.rows[stmt._offset:stmt._offset + stmt._limit]))
+
+    async def pages(self, limit):
+        offset, pages = 0, []
+        while True:
+            contacts, more, truncated = await search_contacts("wilson", self.user, self.session, limit, offset)
+            pages.append(([contact.firstname for contact in contacts], truncated))
+            if not more:
+                return pages
+            offset += limit
+
+    async def test_pages_stop_at_the_cap(self):
+        self.match(10)
+        self.assertEqual(await self.pages(limit=2), [
+            (["Contact0", "Contact1"], True), (["Contact2", "Contact3"], True), (["Contact4"], True)])
+        self.assertEqual(self.limits, [3, 3, 1])
+
+    async def test_last_page_ends_on_the_cap(self):
+        self.match(10)
+        self.assertEqual(await self.pages(limit=5), [(["Contact0", "Contact1", "Contact2", "Contact3", "Contact4"],
+                                                     True)])
+
+    async def test_all_matches_ranked(self):
+        self.match(5)
+        self.assertEqual(await self.pages(limit=5), [(["Contact0", "Contact1", "Contact2", "Contact3", "Contact4"],
+                                                     False)])
+        self.match(0)
+        self.assertEqual(await self.pages(limit=5), [([], False)])
+        self.session.scalar.assert_not_awaited()
+
+    async def test_past_the_cap(self):
+        self.match(10)
+        self.assertEqual(await search_contacts("wilson", self.user, self.session, 5, 5), ([], False, True))
+        self.session.scalar.assert_awaited_once()
 
 
 if __name__ == '__main__':
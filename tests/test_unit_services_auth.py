@@ -0,0 +1,53 @@
+import asyncio
+import unittest
+from unittest.mock import patch
+
+from fastapi import HTTPException
+from jose import JWTError, jwt
+
+from src.services.auth import Auth
+
+
+class TestTokenCache(unittest.TestCase):
+
+    def setUp(self):
+        self.auth = Auth()
+        self.auth.flush_token_cache()
+
+    def tearDown(self):
+        self.auth.flush_token_cache()
+
+    def test_repeat_decode_skips_jwt(self):
+        token = asyncio.run(self.auth.create_access_token(data={"sub": "test@example.com"}))
+        with patch("src.services.auth.jwt.decode", wraps=jwt.decode) as decode:
+            first = self.auth.decode_access_token(token)
+            second = self.auth.decode_access_token(token)
+        self.assertEqual(decode.call_count, 1)
+        self.assertEqual(first, second)
+        self.assertEqual(first["sub"], "test@example.com")
+
+    def test_expired_token_is_not_cached(self):
+        token = asyncio.run(self.auth.create_access_token(data={"sub": "test@example.com"}, expires_delta=-1))
+        with self.assertRaises(JWTError):
+            self.auth.decode_access_token(token)
+        self.assertEqual(len(self.auth.token_cache), 0)
+
+    def test_scope_checked_for_cached_token(self):
+        token = asyncio.run(self.auth.create_refresh_token(data={"sub": "test@example.com"}))
+        self.auth.decode_access_token(token)
+        with self.assertRaises(HTTPException) as error:
+            asyncio.run(self.auth.get_current_user(token=token, db=None))
+        self.assertEqual(error.exception.status_code, 401)
+
+    def test_flush_after_key_rotation(self):
+        token = asyncio.run(self.auth.create_access_token(data={"sub": "test@example.com"}))
+        self.auth.decode_access_token(token)
+        with patch.object(Auth, "SECRET_KEY", "rotated"):
+            self.assertEqual(self.auth.decode_access_token(token)["sub"], "test@example.com")
+            self.auth.flush_token_cache()
+            with self.assertRaises(JWTError):
+                self.auth.decode_access_token(token)
+
+
+if __name__ == '__main__':
+    unittest.main()
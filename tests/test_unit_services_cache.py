@@ -0,0 +1,84 @@
+import json
+import time
+import unittest
+from datetime import datetime
+from unittest.mock import AsyncMock, patch
+
+from redis.exceptions import ConnectionError
+
+from src.database.models import User
+from src.services.cache import LRUCache, UserCache
+
+
+class TestLRUCache(unittest.TestCase):
+
+    def test_evicts_least_recently_used(self):
+        cache = LRUCache(maxsize=2)
+        expires_at = time.monotonic() + 60
+        cache.set("a", 1, expires_at)
+        cache.set("b", 2, expires_at)
+        cache.get("a")
+        cache.set("c", 3, expires_at)
+        self.assertEqual(cache.get("a"), 1)
+        self.assertIsNone(cache.get("b"))
+        self.assertEqual(cache.get("c"), 3)
+
+    def test_expired_entry(self):
+        cache = LRUCache(maxsize=2)
+        cache.set("a", 1, time.monotonic() - 1)
+        self.assertIsNone(cache.get("a"))
+        self.assertEqual(len(cache), 0)
+
+
+class TestUserCache(unittest.IsolatedAsyncioTestCase):
+
+    def setUp(self):
+        self.redis = AsyncMock()
+        patcher = patch("src.database.redis_db.redis_client", self.redis)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.cache = UserCache(ttl=60, local_ttl=5, local_maxsize=16)
+        self.user = User(id=1, username="deadpool", email="deadpool@example.com", password="hash",
+                         created_at=datetime(2023, 5, 1, 12, 0), avatar="url", confirmed=True)
+
+    async def test_miss(self):
+        self.redis.get.return_value = None
+        self.assertIsNone(await self.cache.get(self.user.email))
+        self.assertEqual(self.cache.misses, 1)
+
+    async def test_set_then_local_hit(self):
+        await self.cache.set(self.user)
+        stored = json.loads(self.redis.set.await_args.args[1])
+        self.assertNotIn("password", stored)
+        self.assertEqual(self.redis.set.await_args.kwargs["ex"], 60)
+
+        result = await self.cache.get(self.user.email)
+        self.assertEqual(result.id, self.user.id)
+        self.assertEqual(result.created_at, self.user.created_at)
+        self.assertEqual(self.cache.local_hits, 1)
+        self.redis.get.assert_not_awaited()
+
+    async def test_redis_hit(self):
+        self.redis.get.return_value = json.dumps({"id": 1, "username": "deadpool", "email": self.user.email,
+                                                  "created_at": None, "avatar": None, "confirmed": True})
+        result = await self.cache.get(self.user.email)
+        self.assertEqual(result.username, "deadpool")
+        self.assertEqual(self.cache.redis_hits, 1)
+        await self.cache.get(self.user.email)
+        self.assertEqual(self.cache.local_hits, 1)
+
+    async def test_invalidate(self):
+        await self.cache.set(self.user)
+        await self.cache.invalidate(self.user.email)
+        self.redis.delete.assert_awaited_once_with("user:deadpool@example.com")
+        self.redis.get.return_value = None
+        self.assertIsNone(await self.cache.get(self.user.email))
+
+    async def test_redis_down_is_a_miss(self):
+        self.redis.get.side_effect = ConnectionError()
+        self.assertIsNone(await self.cache.get(self.user.email))
+        self.assertEqual(self.cache.misses, 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
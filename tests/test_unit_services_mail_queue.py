@@ -0,0 +1,126 @@
+import socket
+from email import message_from_bytes, policy
+import unittest
+from unittest.mock import patch
+
+from aiosmtpd.controller import Controller
+from fakeredis import aioredis
+
+from src.services.auth import auth_service
+from src.services.mail_queue import MailWorker, enqueue_email
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+class Handler:
+    def __init__(self):
+        self.messages = []
+        self.reject = []
+
+    async def handle_DATA(self, server, session, envelope):
+        if self.reject:
+            return self.reject.pop(0)
+        self.messages.append(envelope)
+        return "250 OK"
+
+
+class TestMailQueue(unittest.IsolatedAsyncioTestCase):
+
+    def setUp(self):
+        self.handler = Handler()
+        self.controller = Controller(self.handler, hostname="127.0.0.1", port=free_port())
+        self.controller.start()
+        self.addCleanup(self.controller.stop)
+        self.redis = aioredis.FakeRedis(decode_responses=True)
+        patcher = patch("src.database.redis_db.redis_client", self.redis)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    async def asyncSetUp(self):
+        self.worker = MailWorker(self.redis, hostname="127.0.0.1", port=self.controller.port, use_tls=False,
+                                 username=None, password=None, consumer="test")
+        self.worker.interval = 0
+        await self.worker.setup()
+
+    async def asyncTearDown(self):
+        await self.worker.close()
+
+    async def test_sends_batch_over_one_connection(self):
+        for i in range(3):
+            self.assertTrue(await enqueue_email(f"user{i}@example.com", f"user{i}", "http://testserver/"))
+        with patch.object(self.worker.smtp, "connect", wraps=self.worker.smtp.connect) as connect:
+            self.assertEqual(await self.worker.run_once(), 3)
+        connect.assert_awaited_once()
+        self.assertEqual([m.rcpt_tos for m in self.handler.messages],
+                         [["user0@example.com"], ["user1@example.com"], ["user2@example.com"]])
+        self.assertEqual(await self.redis.xlen(self.worker.stream), 0)
+
+        body = message_from_bytes(self.handler.messages[0].content, policy=policy.default).get_content()
+        token = body.split("http://testserver/api/auth/confirmed_email/")[1].split('"')[0]
+        self.assertEqual(auth_service.get_email_from_token(token), "user0@example.com")
+
+    async def test_temporary_failure_is_retried(self):
+        self.handler.reject.append("451 try again later")
+        await enqueue_email("retry@example.com", "retry", "http://testserver/")
+        await self.worker.run_once()
+        self.assertEqual(self.handler.messages, [])
+        self.assertEqual(await self.redis.zcard(self.worker.retry_key), 1)
+
+        with patch("src.services.mail_queue.time.time", return_value=10 ** 10):
+            await self.worker.requeue_due()
+        await self.worker.run_once()
+        self.assertEqual([m.rcpt_tos for m in self.handler.messages], [["retry@example.com"]])
+        self.assertEqual(await self.redis.zcard(self.worker.retry_key), 0)
+
+    async def test_permanent_failure_goes_to_dead_letters(self):
+        self.handler.reject.append("550 no such user")
+        await enqueue_email("nobody@example.com", "nobody", "http://testserver/")
+        await self.worker.run_once()
+        dead = await self.redis.xrange(self.worker.dead_stream)
+        self.assertEqual(dead[0][1]["email"], "nobody@example.com")
+        self.assertEqual(await self.redis.zcard(self.worker.retry_key), 0)
+
+    async def test_unexpected_error_is_retried_then_dead_lettered(self):
+        await enqueue_email("broken@example.com", "broken", "http://testserver/")
+        with patch("src.services.mail_queue.settings.mail_max_attempts", 2), \
+                patch("src.services.mail_queue.build_message", side_effect=ValueError("bad template")), \
+                self.assertLogs("src.services.mail_queue", "ERROR"):
+            self.assertEqual(await self.worker.run_once(), 1)
+            self.assertEqual(await self.redis.zcard(self.worker.retry_key), 1)
+            # requeued and failing again, out of attempts
+            with patch("src.services.mail_queue.time.time", return_value=10 ** 10):
+                self.assertEqual(await self.worker.run_once(), 1)
+        dead = await self.redis.xrange(self.worker.dead_stream)
+        self.assertEqual((dead[0][1]["email"], dead[0][1]["attempts"], dead[0][1]["error"]),
+                         ("broken@example.com", "2", "bad template"))
+        self.assertEqual(await self.redis.xlen(self.worker.stream), 0)
+
+    async def test_requeue_moves_each_job_once(self):
+        self.handler.reject.append("451 try again later")
+        await enqueue_email("retry@example.com", "retry", "http://testserver/")
+        await self.worker.run_once()
+        other = MailWorker(self.redis, consumer="other")
+        with patch("src.services.mail_queue.time.time", return_value=10 ** 10):
+            await self.worker.requeue_due()
+            await other.requeue_due()
+        jobs = await self.redis.xrange(self.worker.stream)
+        self.assertEqual([(job["email"], job["attempts"]) for _, job in jobs], [("retry@example.com", "1")])
+        self.assertEqual(await self.redis.zcard(self.worker.retry_key), 0)
+
+    async def test_unacknowledged_jobs_are_resent_after_restart(self):
+        await enqueue_email("crash@example.com", "crash", "http://testserver/")
+        await self.redis.xreadgroup("mailers", "test", {self.worker.stream: ">"})
+        await self.worker.run_once()
+        self.assertEqual([m.rcpt_tos for m in self.handler.messages], [["crash@example.com"]])
+
+    async def test_enqueue_without_redis(self):
+        with patch("src.database.redis_db.redis_client", None):
+            self.assertFalse(await enqueue_email("user@example.com", "user", "http://testserver/"))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,66 @@
+import unittest
+from unittest.mock import AsyncMock
+
+from fastapi import BackgroundTasks
+
+from src.services.metrics import Counter, Gauge, Histogram, Registry, add_task, background_tasks
+
+
+class TestMetrics(unittest.TestCase):
+
+    def test_histogram(self):
+        histogram = Histogram("latency_seconds", "Latency", ("route",), buckets=(0.1, 1.0))
+        for value in (0.05, 0.1, 0.5, 2.0):
+            histogram.observe(value, "/a")
+        histogram.observe(0.2, '/b"\n')
+        lines = histogram.render()
+        self.assertEqual(lines[:8], [
+            "# HELP latency_seconds Latency",
+            "# TYPE latency_seconds histogram",
+            'latency_seconds_bucket{route="/a",le="0.1"} 2',
+            'latency_seconds_bucket{route="/a",le="1.0"} 3',
+            'latency_seconds_bucket{route="/a",le="+Inf"} 4',
+            'latency_seconds_sum{route="/a"} 2.65',
+            'latency_seconds_count{route="/a"} 4',
+            'latency_seconds_bucket{route="/b\\"\\n",le="0.1"} 0',
+        ])
+
+    def test_counter_and_gauge(self):
+        registry = Registry()
+        counter = registry.register(Counter("rejected_total", "Rejected"))
+        gauge = registry.register(Gauge("in_flight", "In flight", ("method",)))
+        counter.inc()
+        counter.inc(amount=2)
+        gauge.inc("GET")
+        gauge.inc("GET")
+        gauge.dec("GET")
+        gauge.set("POST", value=5)
+        self.assertEqual(registry.render(), "\n".join([
+            "# HELP rejected_total Rejected",
+            "# TYPE rejected_total counter",
+            "rejected_total 3",
+            "# HELP in_flight In flight",
+            "# TYPE in_flight gauge",
+            'in_flight{method="GET"} 1',
+            'in_flight{method="POST"} 5',
+        ]) + "\n")
+
+
+class TestBackgroundTasks(unittest.IsolatedAsyncioTestCase):
+
+    async def test_add_task(self):
+        async def deliver(email):
+            self.assertEqual(background_tasks.values[("deliver",)], 1)
+            await send(email)
+
+        send = AsyncMock()
+        tasks = BackgroundTasks()
+        add_task(tasks, deliver, "user@mail.ua")
+        self.assertEqual(background_tasks.values[("deliver",)], 1)
+        await tasks()
+        send.assert_awaited_once_with("user@mail.ua")
+        self.assertEqual(background_tasks.values[("deliver",)], 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
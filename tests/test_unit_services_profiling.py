@@ -0,0 +1,122 @@
+import asyncio
+import json
+import os
+import tempfile
+import time
+import unittest
+from unittest.mock import patch
+
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import create_async_engine
+
+from src.services.profiling import Profiler, ProfilingMiddleware, sign, verify
+
+
+def busy(seconds):
+    until = time.perf_counter() + seconds
+    while time.perf_counter() < until:
+        pass
+
+
+class TestProfiler(unittest.IsolatedAsyncioTestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        self.profiler = Profiler(self.directory.name, interval=0.001, max_files=2)
+
+    async def profile(self, work, name="GET /api/contacts/"):
+        profile = self.profiler.start(name)
+        started = time.perf_counter()
+        await work()
+        elapsed = (time.perf_counter() - started) * 1000
+        await self.profiler.finish(profile)
+        return profile, elapsed
+
+    async def test_samples_are_categorized(self):
+        engine = create_async_engine("sqlite+aiosqlite://")
+        self.addAsyncCleanup(engine.dispose)
+
+        async def work():
+            busy(0.05)
+            async with engine.connect() as connection:
+                await connection.execute(text("SELECT 1"))
+                for _ in range(200):
+                    await connection.execute(text("WITH RECURSIVE n(i) AS (SELECT 1 UNION ALL SELECT i + 1 FROM n "
+                                                  "WHERE i < 1000) SELECT sum(i) FROM n"))
+
+        profile, elapsed = await self.profile(work)
+        categories = dict(profile.summary())
+        self.assertGreater(categories["app"], 20)
+        self.assertGreater(categories["db"], 0)
+        # wall-clock: the samples cover the whole request, waits included
+        self.assertAlmostEqual(sum(profile.weights), elapsed, delta=elapsed * 0.2)
+
+    async def test_speedscope_file(self):
+        async def work():
+            busy(0.02)
+
+        profile, _ = await self.profile(work)
+        self.assertEqual(self.profiler.list(), [profile.filename])
+        with open(self.profiler.path(profile.filename)) as file:
+            data = json.load(file)
+        frames = [frame["name"] for frame in data["shared"]["frames"]]
+        self.assertIn("busy", frames)
+        sampled = data["profiles"][0]
+        self.assertEqual(sampled["type"], "sampled")
+        self.assertEqual(len(sampled["samples"]), len(sampled["weights"]))
+        for sample in sampled["samples"]:
+            # the category is the root frame of every sample
+            self.assertTrue(frames[sample[0]].startswith("["))
+            self.assertTrue(all(0 <= index < len(frames) for index in sample))
+
+    async def test_no_samples_after_finish(self):
+        async def work():
+            busy(0.02)
+
+        profile, _ = await self.profile(work)
+        samples = len(profile.samples)
+        # the sampler keeps running for another request
+        other = self.profiler.start("GET /other")
+        await asyncio.sleep(0.02)
+        await self.profiler.finish(other)
+        self.assertGreater(len(other.samples), 0)
+        self.assertEqual(len(profile.samples), samples)
+
+    async def test_old_profiles_are_removed(self):
+        async def work():
+            busy(0.02)
+
+        names = []
+        for i in range(3):
+            profile, _ = await self.profile(work, name=f"GET /{i}")
+            names.append(profile.filename)
+        self.assertEqual(set(self.profiler.list()), set(names[1:]))
+
+    async def test_path(self):
+        self.assertIsNone(self.profiler.path("../secret.speedscope.json"))
+        self.assertIsNone(self.profiler.path("missing.speedscope.json"))
+        open(os.path.join(self.directory.name, "a.json"), "w").close()
+        self.assertIsNone(self.profiler.path("a.json"))
+
+
+class TestProfilingTrigger(unittest.TestCase):
+
+    def test_signed_header(self):
+        value = sign(int(time.time()) + 60)
+        self.assertTrue(verify(value))
+        self.assertFalse(verify(sign(int(time.time()) - 1)))
+        self.assertFalse(verify(value[:-1] + ("0" if value[-1] != "0" else "1")))
+        self.assertFalse(verify("garbage"))
+
+    def test_wanted(self):
+        scope = {"headers": [(b"x-profile", sign(int(time.time()) + 60).encode())]}
+        self.assertTrue(ProfilingMiddleware.wanted(scope))
+        self.assertFalse(ProfilingMiddleware.wanted({"headers": [(b"x-profile", b"1.abc")]}))
+        self.assertFalse(ProfilingMiddleware.wanted({"headers": []}))
+        with patch("src.services.profiling.settings.profile_sample_rate", 1.0):
+            self.assertTrue(ProfilingMiddleware.wanted({"headers": []}))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,113 @@
+import unittest
+from unittest.mock import AsyncMock, patch
+
+from fakeredis import aioredis
+from fastapi import HTTPException
+from redis.exceptions import ConnectionError
+
+from src.conf.config import settings
+from src.database.models import User
+from src.services.metrics import redis_duration
+from src.services.rate_limit import RateLimit, RateLimiter, parse_rule
+
+
+class TestRateLimiter(unittest.IsolatedAsyncioTestCase):
+
+    def setUp(self):
+        self.redis = aioredis.FakeRedis(decode_responses=True)
+        patcher = patch("src.database.redis_db.redis_client", self.redis)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.rules = {"burst": "100/60", "slow": "2/60"}
+
+    def limiter(self):
+        return RateLimiter(self.rules, lease=0.1, lease_ttl=60, local_size=100)
+
+    async def acquire_all(self, limiter, name, count, identity=1):
+        return [await limiter.acquire(name, identity) for _ in range(count)]
+
+    def test_parse_rule(self):
+        self.assertEqual(parse_rule("10/60"), (10, 10 / 60))
+
+    async def test_leases_batch_redis_calls(self):
+        limiter = self.limiter()
+        with patch.object(self.redis, "evalsha", wraps=self.redis.evalsha) as evalsha:
+            results = await self.acquire_all(limiter, "burst", 100)
+        self.assertEqual(results, [0.0] * 100)
+        # ten leases of ten tokens; the first EVALSHA fails with NOSCRIPT and is repeated after loading the script
+        self.assertEqual(evalsha.call_count, 11)
+
+    async def test_redis_latency_is_observed(self):
+        observed = sum(redis_duration.series.get(("rate_limit",), [0])[:-1])
+        await self.acquire_all(self.limiter(), "burst", 20)
+        # one script call per lease
+        self.assertEqual(sum(redis_duration.series[("rate_limit",)][:-1]), observed + 2)
+
+    async def test_refused_locally_until_next_token(self):
+        limiter = self.limiter()
+        self.assertEqual(await self.acquire_all(limiter, "slow", 2), [0.0, 0.0])
+        with patch.object(self.redis, "evalsha", wraps=self.redis.evalsha) as evalsha:
+            refused = await self.acquire_all(limiter, "slow", 5)
+        self.assertTrue(all(25 < retry_after <= 30 for retry_after in refused), refused)
+        self.assertEqual(evalsha.call_count, 1)
+
+    async def test_redis_calls_with_a_shipped_rule(self):
+        # contacts:list is 10/60: leases are a single token, the reduction comes from refusing locally
+        self.rules = {"list": settings.rate_limits["contacts:list"]}
+        limiter = self.limiter()
+        with patch.object(self.redis, "evalsha", wraps=self.redis.evalsha) as evalsha:
+            results = await self.acquire_all(limiter, "list", 200)
+        self.assertEqual(results.count(0.0), 10)
+        # ten admitted, then one call to learn that the bucket is empty; the script is loaded by the first call
+        self.assertEqual(evalsha.call_count, 12)
+
+    async def test_workers_share_the_limit(self):
+        workers = [self.limiter() for _ in range(4)]
+        allowed = 0
+        for _ in range(60):
+            for worker in workers:
+                allowed += await worker.acquire("burst", 1) == 0
+        self.assertEqual(allowed, 100)
+
+    async def test_limits_are_per_identity(self):
+        limiter = self.limiter()
+        await self.acquire_all(limiter, "slow", 2, identity=1)
+        self.assertGreater(await limiter.acquire("slow", 1), 0)
+        self.assertEqual(await limiter.acquire("slow", 2), 0)
+
+    async def test_local_bucket_without_redis(self):
+        limiter = self.limiter()
+        with patch("src.database.redis_db.redis_client", None):
+            results = await self.acquire_all(limiter, "slow", 3)
+        self.assertEqual(results[:2], [0.0, 0.0])
+        self.assertTrue(25 < results[2] <= 30, results)
+
+    async def test_local_bucket_on_redis_error(self):
+        limiter = self.limiter()
+        with patch.object(self.redis, "evalsha", AsyncMock(side_effect=ConnectionError)):
+            results = await self.acquire_all(limiter, "slow", 3)
+        self.assertEqual(results[:2], [0.0, 0.0])
+        self.assertGreater(results[2], 0)
+
+
+class TestRateLimit(unittest.IsolatedAsyncioTestCase):
+
+    async def test_too_many_requests(self):
+        with patch("src.services.rate_limit.rate_limiter.acquire", AsyncMock(return_value=12.3)) as acquire:
+            with self.assertRaises(HTTPException) as error:
+                await RateLimit("contacts:create")(current_user=User(id=7))
+        acquire.assert_awaited_once_with("contacts:create", 7)
+        self.assertEqual(error.exception.status_code, 429)
+        self.assertEqual(error.exception.headers["Retry-After"], "13")
+
+    async def test_allowed(self):
+        with patch("src.services.rate_limit.rate_limiter.acquire", AsyncMock(return_value=0.0)):
+            self.assertIsNone(await RateLimit("contacts:create")(current_user=User(id=7)))
+
+    def test_unknown_rule(self):
+        with self.assertRaises(KeyError):
+            RateLimit("contacts:unknown")
+
+
+if __name__ == '__main__':
+    unittest.main()
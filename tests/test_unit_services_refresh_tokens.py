@@ -0,0 +1,68 @@
+import unittest
+from unittest.mock import patch
+
+from fakeredis import aioredis
+from fastapi import HTTPException
+from redis.exceptions import ConnectionError
+
+from src.services.refresh_tokens import RefreshTokenStore
+
+
+class TestRefreshTokenStore(unittest.IsolatedAsyncioTestCase):
+
+    def setUp(self):
+        self.redis = aioredis.FakeRedis(decode_responses=True)
+        patcher = patch("src.database.redis_db.redis_client", self.redis)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.store = RefreshTokenStore(ttl=60, local_size=100)
+
+    async def check_rotation(self):
+        family, first = await self.store.start()
+        second = await self.store.rotate(family, first)
+        self.assertIsNotNone(second)
+        third = await self.store.rotate(family, second)
+        self.assertNotIn(third, (None, first, second))
+        # the spent token is refused and the whole family with it
+        self.assertIsNone(await self.store.rotate(family, first))
+        self.assertIsNone(await self.store.rotate(family, third))
+
+    async def test_rotation(self):
+        await self.check_rotation()
+        family, token_id = await self.store.start()
+        self.assertEqual(await self.redis.get(self.store.token_key(token_id)), "0")
+        self.assertGreater(await self.redis.ttl(self.store.family_key(family)), 0)
+
+    async def test_rotation_without_redis(self):
+        with patch("src.database.redis_db.redis_client", None):
+            await self.check_rotation()
+
+    async def test_families_are_independent(self):
+        family, token_id = await self.store.start()
+        other_family, other_token_id = await self.store.start()
+        await self.store.rotate(family, token_id)
+        await self.store.rotate(family, token_id)
+        self.assertIsNotNone(await self.store.rotate(other_family, other_token_id))
+
+    async def test_unknown_and_mismatched_tokens(self):
+        family, token_id = await self.store.start()
+        self.assertIsNone(await self.store.rotate(family, "unknown"))
+        self.assertIsNone(await self.store.rotate("unknown", token_id))
+        self.assertIsNone(await self.store.rotate(None, None))
+
+    async def test_expired_tokens(self):
+        store = RefreshTokenStore(ttl=0, local_size=100)
+        with patch("src.database.redis_db.redis_client", None):
+            family, token_id = await store.start()
+            self.assertIsNone(await store.rotate(family, token_id))
+
+    async def test_redis_failure_refuses(self):
+        with patch.object(self.redis, "evalsha", side_effect=ConnectionError("down")):
+            family, token_id = await self.store.start()
+            with self.assertRaises(HTTPException) as error:
+                await self.store.rotate(family, token_id)
+        self.assertEqual(error.exception.status_code, 503)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,67 @@
+import json
+import unittest
+from unittest.mock import AsyncMock, patch
+
+from fakeredis import aioredis
+from fastapi import Request
+from redis.exceptions import ConnectionError
+
+from src.services.response_cache import ResponseCache
+
+
+def make_request(path="/api/contacts/", query=b"limit=10", etag=None):
+    headers = [(b"if-none-match", etag.encode())] if etag else []
+    return Request({"type": "http", "method": "GET", "path": path, "query_string": query, "headers": headers})
+
+
+class TestResponseCache(unittest.IsolatedAsyncioTestCase):
+
+    def setUp(self):
+        self.redis = aioredis.FakeRedis(decode_responses=True)
+        patcher = patch("src.database.redis_db.redis_client", self.redis)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.cache = ResponseCache(ttl=60)
+        self.build = AsyncMock(return_value=[1, 2, 3])
+
+    async def test_cached_until_bump(self):
+        first = await self.cache.respond(make_request(), 1, self.build)
+        second = await self.cache.respond(make_request(), 1, self.build)
+        self.assertEqual(json.loads(second.body), [1, 2, 3])
+        self.assertEqual(first.headers["etag"], second.headers["etag"])
+        self.build.assert_awaited_once()
+
+        await self.cache.bump(1)
+        third = await self.cache.respond(make_request(), 1, self.build)
+        self.assertNotEqual(third.headers["etag"], first.headers["etag"])
+        self.assertEqual(self.build.await_count, 2)
+
+    async def test_not_modified_skips_build(self):
+        etag = (await self.cache.respond(make_request(), 1, self.build)).headers["etag"]
+        self.build.reset_mock()
+        response = await self.cache.respond(make_request(etag=f'"other", {etag}'), 1, self.build)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.headers["etag"], etag)
+        self.build.assert_not_awaited()
+
+    async def test_key_depends_on_user_and_query(self):
+        etag = (await self.cache.respond(make_request(), 1, self.build)).headers["etag"]
+        other_user = await self.cache.respond(make_request(etag=etag), 2, self.build)
+        other_query = await self.cache.respond(make_request(query=b"limit=20", etag=etag), 1, self.build)
+        self.assertEqual(other_user.status_code, 200)
+        self.assertEqual(other_query.status_code, 200)
+        self.assertEqual(self.build.await_count, 3)
+
+    async def test_bump_before_first_read(self):
+        await self.cache.bump(1)
+        self.assertGreater(int(await self.cache.version(1)), 1)
+
+    async def test_redis_down_is_uncached(self):
+        with patch.object(self.redis, "get", side_effect=ConnectionError()):
+            result = await self.cache.respond(make_request(), 1, self.build)
+        self.assertEqual(json.loads(result.body), [1, 2, 3])
+        self.assertNotIn("etag", result.headers)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,32 @@
+import json
+import unittest
+from datetime import datetime
+
+from fastapi.encoders import jsonable_encoder
+
+from src.database.models import Contact
+from src.schemas import ContactResponse
+from src.services.serialization import contact_dict, contact_dicts, dumps
+
+
+def make_contact(i, birthday=datetime(1990, 5, 17)):
+    return Contact(id=i, firstname=f"First{i}", lastname="Last", email=f"contact{i}@example.com", phone=f"+380{i:09}",
+                   birthday=birthday, description="Ünïcode \"quoted\"", created_at=datetime(2023, 1, 2, 3, 4, 5, 6789),
+                   updated_at=datetime(2023, 1, 2, 3, 4, 5), user_id=1)
+
+
+class TestSerialization(unittest.TestCase):
+
+    def test_contact_dict_matches_validated_response(self):
+        for contact in (make_contact(1), make_contact(2, birthday=None)):
+            expected = jsonable_encoder(ContactResponse.from_orm(contact))
+            self.assertEqual(json.loads(dumps(contact_dict(contact))), expected)
+
+    def test_contact_dicts(self):
+        contacts = [make_contact(i) for i in range(3)]
+        self.assertEqual(contact_dicts(contacts), [contact_dict(contact) for contact in contacts])
+        self.assertNotIn("user_id", contact_dicts(contacts)[0])
+
+
+if __name__ == '__main__':
+    unittest.main()